@@ -0,0 +1,46 @@
+"""
+	bench_import_time.py
+	Import time of a geospacepy module, from python -X importtime in fresh
+	interpreters. Reports the median cumulative import time over several
+	runs, the slowest imports it pulls in, and which heavy modules
+	(matplotlib, scipy, spacepy, ...) were imported.
+
+		python benchmarks/bench_import_time.py [--module geospacepy.omnireader] [--runs 7]
+"""
+import argparse, os, subprocess, sys
+import numpy as np
+
+heavy_modules = ['matplotlib','scipy','spacepy','ftplib','ephem','geospacepy.omnitxtcdf',
+					'multiprocessing.shared_memory','concurrent.futures']
+
+def importtime(module):
+	"""(self us,cumulative us,module name) of each import, and the heavy modules imported"""
+	code = 'import sys,%s; print(",".join(m for m in %r if m in sys.modules))' % (module,heavy_modules)
+	env = dict(os.environ,PYTHONPATH=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+	result = subprocess.run([sys.executable,'-X','importtime','-c',code],capture_output=True,text=True,env=env,check=True)
+	rows = []
+	for line in result.stderr.splitlines():
+		if not line.startswith('import time:') or 'self [us]' in line:
+			continue
+		self_us,cumulative_us,name = line[len('import time:'):].split('|')
+		rows.append((int(self_us),int(cumulative_us),name.rstrip()))
+	return rows,[m for m in result.stdout.strip().split(',') if m]
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Import time of a module (python -X importtime)')
+	parser.add_argument('--module',default='geospacepy.omnireader')
+	parser.add_argument('--runs',type=int,default=7)
+	parser.add_argument('--top',type=int,default=10,help='number of slowest imports to list')
+	args = parser.parse_args()
+	totals = []
+	for i in range(args.runs):
+		rows,loaded = importtime(args.module)
+		totals.append(sum(row[0] for row in rows))
+	print('%s: median total import time %.1f ms over %d runs (min %.1f ms)' % (args.module,np.median(totals)/1e3,
+																			args.runs,np.min(totals)/1e3))
+	print('Heavy modules imported: %s' % (', '.join(loaded) if loaded else 'none'))
+	print('Slowest imports (cumulative ms) made directly by %s in the last run:' % (args.module))
+	#Names are indented two spaces per level below the module
+	direct = [row for row in rows if len(row[2])-len(row[2].lstrip()) <= 3]
+	for self_us,cumulative_us,name in sorted(direct,key=lambda row: row[1],reverse=True)[:args.top]:
+		print('%10.1f  %s' % (cumulative_us/1e3,name.strip()))
@@ -0,0 +1,63 @@
+"""
+	bench_omni_memory.py
+	Memory used by a year of 1 minute OMNI data read with omni_interval
+	in float64 and in float32 (the dtype option). Reads the variables
+	and derived variables below and reports the bytes held by the arrays
+	and the peak traced allocation (tracemalloc, which numpy reports to)
+	for each dtype.
+
+		python benchmarks/bench_omni_memory.py [--year 2006] [--synthetic]
+
+	Uses the configured OMNI mirror (downloading what is missing), or with
+	--synthetic a year of synthetic CDFs (see geospacepy/test/omnisynthetic.py)
+	written to a temporary directory (needs spacepy).
+"""
+import argparse, datetime, gc, os, sys, tempfile, time, tracemalloc
+import numpy as np
+
+#Run from any directory: geospacepy from this checkout, and the synthetic
+#CDF writer from its tests
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..')
+sys.path.insert(0,os.path.join(repo_root,'geospacepy','test'))
+sys.path.insert(0,repo_root)
+
+variables = ['BX_GSE','BY_GSM','BZ_GSM','flow_speed','proton_density','Mach_num','Mgs_mach_num','SYM_H','AL_INDEX']
+derived = ['pdyn','shue_r0','epsilon','newell']
+
+def measure(year,dtype):
+	from geospacepy import omnireader
+	gc.collect()
+	tracemalloc.start()
+	t0 = time.time()
+	oi = omnireader.omni_interval(datetime.datetime(year,1,1),datetime.datetime(year+1,1,1),'1min',
+									silent=True,dtype=dtype)
+	arrays = {var:oi.get_float(var) for var in variables}
+	arrays.update({var:oi[var] for var in derived})
+	elapsed = time.time()-t0
+	held = sum(arr.nbytes for arr in arrays.values())
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	oi.close()
+	return len(arrays['BZ_GSM']),held,peak,elapsed
+
+def write_synthetic_year(localdir,year):
+	from omnisynthetic import write_synthetic_omni_cdf
+	for month in range(1,13):
+		write_synthetic_omni_cdf(localdir,datetime.datetime(year,month,1),'1min')
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Memory of a year of 1 minute OMNI data in float64 and float32')
+	parser.add_argument('--year',type=int,default=2006)
+	parser.add_argument('--synthetic',action='store_true',help='use synthetic CDFs in a temporary directory')
+	args = parser.parse_args()
+	from geospacepy import omnireader
+	if args.synthetic:
+		tmpdir = tempfile.TemporaryDirectory()
+		omnireader.localdir = tmpdir.name
+		write_synthetic_year(tmpdir.name,args.year)
+	#Read once so downloads are not measured
+	measure(args.year,None)
+	print('%-8s %10s %14s %14s %8s' % ('dtype','samples','arrays (MB)','peak (MB)','time (s)'))
+	for dtype in [np.float64,np.float32]:
+		n,held,peak,elapsed = measure(args.year,dtype)
+		print('%-8s %10d %14.1f %14.1f %8.2f' % (np.dtype(dtype).name,n,held/1e6,peak/1e6,elapsed))
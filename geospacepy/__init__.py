@@ -3,6 +3,20 @@ Geospacepy init file
 """
 #import yaml,pkg_resources
 #config_file_as_str = pkg_resources.resource_string(__name__,'geospacepy_config')
+import importlib
 
-from geospacepy import geospacepy_config
-config = geospacepy_config.config
+#Submodules (and config) are imported on first access, e.g. geospacepy.omnireader,
+#so using one module doesn't import the others and their dependencies
+_submodules = ['astrodynamics2','geospacepy_config','lmk_utils','omniavail','omnievents',
+				'omnifill','omnimapreduce','omnipropagate','omnireader','omnirollup',
+				'omniserver','omnitxtcdf','omnixcorr','satplottools','special_datetime']
+
+def __getattr__(name):
+	if name == 'config':
+		return importlib.import_module('geospacepy.geospacepy_config').config
+	elif name in _submodules:
+		return importlib.import_module('geospacepy.'+name)
+	raise AttributeError("module 'geospacepy' has no attribute '%s'" % (name))
+
+def __dir__():
+	return sorted(list(globals().keys())+_submodules+['config'])
@@ -4,9 +4,9 @@ Author - Liam Kilcommons
 """
 from numpy import *
 import numpy as np
-import matplotlib.pyplot as pp
 import itertools, datetime
-import ephem # Pyephem celestial ephemerides
+#matplotlib and ephem (Pyephem celestial ephemerides) are imported
+#by the functions which use them
 
 G = 6.67e-11 #N m^2/s^2
 m_earth = 5.9742e24 #kg
@@ -88,6 +88,7 @@ def orbitPlotter(ecc,p=nan,a=nan,inputUnits='earth radii',step=.01,planetaryRadi
 	planet_x = planetaryRadius*cos(nu)
 	planet_y = planetaryRadius*sin(nu)
 
+	import matplotlib.pyplot as pp
 	fig = pp.figure()
 	ax = pp.axes(aspect='equal')
 	ax.plot(x,y,'b-')
@@ -618,6 +619,7 @@ def hour_angle(dt, lons, hours=False):
 	# @input lon(float, degrees, negative west of Greenwich)
 	# @output hour angle, in degrees (float)
 
+	import ephem
 	sun = ephem.Sun()
 	o = ephem.Observer()
 	o.lat,o.lon,o.date = 0.,0.,dt
@@ -766,6 +768,7 @@ def solar_zenith_angle_broken(dt,lats,lons,degrees=True):
 		slt is the solar local time in hours
 
 	"""
+	import ephem
 	obs = ephem.Observer()
 	obs.lat,obs.lon = 0.,0.
 	#obs.elev = -1*6371.2*1000. # Center of the earth
@@ -793,6 +796,7 @@ def solar_zenith_angle_broken(dt,lats,lons,degrees=True):
 
 def terminator(dt,lat_space=1):
 	"""Find the longitude of the terminator latitudes lat_space apart with fixed time dt"""
+	import ephem
 	sun = ephem.Sun()
 	sun.compute(dt)
 	#Compute subsolar latitude and longitude
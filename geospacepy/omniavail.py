@@ -0,0 +1,155 @@
+"""
+	omniavail.py
+	Data availability of OMNI variables. For every file in the local
+	mirror a bit-packed bitmap of which records of each variable are
+	valid (present, finite and not fill) is saved next to the file
+	(by omni_availability when it first needs them, or by omni_downloader
+	when it opens a file if its build_bitmaps option is set). Coverage
+	and data gap queries for any windows are then answered from the
+	bitmaps, at one bit per record, without reading the data.
+"""
+import os, datetime, tempfile
+import numpy as np
+from geospacepy import omnireader, omnievents, special_datetime
+
+def bitmap_path(localfn):
+	"""Path of the validity bitmaps of the OMNI file localfn"""
+	return localfn+'.valid.npz'
+
+def _unixtime(dt):
+	return special_datetime.datetimearr2unixtime(np.atleast_1d(dt)).flatten()
+
+def write_validity_bitmaps(localfn,cdf,file_span,cadence):
+	"""
+	Save the validity bitmaps of every variable in an open OMNI file
+	(a pycdf.CDF or omni_txt_cdf_mimic). Bit i is record i of a regular
+	grid at the cadence over the file's time span (file_span, a (start,end)
+	tuple of datetimes), so missing records are invalid too. The file is
+	written to a temporary file and renamed into place, so readers never
+	see a partial file; if it can't be written (e.g. a read-only mirror)
+	a message is printed. Returns the bitmaps as a dict like the saved npz
+	"""
+	step = omnireader.cadence_minutes[cadence]*60.
+	file_start,file_end = _unixtime(file_span)
+	nrecords = int(round((file_end-file_start)/step))
+	t = _unixtime(cdf['Epoch'][:])
+	irecord = np.round((t-file_start)/step).astype(np.int64)
+	in_file = np.logical_and(irecord>=0,irecord<nrecords)
+	bitmaps = dict()
+	for var in cdf.keys():
+		if var == 'Epoch':
+			continue
+		try:
+			data = np.asarray(cdf[var][:],dtype=float)
+		except (TypeError,ValueError):
+			continue
+		if data.shape != t.shape:
+			continue
+		valid = np.isfinite(data)
+		if 'FILLVAL' in cdf[var].attrs:
+			with np.errstate(invalid='ignore'):
+				valid = np.logical_and(valid,data!=float(cdf[var].attrs['FILLVAL']))
+		record_valid = np.zeros((nrecords,),dtype=bool)
+		record_valid[irecord[in_file]] = valid[in_file]
+		bitmaps[var] = np.packbits(record_valid)
+	bitmaps.update(file_start=file_start,step=step,nrecords=nrecords,varnames=np.array(sorted(bitmaps.keys())))
+	fn = bitmap_path(localfn)
+	tmpfn = None
+	try:
+		fd,tmpfn = tempfile.mkstemp(dir=os.path.dirname(fn),prefix=os.path.basename(fn),suffix='.tmp')
+		with os.fdopen(fd,'wb') as f:
+			np.savez(f,**bitmaps)
+		os.replace(tmpfn,fn)
+	except OSError as e:
+		print("Could not save validity bitmaps %s: %s" % (fn,str(e)))
+		if tmpfn is not None and os.path.exists(tmpfn):
+			os.remove(tmpfn)
+	return bitmaps
+
+class omni_availability(object):
+	def __init__(self,cadence,cdf_or_txt='cdf'):
+		"""
+		Coverage and gap queries for OMNI variables at a cadence,
+		answered from the validity bitmaps of the local mirror.
+		Files not yet in the mirror are downloaded, and bitmaps not yet
+		saved are made, on first use.
+		"""
+		self.cadence = cadence
+		self.dwnldr = omnireader.omni_downloader(cdf_or_txt=cdf_or_txt)
+		self.step = omnireader.cadence_minutes[cadence]*60.
+		self.bitmaps = dict()
+
+	def _file_bitmaps(self,file_startdt):
+		if file_startdt not in self.bitmaps:
+			localfn = self.dwnldr.local_path(file_startdt,self.cadence)
+			if os.path.exists(bitmap_path(localfn)):
+				with np.load(bitmap_path(localfn)) as npz:
+					self.bitmaps[file_startdt] = {key:npz[key] for key in npz.files}
+			else:
+				cdf = self.dwnldr.get_cdf(file_startdt,self.cadence)
+				self.bitmaps[file_startdt] = write_validity_bitmaps(localfn,cdf,
+					self.dwnldr.file_span(file_startdt,self.cadence),self.cadence)
+				cdf.close()
+		return self.bitmaps[file_startdt]
+
+	def valid(self,var,startdt,enddt):
+		"""
+		Times (seconds since 1970) of the records between startdt and
+		enddt and whether var is valid in each, unpacked from the bitmaps
+		"""
+		#Nothing (rather than an error) if there are no files in the range
+		t,valid = [np.zeros((0,))],[np.zeros((0,),dtype=bool)]
+		t0,t1 = _unixtime([startdt,enddt])
+		for file_startdt,file_enddt in self.dwnldr.file_spans(startdt,enddt,self.cadence):
+			bitmaps = self._file_bitmaps(file_startdt)
+			nrecords = int(bitmaps['nrecords'])
+			if var not in bitmaps:
+				raise KeyError('No variable %s in %s OMNI files' % (var,self.cadence))
+			file_t = bitmaps['file_start']+np.arange(nrecords)*self.step
+			i0,i1 = np.searchsorted(file_t,[t0,t1],side='left')
+			t.append(file_t[i0:i1])
+			valid.append(np.unpackbits(bitmaps[var],count=nrecords)[i0:i1].astype(bool))
+		return np.concatenate(t),np.concatenate(valid)
+
+	def coverage(self,var,startdts,enddts):
+		"""
+		Fraction of the records between startdts and enddts for which
+		var is valid. startdts,enddts can be datetimes or lists/arrays of
+		windows; each file is read once for all the windows. Windows with
+		no records (empty or inverted) have zero coverage
+		"""
+		scalar = isinstance(startdts,datetime.datetime)
+		t0,t1 = _unixtime(startdts),_unixtime(enddts)
+		if len(t0) == 0:
+			return np.zeros((0,))
+		t,valid = self.valid(var,special_datetime.unixtime2datetime(np.min(t0)),
+								special_datetime.unixtime2datetime(np.max(t1)))
+		nvalid = np.concatenate([[0],np.cumsum(valid)])
+		i0,i1 = np.searchsorted(t,t0,side='left'),np.searchsorted(t,t1,side='left')
+		with np.errstate(invalid='ignore',divide='ignore'):
+			fraction = np.where(i1>i0,(nvalid[i1]-nvalid[i0])/(i1-i0).astype(float),0.)
+		return fraction[0] if scalar else fraction
+
+	def gaps(self,var,startdt,enddt,min_gap_mins=0.):
+		"""
+		(start,end) datetimes of the runs of missing or invalid var
+		between startdt and enddt at least min_gap_mins long
+		"""
+		t,valid = self.valid(var,startdt,enddt)
+		i_starts,i_ends = omnievents.find_runs(~valid)
+		gap_starts,gap_ends = t[i_starts],t[i_ends-1]+self.step
+		long_enough = gap_ends-gap_starts >= min_gap_mins*60.
+		return list(zip(special_datetime.unixtime2datetime(gap_starts[long_enough]),
+						special_datetime.unixtime2datetime(gap_ends[long_enough])))
+
+	def longest_gap(self,var,startdt,enddt):
+		"""
+		(start,end,minutes) of the longest run of missing or invalid var
+		between startdt and enddt, (None,None,0.) if there are no gaps
+		"""
+		gaps = self.gaps(var,startdt,enddt)
+		if len(gaps) == 0:
+			return None,None,0.
+		lengths = [(gap_end-gap_start).total_seconds()/60. for gap_start,gap_end in gaps]
+		ilongest = int(np.argmax(lengths))
+		return gaps[ilongest][0],gaps[ilongest][1],lengths[ilongest]
@@ -0,0 +1,356 @@
+"""
+	omnievents.py
+	Find events in the OMNI archive: every interval where a condition on
+	OMNI variables holds (e.g. 'BZ_GSM < -10' for at least 3 hours), read
+	file by file so decades can be searched without loading them at once.
+	The resulting event lists can be passed straight to omnireader.omni_sea
+"""
+import datetime, ast, functools
+import numpy as np
+from geospacepy import omnireader, special_datetime
+
+def iter_omni_chunks(startdt,enddt,cadence,varnames,lookback_mins=0.,cdf_or_txt='cdf'):
+	"""
+	Read OMNI variables between startdt and enddt one file at a time.
+
+	Yields (t,data,nlookback): t is seconds since 1970, data a dict of
+	float arrays (fill values are NaN). Each chunk but the first starts with
+	the last lookback_mins of the previous chunk, so calculations which need
+	earlier data can run across file boundaries; these nlookback samples
+	belong to the previous chunk.
+	"""
+	dwnldr = omnireader.omni_downloader(cdf_or_txt=cdf_or_txt)
+	tail_t,tail_data = np.zeros((0,)),{var:np.zeros((0,)) for var in varnames}
+	for file_startdt,file_enddt in dwnldr.file_spans(startdt,enddt,cadence):
+		oi = omnireader.omni_interval(max(startdt,file_startdt),min(enddt,file_enddt),cadence,
+										silent=True,cdf_or_txt=cdf_or_txt)
+		t = special_datetime.datetimearr2unixtime(oi['Epoch']).flatten()
+		data = {var:oi.get_float(var) for var in varnames}
+		oi.close()
+		nlookback = len(tail_t)
+		t = np.concatenate([tail_t,t])
+		data = {var:np.concatenate([tail_data[var],data[var]]) for var in varnames}
+		yield t,data,nlookback
+		if lookback_mins > 0. and len(t) > 0:
+			keep = t >= t[-1]-lookback_mins*60.
+			tail_t,tail_data = t[keep],{var:data[var][keep] for var in varnames}
+
+def find_runs(mask):
+	"""
+	Run-length encode a boolean array, returning the start and end
+	(exclusive) indices of each run of True values
+	"""
+	edges = np.diff(np.concatenate([[0],np.asarray(mask,dtype=np.int8).flatten(),[0]]))
+	return np.flatnonzero(edges==1),np.flatnonzero(edges==-1)
+
+def merge_runs(starts,ends,max_gap):
+	"""
+	Group time sorted runs [starts,ends) whose gap to the previous run is
+	at most max_gap. Returns the index of the group of each run
+	"""
+	starts,ends = np.asarray(starts,dtype=float),np.asarray(ends,dtype=float)
+	if len(starts) == 0:
+		return np.zeros((0,),dtype=int)
+	#A run may end after the next starts only if they overlap, use the latest end so far
+	prev_end = np.maximum.accumulate(ends)[:-1]
+	new_group = np.concatenate([[True],starts[1:]-prev_end > max_gap])
+	return np.cumsum(new_group)-1
+
+class omni_event_list(object):
+	def __init__(self,starts,ends,name=None,**columns):
+		"""
+		A list of events, each with a start and end (seconds since 1970)
+		and optionally other per-event columns (e.g. amplitude, kind)
+		"""
+		self.name = name
+		self.starts = np.asarray(starts,dtype=float).flatten()
+		self.ends = np.asarray(ends,dtype=float).flatten()
+		self.columns = {col:np.asarray(columns[col]) for col in columns}
+
+	def __len__(self):
+		return len(self.starts)
+
+	def __getitem__(self,key):
+		if key in ['starts','ends']:
+			return special_datetime.unixtime2datetime(getattr(self,key))
+		elif key == 'durations_mins':
+			return (self.ends-self.starts)/60.
+		return self.columns[key]
+
+	def select(self,mask,name=None):
+		"""A new event list with only the events where mask is True"""
+		mask = np.asarray(mask,dtype=bool)
+		return omni_event_list(self.starts[mask],self.ends[mask],name=name if name is not None else self.name,
+								**{col:self.columns[col][mask] for col in self.columns})
+
+	def center_ymdhm_list(self,center='start'):
+		"""
+		[year,month,day,hour,minute] of each event (minute can be fractional),
+		the format of omnireader.omni_sea's center_ymdhm_list.
+		center - 'start','end' or 'middle' of the events
+		"""
+		if center == 'start':
+			t = self.starts
+		elif center == 'end':
+			t = self.ends
+		elif center == 'middle':
+			t = (self.starts+self.ends)/2.
+		else:
+			raise ValueError('Invalid center %s, valid values are "start","end" and "middle"' % (center))
+		ymdhm = []
+		for dt in special_datetime.unixtime2datetime(t):
+			ymdhm.append([dt.year,dt.month,dt.day,dt.hour,dt.minute+(dt.second+dt.microsecond/1.0e6)/60.])
+		return ymdhm
+
+	def omni_sea(self,center='start',**kwargs):
+		"""Superposed epoch analysis of these events (kwargs go to omnireader.omni_sea)"""
+		if 'name' not in kwargs:
+			kwargs['name'] = self.name
+		return omnireader.omni_sea(self.center_ymdhm_list(center=center),**kwargs)
+
+def _condition_functions(t):
+	"""Functions usable in string conditions, for samples at times t"""
+	def change(y,mins):
+		"""y minus its value mins minutes earlier (NaN where that is missing)"""
+		t_before = t-mins*60.
+		i = np.clip(np.searchsorted(t,t_before),0,len(t)-1)
+		return np.where(t[i]==t_before,y-y[i],np.nan)
+	def window_min(y,mins):
+		"""Minimum of y in the mins minutes up to and including each time"""
+		return _window_reduce(np.fmin,t,y,mins)
+	def window_max(y,mins):
+		"""Maximum of y in the mins minutes up to and including each time"""
+		return _window_reduce(np.fmax,t,y,mins)
+	return {'change':change,'window_min':window_min,'window_max':window_max,'abs':np.abs}
+
+def _window_reduce(fcn,t,y,mins):
+	"""
+	Reduce y with a NaN ignoring binary ufunc (np.fmin or np.fmax) over
+	the mins minutes up to and including each time (found by time, so
+	missing records are allowed for). Uses a table of reductions over
+	blocks of 2**k samples, built by doubling: each window is covered by
+	two (overlapping) blocks, so the work grows with the log of the
+	window length, not the length
+	"""
+	y = np.asarray(y,dtype=float)
+	n = len(y)
+	if n < 2:
+		return y.copy()
+	i1 = np.arange(1,n+1)
+	i0 = np.searchsorted(t,t-mins*60.,side='left')
+	level = np.frexp(i1-i0)[1]-1 #Largest k with 2**k <= window length
+	out = np.full(y.shape,np.nan)
+	table = y
+	for k in range(int(np.max(level))+1):
+		if k > 0:
+			#table[i] is the reduction over y[i:i+2**k]
+			table = fcn(table[:-2**(k-1)],table[2**(k-1):])
+		at = level == k
+		out[at] = fcn(table[i0[at]],table[i1[at]-2**k])
+	return out
+
+_condition_operators = {ast.Add:np.add,ast.Sub:np.subtract,ast.Mult:np.multiply,ast.Div:np.true_divide,
+						ast.Pow:np.power,ast.BitAnd:np.logical_and,ast.BitOr:np.logical_or,
+						ast.BitXor:np.logical_xor,ast.And:np.logical_and,ast.Or:np.logical_or,
+						ast.Lt:np.less,ast.LtE:np.less_equal,ast.Gt:np.greater,ast.GtE:np.greater_equal,
+						ast.Eq:np.equal,ast.NotEq:np.not_equal,ast.USub:np.negative,ast.UAdd:np.positive,
+						ast.Not:np.logical_not,ast.Invert:np.logical_not}
+
+def _parse_condition(condition):
+	"""
+	Parse a string condition, allowing only variable names, numbers,
+	arithmetic, comparisons, boolean operators and calls of the condition
+	functions (see _condition_functions). Raises ValueError otherwise
+	"""
+	try:
+		tree = ast.parse(condition,mode='eval')
+	except SyntaxError as e:
+		raise ValueError('Invalid condition %s: %s' % (condition,str(e)))
+	functions = _condition_functions(np.zeros((0,)))
+	for node in ast.walk(tree):
+		if isinstance(node,ast.Call):
+			if not isinstance(node.func,ast.Name) or node.func.id not in functions or len(node.keywords) > 0:
+				raise ValueError('Invalid call in condition %s, only %s(var,...) are allowed'
+									% (condition,','.join(sorted(functions.keys()))))
+		elif isinstance(node,ast.Constant):
+			if isinstance(node.value,bool) or not isinstance(node.value,(int,float)):
+				raise ValueError('Invalid constant %r in condition %s, only numbers are allowed' % (node.value,condition))
+		elif not isinstance(node,(ast.Expression,ast.Name,ast.Load,ast.BoolOp,ast.BinOp,ast.UnaryOp,ast.Compare)
+							+tuple(_condition_operators.keys())):
+			raise ValueError('%s is not allowed in condition %s' % (type(node).__name__,condition))
+	return tree
+
+def _evaluate_condition(node,variables,functions):
+	"""Evaluate a parsed condition (see _parse_condition) on arrays of variables"""
+	if isinstance(node,ast.Expression):
+		return _evaluate_condition(node.body,variables,functions)
+	elif isinstance(node,ast.Constant):
+		return node.value
+	elif isinstance(node,ast.Name):
+		if node.id in functions:
+			raise ValueError('%s can only be called' % (node.id))
+		return variables[node.id]
+	elif isinstance(node,ast.Call):
+		return functions[node.func.id](*[_evaluate_condition(arg,variables,functions) for arg in node.args])
+	elif isinstance(node,ast.UnaryOp):
+		return _condition_operators[type(node.op)](_evaluate_condition(node.operand,variables,functions))
+	elif isinstance(node,ast.BinOp):
+		return _condition_operators[type(node.op)](_evaluate_condition(node.left,variables,functions),
+													_evaluate_condition(node.right,variables,functions))
+	elif isinstance(node,ast.BoolOp):
+		values = [_evaluate_condition(value,variables,functions) for value in node.values]
+		return functools.reduce(_condition_operators[type(node.op)],values)
+	elif isinstance(node,ast.Compare):
+		#Chained comparisons, e.g. -5 < BZ_GSM < 5
+		left = _evaluate_condition(node.left,variables,functions)
+		result = True
+		for op,comparator in zip(node.ops,node.comparators):
+			right = _evaluate_condition(comparator,variables,functions)
+			result = np.logical_and(result,_condition_operators[type(op)](left,right))
+			left = right
+		return result
+	raise ValueError('%s is not allowed in conditions' % (type(node).__name__))
+
+def condition_varnames(condition):
+	"""Names of the OMNI variables a string condition uses"""
+	functions = _condition_functions(np.zeros((0,)))
+	names = []
+	for node in ast.walk(_parse_condition(condition)):
+		if isinstance(node,ast.Name) and node.id not in functions and node.id not in names:
+			names.append(node.id)
+	return names
+
+def find_events(condition,startdt,enddt,cadence='5min',varnames=None,min_duration_mins=0.,
+				merge_gap_mins=0.,lookback_mins=0.,name=None,cdf_or_txt='cdf'):
+	"""
+	Find every interval between startdt and enddt where condition holds.
+
+	condition - str or function
+		A string expression in OMNI variable names and numbers, e.g.
+		'(BZ_GSM < -10) & (flow_speed > 500)', with arithmetic, comparisons,
+		and/or/not (or &,|,~) and the functions change(var,mins),
+		window_min(var,mins), window_max(var,mins) and abs(var), e.g.
+		'change(SYM_H,60) < -50'. It is parsed, not run as python code, and
+		anything else raises a ValueError. A function is called with a dict of
+		float arrays (variables in varnames plus 'Epoch', seconds since 1970)
+		and must return a boolean array
+	varnames - list, needed if condition is a function
+	min_duration_mins - drop events shorter than this (after merging)
+	merge_gap_mins - merge events separated by at most this much time
+	lookback_mins - the longest window used by change/window functions,
+		so that they also work at the start of each file
+
+	Missing (NaN) data never satisfies a comparison, so data gaps end events
+	unless bridged by merge_gap_mins.
+	Returns an omni_event_list (see its center_ymdhm_list and omni_sea)
+	"""
+	if isinstance(condition,str):
+		tree = _parse_condition(condition)
+		varnames = condition_varnames(condition)
+	elif varnames is None:
+		raise ValueError('varnames must be given when condition is a function')
+	step = omnireader.cadence_minutes[cadence]*60.
+	#No events (rather than an error) if there are no files in the range
+	starts,ends = [np.zeros((0,))],[np.zeros((0,))]
+	for t,data,nlookback in iter_omni_chunks(startdt,enddt,cadence,varnames,
+												lookback_mins=lookback_mins,cdf_or_txt=cdf_or_txt):
+		if isinstance(condition,str):
+			with np.errstate(invalid='ignore'):
+				mask = _evaluate_condition(tree,data,_condition_functions(t))
+		else:
+			chunk = dict(data)
+			chunk['Epoch'] = t
+			with np.errstate(invalid='ignore'):
+				mask = condition(chunk)
+		mask = np.broadcast_to(np.asarray(mask,dtype=bool),t.shape)[nlookback:]
+		i_starts,i_ends = find_runs(mask)
+		#Each sample stands for the cadence-long interval it starts
+		starts.append(t[nlookback:][i_starts])
+		ends.append(t[nlookback:][i_ends-1]+step)
+
+	starts,ends = np.concatenate(starts),np.concatenate(ends)
+	#Runs which continue across a file boundary have a zero gap, so always merge
+	group = merge_runs(starts,ends,max(merge_gap_mins*60.,0.))
+	ngroups = group[-1]+1 if len(group) > 0 else 0
+	first = np.flatnonzero(np.concatenate([[True],np.diff(group)>0])) if ngroups > 0 else np.zeros((0,),dtype=int)
+	event_starts = starts[first]
+	event_ends = np.full((ngroups,),-np.inf)
+	np.maximum.at(event_ends,group,ends)
+	long_enough = event_ends-event_starts >= min_duration_mins*60.
+	return omni_event_list(event_starts[long_enough],event_ends[long_enough],
+							name=name if name is not None else str(condition))
+
+def find_sudden_impulses(startdt,enddt,amplitude_nT=10.,rise_mins=10.,pressure_ratio=1.2,
+						require_pressure=False,merge_gap_mins=60.,storm_symh_nT=-50.,storm_hours=24.,
+						cadence='1min',cdf_or_txt='cdf'):
+	"""
+	Detect sudden impulses in SYM_H between startdt and enddt, reading one
+	file at a time. A sudden impulse is a rise of SYM_H of at least
+	amplitude_nT within rise_mins, with the solar wind dynamic pressure
+	('Pressure') rising by at least a factor of pressure_ratio over the same
+	time. Missing pressure only rejects an impulse if require_pressure.
+	Detections within merge_gap_mins of each other are one event.
+
+	Events followed by a storm, SYM_H at or below storm_symh_nT within
+	storm_hours of the onset, are storm sudden commencements ('SSC'),
+	the rest sudden impulses ('SI'). The storm check only uses data
+	before enddt.
+
+	Returns an omni_event_list, starting at the onset (the last sample
+	before the rise) and ending when the rise criterion stops being met,
+	with columns 'kind' ('SSC' or 'SI'), 'amplitude' (largest rise, nT),
+	and 'storm_min_symh' (nT). E.g. for superposed epoch analysis of the
+	storm sudden commencements:
+		events = find_sudden_impulses(startdt,enddt)
+		sea = events.select(events['kind']=='SSC').omni_sea(cadence='hourly')
+	"""
+	if cadence not in ['1min','5min']:
+		raise ValueError('SYM_H is only available at 1min and 5min cadence, not %s' % (cadence))
+	step = omnireader.cadence_minutes[cadence]*60.
+	nwin = int(round(rise_mins*60./step))
+	onsets,starts,ends,amplitudes = [],[],[],[]
+	storm_min = np.zeros((0,))
+	for t,data,nlookback in iter_omni_chunks(startdt,enddt,cadence,['SYM_H','Pressure'],
+												lookback_mins=rise_mins,cdf_or_txt=cdf_or_txt):
+		symh,pressure = data['SYM_H'],data['Pressure']
+		with np.errstate(invalid='ignore',divide='ignore'):
+			rise = symh-_window_reduce(np.fmin,t,symh,rise_mins)
+			pratio = pressure/_window_reduce(np.fmin,t,pressure,rise_mins)
+			pressure_ok = pratio >= pressure_ratio
+			if not require_pressure:
+				pressure_ok = np.logical_or(pressure_ok,~np.isfinite(pratio))
+			detected = np.logical_and(rise >= amplitude_nT,pressure_ok)
+		i_starts,i_ends = find_runs(detected[nlookback:])
+		i_starts,i_ends = i_starts+nlookback,i_ends+nlookback
+		if len(i_starts) > 0:
+			#Onset is the (latest) minimum of SYM_H in the window before the first detection
+			window = np.clip(i_starts[:,np.newaxis]-np.arange(nwin+1)[np.newaxis,:],0,len(t)-1)
+			before = np.where(np.isfinite(symh[window]),symh[window],np.inf)
+			onsets.append(t[window[np.arange(len(i_starts)),np.argmin(before,axis=1)]])
+			starts.append(t[i_starts])
+			ends.append(t[i_ends-1]+step)
+			amplitudes.append(omnireader.segment_reduce(np.fmax,rise,i_starts,i_ends))
+			storm_min = np.concatenate([storm_min,np.full((len(i_starts),),np.nan)])
+		#Update the minimum SYM_H after each onset found so far
+		if len(storm_min) > 0:
+			all_onsets = np.concatenate(onsets)
+			tc,symhc = t[nlookback:],symh[nlookback:]
+			i0 = np.searchsorted(tc,all_onsets,side='left')
+			i1 = np.searchsorted(tc,all_onsets+storm_hours*3600.,side='left')
+			storm_min = np.fmin(storm_min,omnireader.segment_reduce(np.fmin,symhc,i0,i1))
+
+	if len(onsets) == 0:
+		return omni_event_list([],[],name='Sudden impulses',kind=np.zeros((0,),dtype='<U3'),
+								amplitude=[],storm_min_symh=[])
+	onsets,starts,ends,amplitudes = [np.concatenate(arr) for arr in [onsets,starts,ends,amplitudes]]
+	group = merge_runs(starts,ends,merge_gap_mins*60.)
+	first = np.flatnonzero(np.concatenate([[True],np.diff(group)>0]))
+	event_ends = np.full((len(first),),-np.inf)
+	np.maximum.at(event_ends,group,ends)
+	event_amplitudes = np.full((len(first),),-np.inf)
+	np.fmax.at(event_amplitudes,group,amplitudes)
+	storm_min = storm_min[first]
+	with np.errstate(invalid='ignore'):
+		kind = np.where(storm_min <= storm_symh_nT,'SSC','SI')
+	return omni_event_list(onsets[first],event_ends,name='Sudden impulses',kind=kind,
+							amplitude=event_amplitudes,storm_min_symh=storm_min)
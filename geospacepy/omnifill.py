@@ -0,0 +1,223 @@
+"""
+	omnifill.py
+	Fill short data gaps in OMNI time series. Gap lengths are found in
+	one pass (from the indices of the valid samples before and after each
+	sample), gaps of at most max_gap missing samples (or, with times, whose
+	valid samples either side are at most max_span apart, so missing
+	records count too) are filled by linear interpolation, the previous
+	value or local PCHIP (a cubic Hermite through the samples bracketing
+	the gap, with PCHIP slopes), and longer gaps are left NaN. Every
+	function works on blocks of many variables (samples x variables) at
+	once, and gap_filler applies the same filling to a stream of chunks.
+"""
+import numpy as np
+from geospacepy import omnireader, special_datetime
+
+fill_methods = ['linear','previous','pchip']
+
+def _as_block(Y):
+	Y = np.array(Y,dtype=float)
+	return Y.reshape(-1,1) if Y.ndim == 1 else Y
+
+def _valid_neighbors(valid):
+	"""
+	Index of the last valid sample at or before (iprev, -1 if none)
+	and first valid sample at or after (inext, n if none) each sample
+	"""
+	n = valid.shape[0]
+	i = np.arange(n).reshape(-1,1)
+	iprev = np.maximum.accumulate(np.where(valid,i,-1),axis=0)
+	inext = np.minimum.accumulate(np.where(valid,i,n)[::-1,:],axis=0)[::-1,:]
+	return iprev,inext
+
+def gap_lengths(Y):
+	"""
+	Length (number of missing samples) of the gap each sample is in,
+	0 for valid samples. Gaps at the start or end can only be measured up
+	to the edge of the data. Y is samples (x variables)
+	"""
+	Y = np.asarray(Y,dtype=float)
+	block = _as_block(Y)
+	iprev,inext = _valid_neighbors(np.isfinite(block))
+	lengths = np.where(np.isfinite(block),0,inext-iprev-1)
+	return lengths.reshape(Y.shape)
+
+def _short_gaps(iprev,inext,max_gap,t,max_span):
+	"""
+	Whether the gaps between valid samples iprev and inext are short enough
+	to fill: at most max_gap samples missing (None for no limit) and at most
+	max_span between t[iprev] and t[inext] (None for no limit)
+	"""
+	short = np.ones(np.shape(iprev),dtype=bool) if max_gap is None else inext-iprev-1<=max_gap
+	if max_span is not None:
+		n = len(t)
+		short = np.logical_and(short,t[np.clip(inext,0,n-1)]-t[np.clip(iprev,0,n-1)]<=max_span)
+	return short
+
+def _pchip_slope(d0,d1,h0,h1):
+	"""PCHIP (Fritsch-Carlson) slope at a knot between secants d0 and d1 of widths h0 and h1"""
+	w1,w2 = 2*h1+h0,h1+2*h0
+	with np.errstate(invalid='ignore',divide='ignore'):
+		slope = (w1+w2)/(w1/d0+w2/d1)
+	return np.where(d0*d1>0,slope,0.)
+
+def fill_gaps(Y,max_gap,method='linear',t=None,max_span=None):
+	"""
+	Fill the gaps (runs of NaN) of at most max_gap samples in Y (samples
+	x variables, or one variable) which have valid data on both sides.
+
+	method - 'linear','previous' (the last valid value) or 'pchip' (cubic
+		Hermite through the valid samples on either side of the gap, with
+		PCHIP slopes from their neighbors; a neighbor across a gap longer
+		than max_gap is not used, so filling stays local)
+	t - times of the samples, for irregular sampling (default is even)
+	max_span - only fill gaps whose valid samples either side are at most
+		max_span apart in t, so samples missing from t (e.g. missing
+		records) count towards the gap. max_gap can be None to limit
+		gaps by max_span only
+
+	Returns the filled copy of Y and a boolean mask of the filled values
+	"""
+	if method not in fill_methods:
+		raise ValueError('Invalid method %s, valid values are %s' % (method,str(fill_methods)))
+	shape = np.shape(Y)
+	Y = _as_block(Y)
+	n,nvars = Y.shape
+	if n == 0:
+		return Y.reshape(shape),np.zeros(shape,dtype=bool)
+	t = np.arange(n,dtype=float) if t is None else np.asarray(t,dtype=float).flatten()
+	valid = np.isfinite(Y)
+	iprev,inext = _valid_neighbors(valid)
+	fill = np.logical_and.reduce([~valid,iprev>=0,inext<n,_short_gaps(iprev,inext,max_gap,t,max_span)])
+	if not np.any(fill):
+		return Y.reshape(shape),fill.reshape(shape)
+
+	#Work only on the samples to fill
+	irow,icol = np.nonzero(fill)
+	p,q = iprev[irow,icol],inext[irow,icol]
+	yp,yq = Y[p,icol],Y[q,icol]
+	if method == 'previous':
+		filled = yp
+	else:
+		h = t[q]-t[p]
+		s = (t[irow]-t[p])/h
+		if method == 'linear':
+			filled = yp+s*(yq-yp)
+		else:
+			d = (yq-yp)/h
+			#Valid samples before p and after q, if they are across a fillable gap
+			pp = np.where(p>0,iprev[np.maximum(p-1,0),icol],-1)
+			qq = np.where(q<n-1,inext[np.minimum(q+1,n-1),icol],n)
+			use_pp = np.logical_and(pp>=0,_short_gaps(pp,p,max_gap,t,max_span))
+			use_qq = np.logical_and(qq<n,_short_gaps(q,qq,max_gap,t,max_span))
+			pp,qq = np.maximum(pp,0),np.minimum(qq,n-1)
+			with np.errstate(invalid='ignore',divide='ignore'):
+				h0,h2 = t[p]-t[pp],t[qq]-t[q]
+				d0,d2 = (yp-Y[pp,icol])/h0,(Y[qq,icol]-yq)/h2
+			mp = np.where(use_pp,_pchip_slope(d0,d,h0,h),d)
+			mq = np.where(use_qq,_pchip_slope(d,d2,h,h2),d)
+			filled = ((2*s**3-3*s**2+1)*yp+(s**3-2*s**2+s)*h*mp
+						+(-2*s**3+3*s**2)*yq+(s**3-s**2)*h*mq)
+	out = Y.copy()
+	out[irow,icol] = filled
+	return out.reshape(shape),fill.reshape(shape)
+
+class gap_filler(object):
+	def __init__(self,max_gap,method='linear',max_span=None):
+		"""
+		fill_gaps for data arriving in chunks (push). Each push returns the
+		samples whose filled values can no longer change, i.e. everything
+		except a gap still open at the end of the chunk (and for 'pchip',
+		the gap before the last valid sample, whose slope needs the next one).
+		Only those samples and the few valid samples they are filled from
+		are kept between chunks. The concatenated output is the same as
+		fill_gaps of all the data at once (with the same max_gap, method
+		and max_span).
+		"""
+		if method not in fill_methods:
+			raise ValueError('Invalid method %s, valid values are %s' % (method,str(fill_methods)))
+		self.max_gap = max_gap
+		self.method = method
+		self.max_span = max_span
+		self.t = None
+		self.Y = None
+		self.n_done = 0 #Samples at the start of the buffer already returned
+
+	def push(self,t,Y):
+		"""
+		Add a chunk of samples at times t (Y is samples x variables), returns
+		(t,filled,fill_mask) of the samples which are now final
+		"""
+		t,Y = np.asarray(t,dtype=float).flatten(),_as_block(Y)
+		if self.t is None:
+			self.t,self.Y = t,Y
+		else:
+			self.t,self.Y = np.concatenate([self.t,t]),np.concatenate([self.Y,Y],axis=0)
+		n,nvars = self.Y.shape
+		filled,fill = fill_gaps(self.Y,self.max_gap,method=self.method,t=self.t,max_span=self.max_span)
+		if n == 0:
+			return self.t,filled,fill
+
+		valid = np.isfinite(self.Y)
+		iprev,inext = _valid_neighbors(valid)
+		icol = np.arange(nvars)
+		last = iprev[-1,:]
+		#Samples before final_before can no longer change, for each variable
+		if self.method == 'pchip':
+			second_last = np.where(last>0,iprev[np.maximum(last-1,0),icol],-1)
+			final_before = second_last+1
+		else:
+			final_before = last+1
+		#A gap open at the end which is already too long is never filled
+		if self.max_gap is not None:
+			final_before[n-1-last > self.max_gap] = n
+		if self.max_span is not None:
+			final_before[np.logical_or(last<0,self.t[-1]-self.t[np.maximum(last,0)] >= self.max_span)] = n
+		release = max(int(np.min(final_before)),self.n_done)
+
+		#Keep the valid samples which the gaps from release onwards are filled from
+		keep_from = np.full((nvars,),release)
+		if release > 0:
+			p = iprev[release-1,:]
+			#The gap at release may still be filled from p (its end is later than release-1)
+			open_gap = p>=0
+			if self.max_gap is not None:
+				open_gap = np.logical_and(open_gap,release-p-1<=self.max_gap)
+			if self.max_span is not None:
+				open_gap = np.logical_and(open_gap,self.t[release-1]-self.t[np.maximum(p,0)]<self.max_span)
+			keep_from[open_gap] = p[open_gap]
+			if self.method == 'pchip':
+				pp = np.where(p>0,iprev[np.maximum(p-1,0),icol],-1)
+				use_pp = np.logical_and.reduce([open_gap,pp>=0,_short_gaps(pp,p,self.max_gap,self.t,self.max_span)])
+				keep_from[use_pp] = pp[use_pp]
+		keep_from = min(int(np.min(keep_from)),release)
+
+		out = (self.t[self.n_done:release],filled[self.n_done:release,:],fill[self.n_done:release,:])
+		self.t,self.Y = self.t[keep_from:],self.Y[keep_from:,:]
+		self.n_done = release-keep_from
+		return out
+
+	def flush(self):
+		"""Return the remaining samples (gaps open at the end are not filled)"""
+		if self.t is None:
+			return np.zeros((0,)),np.zeros((0,0)),np.zeros((0,0),dtype=bool)
+		filled,fill = fill_gaps(self.Y,self.max_gap,method=self.method,t=self.t,max_span=self.max_span)
+		out = (self.t[self.n_done:],filled[self.n_done:,:],fill[self.n_done:,:])
+		self.t,self.Y,self.n_done = None,None,0
+		return out
+
+def fill_interval(oi,varnames,max_gap_mins,method='linear'):
+	"""
+	Gap fill variables of an omni_interval, filling gaps of at most
+	max_gap_mins (missing records included). Returns the times (seconds
+	since 1970), the filled block (samples x variables) and the mask of
+	filled values
+	"""
+	if isinstance(varnames,str):
+		varnames = [varnames]
+	t = special_datetime.datetimearr2unixtime(oi['Epoch']).flatten()
+	Y = np.column_stack([oi.get_float(var) for var in varnames])
+	#The valid samples either side of a gap of max_gap_mins are a step further apart
+	step = omnireader.cadence_minutes[oi.cadence]*60.
+	filled,fill = fill_gaps(Y,None,method=method,t=t,max_span=max_gap_mins*60.+step)
+	return t,filled,fill
@@ -0,0 +1,71 @@
+"""
+	omnimapreduce.py
+	Map-reduce of a function over a long range of OMNI data. The range is
+	split into chunks aligned to the OMNI file boundaries (monthly CDFs at
+	1 and 5 minute cadence, half-yearly for hourly; hourly and 5 minute
+	text files are yearly), each chunk is passed
+	as an omni_interval to a user function in a process pool, so each
+	worker only reads its own files, and the results are combined in time
+	order, so the result does not depend on the number of processes.
+
+		def daily_min_symh(oi,chunk_start,chunk_end):
+			...
+		result = omni_map_reduce(startdt,enddt,'5min',daily_min_symh,combine=np.minimum)
+"""
+import datetime, functools
+from geospacepy import omnireader
+
+def omni_chunks(startdt,enddt,cadence,files_per_chunk=1,cdf_or_txt='cdf'):
+	"""
+	(start,end) datetimes of the chunks of startdt to enddt, each
+	covering files_per_chunk OMNI files of the cdf_or_txt kind
+	(clipped to startdt,enddt)
+	"""
+	spans = omnireader.omni_downloader(cdf_or_txt=cdf_or_txt).file_spans(startdt,enddt,cadence)
+	chunks = []
+	for i in range(0,len(spans),files_per_chunk):
+		chunks.append((max(spans[i][0],startdt),min(spans[min(i+files_per_chunk,len(spans))-1][1],enddt)))
+	return chunks
+
+def _map_chunk(args):
+	"""Run fcn on the omni_interval of one chunk (plus margins)"""
+	fcn,chunk_start,chunk_end,cadence,margin,cdf_or_txt = args
+	oi = omnireader.omni_interval(chunk_start-margin,chunk_end+margin,cadence,silent=True,cdf_or_txt=cdf_or_txt)
+	try:
+		return fcn(oi,chunk_start,chunk_end)
+	finally:
+		oi.close()
+
+def omni_map(startdt,enddt,cadence,fcn,margin_mins=0.,files_per_chunk=1,nprocs=None,cdf_or_txt='cdf'):
+	"""
+	Results of fcn(oi,chunk_start,chunk_end) for each chunk of startdt to
+	enddt (see omni_chunks), in time order. oi is an omni_interval from
+	margin_mins before chunk_start to margin_mins after chunk_end, for
+	functions of windows which need data from either side of the chunk;
+	fcn should only report on chunk_start to chunk_end. Chunks are spread
+	over nprocs processes (default all cores, 1 runs serially), so fcn
+	must be picklable (a module level function)
+	"""
+	margin = datetime.timedelta(minutes=margin_mins)
+	tasks = [(fcn,chunk_start,chunk_end,cadence,margin,cdf_or_txt)
+				for chunk_start,chunk_end in omni_chunks(startdt,enddt,cadence,files_per_chunk=files_per_chunk,
+															cdf_or_txt=cdf_or_txt)]
+	#Results are in the order of the tasks, however they finish
+	return omnireader._run_in_pool(_map_chunk,None,tasks,nprocs=nprocs)
+
+def omni_map_reduce(startdt,enddt,cadence,fcn,combine=None,initial=None,margin_mins=0.,
+						files_per_chunk=1,nprocs=None,cdf_or_txt='cdf'):
+	"""
+	omni_map, then the chunk results combined in time order with
+	combine(accumulated,result) (starting from initial if given).
+	Without combine the list of chunk results is returned
+	"""
+	results = omni_map(startdt,enddt,cadence,fcn,margin_mins=margin_mins,files_per_chunk=files_per_chunk,
+						nprocs=nprocs,cdf_or_txt=cdf_or_txt)
+	if combine is None:
+		return results
+	if initial is not None:
+		return functools.reduce(combine,results,initial)
+	if len(results) == 0:
+		raise ValueError('No OMNI data between %s and %s to reduce' % (str(startdt),str(enddt)))
+	return functools.reduce(combine,results)
@@ -0,0 +1,159 @@
+"""
+	omnipropagate.py
+	Ballistic propagation of OMNI solar wind from the bow shock nose,
+	where OMNI is time shifted to, further downstream (e.g. to the
+	magnetopause). Each sample is delayed by its own travel time from
+	its bow shock nose position to the target at its own Vx, samples
+	overtaken by later, faster ones are removed so arrival times are
+	increasing, and the result is resampled onto a regular time grid.
+"""
+import datetime
+import numpy as np
+from geospacepy import omnireader, omnievents, special_datetime
+
+earth_radius_km = 6371.2
+
+def arrival_times(t,x_re,vx,target_x_re):
+	"""
+	Time (same units as t, seconds) each sample reaches target_x_re
+	(GSE x, Earth radii, a number or one per sample), travelling at
+	|vx| (km/s) from x_re
+	"""
+	with np.errstate(invalid='ignore',divide='ignore'):
+		return t+(x_re-target_x_re)*earth_radius_km/np.abs(vx)
+
+def resolve_overtaking(arrival,overtaking='drop'):
+	"""
+	Indices of the samples to use, in order of increasing arrival.
+	overtaking='drop' removes each sample which a sample emitted after it
+	reaches the target no later than (the later, faster, plasma sweeps it
+	up), so the remaining arrival times are strictly increasing without
+	reordering. overtaking='sort' keeps every sample and sorts by arrival.
+	Samples without an arrival time (missing position or speed) are left out
+	"""
+	arrival = np.asarray(arrival,dtype=float)
+	valid = np.isfinite(arrival)
+	if overtaking == 'sort':
+		return np.flatnonzero(valid)[np.argsort(arrival[valid],kind='mergesort')]
+	elif overtaking != 'drop':
+		raise ValueError('Invalid overtaking %s, valid values are "drop" and "sort"' % (overtaking))
+	a = np.where(valid,arrival,np.inf)
+	#Earliest arrival of any sample emitted later
+	later_min = np.concatenate([np.minimum.accumulate(a[::-1])[::-1][1:],[np.inf]])
+	return np.flatnonzero(np.logical_and(valid,a<later_min))
+
+def resample_arrivals(arrival,Y,grid,method='previous',max_gap=np.inf):
+	"""
+	Resample values Y (samples x variables) arriving at increasing times
+	arrival onto times grid: method 'previous' holds the last arrived value
+	for at most max_gap, 'linear' interpolates between arrivals at most
+	max_gap apart. Returns len(grid) x variables, NaN elsewhere
+	"""
+	Y = np.asarray(Y,dtype=float).reshape(len(arrival),-1)
+	out = np.full((len(grid),Y.shape[1]),np.nan)
+	if len(arrival) == 0:
+		return out
+	iprev = np.searchsorted(arrival,grid,side='right')-1
+	inext = np.minimum(iprev+1,len(arrival)-1)
+	ip = np.maximum(iprev,0)
+	if method == 'previous':
+		ok = np.logical_and(iprev>=0,grid-arrival[ip]<=max_gap)
+		out[ok,:] = Y[ip[ok],:]
+	elif method == 'linear':
+		exact = np.logical_and(iprev>=0,arrival[ip]==grid)
+		ok = np.logical_and.reduce([iprev>=0,iprev<len(arrival)-1,arrival[inext]-arrival[ip]<=max_gap])
+		with np.errstate(invalid='ignore',divide='ignore'):
+			w = ((grid-arrival[ip])/(arrival[inext]-arrival[ip])).reshape(-1,1)
+		interp = Y[ip,:]+w*(Y[inext,:]-Y[ip,:])
+		out[ok,:] = interp[ok,:]
+		out[exact,:] = Y[ip[exact],:]
+	else:
+		raise ValueError('Invalid method %s, valid values are "previous" and "linear"' % (method))
+	return out
+
+def _source_names(cadence):
+	"""Variables with the bow shock nose x position and Vx (hourly has neither)"""
+	if cadence == 'hourly':
+		return 'bowshock_r0','V'
+	return 'BSN_x','Vx'
+
+def _propagate(t,data,cadence,varnames,target_x_re,grid,method,max_gap,overtaking):
+	x_var,v_var = _source_names(cadence)
+	target = data[target_x_re] if isinstance(target_x_re,str) else target_x_re
+	arrival = arrival_times(t,data[x_var],data[v_var],target)
+	use = resolve_overtaking(arrival,overtaking=overtaking)
+	Y = np.column_stack([data[var] for var in varnames]) if len(varnames) > 0 else np.zeros((len(t),0))
+	return arrival[use],resample_arrivals(arrival[use],Y[use,:],grid,method=method,max_gap=max_gap)
+
+def _required_vars(cadence,varnames,target_x_re):
+	required = list(_source_names(cadence))+list(varnames)
+	if isinstance(target_x_re,str):
+		required.append(target_x_re)
+	return [var for i,var in enumerate(required) if var not in required[:i]]
+
+class omni_interval_propagated(object):
+	def __init__(self,startdt,enddt,cadence,varnames,target_x_re=10.,max_lag_mins=180.,
+					method='previous',max_gap_mins=None,overtaking='drop',cdf_or_txt='cdf'):
+		"""
+		OMNI variables propagated from the bow shock nose to target_x_re
+		(GSE x in Earth radii, or the name of a variable, e.g. 'shue_r0' for
+		the magnetopause) on a regular grid at the cadence from startdt to
+		enddt. Data from max_lag_mins before startdt is read for the samples
+		which arrive after startdt. Grid times more than max_gap_mins (default
+		three samples) from an arrival are NaN. Hourly data are propagated
+		from the model bow shock nose (bowshock_r0) at speed V
+		"""
+		self.startdt = startdt
+		self.enddt = enddt
+		self.cadence = cadence
+		self.varnames = list(varnames)
+		step = omnireader.cadence_minutes[cadence]*60.
+		max_gap = (max_gap_mins if max_gap_mins is not None else 3*step/60.)*60.
+		self.oi = omnireader.omni_interval(startdt-datetime.timedelta(minutes=max_lag_mins),enddt,cadence,
+											silent=True,cdf_or_txt=cdf_or_txt)
+		t = special_datetime.datetimearr2unixtime(self.oi['Epoch']).flatten()
+		data = {var:self.oi.get_float(var) for var in _required_vars(cadence,self.varnames,target_x_re)}
+		t0,t1 = special_datetime.datetimearr2unixtime([startdt,enddt]).flatten()
+		self.t = np.arange(t0,t1,step)
+		self.arrival,self.block = _propagate(t,data,cadence,self.varnames,target_x_re,self.t,
+												method,max_gap,overtaking)
+		self.dts = (self.t*1e6).astype('datetime64[us]').astype(datetime.datetime)
+
+	def __getitem__(self,varname):
+		if varname == 'Epoch':
+			return self.dts
+		return self.block[:,self.varnames.index(varname)]
+
+def iter_propagated(startdt,enddt,cadence,varnames,target_x_re=10.,max_lag_mins=180.,
+					method='previous',max_gap_mins=None,overtaking='drop',cdf_or_txt='cdf'):
+	"""
+	omni_interval_propagated over a long range, reading one file at a time.
+	Yields (t,block) for consecutive stretches of the output grid (t in
+	seconds since 1970, block len(t) x len(varnames)). Grid times are only
+	output once no later data can arrive before them, so the result is the
+	same as propagating the whole range at once (for targets downstream of
+	the bow shock nose, i.e. non-negative travel times)
+	"""
+	step = omnireader.cadence_minutes[cadence]*60.
+	max_gap = (max_gap_mins if max_gap_mins is not None else 3*step/60.)*60.
+	t0,t1 = special_datetime.datetimearr2unixtime([startdt,enddt]).flatten()
+	next_grid = t0
+	required = _required_vars(cadence,varnames,target_x_re)
+	for t,data,nlookback in omnievents.iter_omni_chunks(startdt-datetime.timedelta(minutes=max_lag_mins),enddt,
+														cadence,required,lookback_mins=max_lag_mins+max_gap/60.,
+														cdf_or_txt=cdf_or_txt):
+		if len(t) == 0:
+			continue
+		#Later data are emitted, so arrive, after the end of this chunk
+		chunk_end = min(t[-1]+step,t1)
+		is_last = t[-1]+step >= t1
+		grid = np.arange(next_grid,t1 if is_last else chunk_end,step)
+		arrival,block = _propagate(t,data,cadence,varnames,target_x_re,grid,method,max_gap,overtaking)
+		if method == 'linear' and not is_last:
+			#Interpolating needs the next arrival, which may not be in this chunk yet
+			arrived = arrival[arrival<=chunk_end]
+			safe = grid < (arrived[-1] if len(arrived) > 0 else -np.inf)
+			grid,block = grid[safe],block[safe,:]
+		if len(grid) > 0:
+			next_grid = grid[-1]+step
+			yield grid,block
@@ -1,28 +1,35 @@
-import sys, os, copy, textwrap, datetime, subprocess, ftplib, traceback
+import sys, os, textwrap, datetime, traceback, weakref, importlib.util
 
 from geospacepy import special_datetime
 import numpy as np
-import matplotlib as mpl
-mpl.use('Agg')
-import matplotlib.pyplot as pp
-import scipy.interpolate as interpolate
+#matplotlib, scipy, ftplib, multiprocessing and the text file metadata
+#(omnitxtcdf) are imported where they are used, so workers which only
+#read arrays don't pay for them at import
 
 #Attempt to pull in spacepy to get pycdf interface
-#to use faster CDFs
-try:
-	from spacepy import pycdf
-	spacepy_is_available = True
-except KeyboardInterrupt:
-	print(traceback.format_exc())
-	print(textwrap.dedent("""
-		------------IMPORTANT----------------------------
-		Unable to import spacepy. Will fall back to 
-		using Omni text files, but I really recommend
-		installing spacepy and using the cdf format. It's
-		faster.
-		-------------------------------------------------
-		"""))
-	spacepy_is_available = False
+#to use faster CDFs. It is imported by the first omni_downloader
+#which reads CDFs (see _import_pycdf), pycdf imports matplotlib
+pycdf = None
+spacepy_is_available = importlib.util.find_spec('spacepy') is not None
+
+def _import_pycdf():
+	"""Import spacepy.pycdf if it isn't yet, returns whether it is available"""
+	global pycdf,spacepy_is_available
+	if pycdf is None and spacepy_is_available:
+		try:
+			from spacepy import pycdf
+		except ImportError:
+			print(traceback.format_exc())
+			print(textwrap.dedent("""
+				------------IMPORTANT----------------------------
+				Unable to import spacepy. Will fall back to 
+				using Omni text files, but I really recommend
+				installing spacepy and using the cdf format. It's
+				faster.
+				-------------------------------------------------
+				"""))
+			spacepy_is_available = False
+	return spacepy_is_available
 
 #Variables in 1 Hour CDFS
 # ABS_B: CDF_REAL4 [4344]
@@ -135,10 +142,25 @@ except KeyboardInterrupt:
 # z: CDF_REAL4 [8928]
 # >
 import geospacepy
-from geospacepy import omnitxtcdf
 
 localdir = geospacepy.config['omnireader']['local_cdf_dir']
 
+def _matplotlib():
+	"""matplotlib and pyplot, with the Agg backend unless pyplot is already in use"""
+	import matplotlib as mpl
+	if 'matplotlib.pyplot' not in sys.modules:
+		mpl.use('Agg')
+	import matplotlib.pyplot as pp
+	return mpl,pp
+
+def txt_metadata(cadence):
+	"""
+	Variables (with their text file columns) and global attributes of
+	the OMNI files at a cadence, from omnitxtcdf (imported on first use)
+	"""
+	from geospacepy import omnitxtcdf
+	return omnitxtcdf.metadata[cadence]
+
 class omni_txt_cdf_mimic_var(object):
 	"""
 	A class to mimic the interface to a CDF 
@@ -215,7 +237,7 @@ class omni_txt_cdf_mimic(object):
 	have to clutter up the rest of the code with
 	alternate versions for txt or cdf
 	"""
-	def __init__(self,omnitxt,cadence):
+	def __init__(self,omnitxt,cadence,dtype=None):
 		self.txtfn = omnitxt
 		self.cadence = cadence
 		try:
@@ -225,9 +247,9 @@ class omni_txt_cdf_mimic(object):
 			
 		#Load the dictionaries that map CDF variable names in 
 		#the omni CDFs to columns in the text files
-		cdfvars_meta = omnitxtcdf.metadata[cadence]['vars'] 
+		cdfvars_meta = txt_metadata(cadence)['vars'] 
 		self.vars = {varname:omni_txt_cdf_mimic_var(varname,cdfvars_meta[varname],self.data,cadence) for varname in cdfvars_meta}
-		self.attrs = omnitxtcdf.metadata[cadence]['attrs']
+		self.attrs = txt_metadata(cadence)['attrs']
 		#Compute the equivalent to the CDF variable'Epoch', i.e. the time
 		#of each observation as an array of datetimes
 		year,doy = self.vars['YR'][:],self.vars['Day'][:]
@@ -238,38 +260,90 @@ class omni_txt_cdf_mimic(object):
 		epoch_vardict = {'column':-1,'attrs':{'FILLVAL':np.nan}}
 		epoch = special_datetime.doyarr2datetime(doy,year).flatten()
 		self.vars['Epoch'] = omni_txt_cdf_mimic_var('Epoch',epoch_vardict,epoch,cadence,data_is_column=True)
+		if dtype is not None:
+			#Convert after Epoch is computed, float32 days of year are only good to seconds
+			self.data = self.data.astype(dtype)
+			for varname in cdfvars_meta:
+				self.vars[varname].data = self.data[:,int(cdfvars_meta[varname]['column'])]
 
 					
 	def __getitem__(self,var):
 		data = self.vars[var]
 		return data
 
+	def keys(self):
+		return self.vars.keys()
+
+	def close(self):
+		"""Nothing to close, the text file is read into memory"""
+		pass
+
 class omni_downloader(object):
-	def __init__(self,cdf_or_txt='cdf'):
+	def __init__(self,cdf_or_txt='cdf',dtype=None,build_bitmaps=False):
+		"""
+		dtype - floating point type text files are stored as (default float64,
+			CDFs are always read in their native types)
+		build_bitmaps - save validity bitmaps (see omniavail) of each file
+			opened which doesn't have them yet; this reads every variable
+			of the file, so it is off by default (omni_availability makes
+			the bitmaps it needs itself)
+		"""
 		self.localdir = localdir
-		self.cdf_or_txt = cdf_or_txt if spacepy_is_available else 'txt' # is set at top of file in imports
+		self.dtype = dtype
+		self.cdf_or_txt = cdf_or_txt if cdf_or_txt != 'cdf' or _import_pycdf() else 'txt' # is set at top of file in imports
 		#self.cdf_or_txt =
 		self.ftpserv = 'spdf.gsfc.nasa.gov'
 		self.ftpdir = '/pub/data/omni/'	
+		self.build_bitmaps = build_bitmaps
 		#Hourly CDF are every six months, 5 minute are every month as are 1 min
-		if self.cdf_or_txt is 'cdf':
+		if self.cdf_or_txt == 'cdf':
 			self.cadence_subdir = {'hourly':'omni_cdaweb/hourly','5min':'omni_cdaweb/hro_5min','1min':'omni_cdaweb/hro_1min'}
 			self.filename_gen = {'hourly':lambda dt: '%d/omni2_h0_mrg1hr_%d%.2d01_v01.cdf' % (dt.year,dt.year,1 if dt.month < 7 else 7),
 							 '5min':lambda dt: '%d/omni_hro_5min_%d%.2d01_v01.cdf' % (dt.year,dt.year,dt.month),
 							 '1min':lambda dt: '%d/omni_hro_1min_%d%.2d01_v01.cdf' % (dt.year,dt.year,dt.month) }
-		elif self.cdf_or_txt is 'txt':
+			self.file_months = {'hourly':6,'5min':1,'1min':1}
+		elif self.cdf_or_txt == 'txt':
 			self.cadence_subdir = {'hourly':'low_res_omni','5min':'high_res_omni','1min':'high_res_omni/monthly_1min'}
 			self.filename_gen = {'hourly':lambda dt: 'omni2_%d.dat' % (dt.year),
 							 '5min':lambda dt: 'omni_5min%d.asc' % (dt.year),
 							 '1min':lambda dt: 'omni_min%d%.2d.asc' % (dt.year,dt.month) }
+			self.file_months = {'hourly':12,'5min':12,'1min':1}
 		else:
 			raise ValueError('Invalid value of cdf_or_txt argument. Valid values are "txt" and "cdf"')
 
+	def file_start(self,dt,cadence):
+		"""Start of the time span of the file containing datetime dt"""
+		n_months = self.file_months[cadence]
+		return datetime.datetime(dt.year,((dt.month-1)//n_months)*n_months+1,1)
+
+	def file_span(self,dt,cadence):
+		"""(start,end) datetimes of the time span of the file containing datetime dt"""
+		file_startdt = self.file_start(dt,cadence)
+		months = file_startdt.year*12+file_startdt.month-1+self.file_months[cadence]
+		return file_startdt,datetime.datetime(months//12,months%12+1,1)
+
+	def file_spans(self,startdt,enddt,cadence):
+		"""
+		List of (start,end) datetimes of the time spans of the
+		files which hold data between startdt and enddt, in order
+		"""
+		spans = []
+		file_startdt = self.file_start(startdt,cadence)
+		while file_startdt < enddt:
+			spans.append(self.file_span(file_startdt,cadence))
+			file_startdt = spans[-1][1]
+		return spans
+
+	def local_path(self,dt,cadence):
+		"""Path the file containing datetime dt is (or would be) saved to"""
+		return os.path.join(self.localdir,os.path.basename(self.filename_gen[cadence](dt)))
+
 	def get_cdf(self,dt,cadence):
 		remotefn = self.ftpdir+'/'+self.cadence_subdir[cadence]+'/'+self.filename_gen[cadence](dt)
 		remote_path,fn = '/'.join(remotefn.split('/')[:-1]),remotefn.split('/')[-1]
-		localfn = os.path.join(self.localdir,fn)
+		localfn = self.local_path(dt,cadence)
 		if not os.path.exists(localfn):
+			import ftplib
 			ftp = ftplib.FTP(self.ftpserv)
 			print('Connecting to OMNIWeb FTP server %s' % (self.ftpserv))
 			ftp.connect()
@@ -283,10 +357,21 @@ class omni_downloader(object):
 			print("Saved as %s" % (localfn))
 			ftp.quit()
 
-		if self.cdf_or_txt is 'cdf':
+		cdf = self.open_file(localfn,cadence)
+
+		if self.build_bitmaps:
+			#Record which values are valid while the file is open anyway
+			from geospacepy import omniavail
+			if not os.path.exists(omniavail.bitmap_path(localfn)):
+				omniavail.write_validity_bitmaps(localfn,cdf,self.file_span(dt,cadence),cadence)
+		return cdf
+
+	def open_file(self,localfn,cadence):
+		"""Open a local OMNI file"""
+		if self.cdf_or_txt == 'cdf':
 			return pycdf.CDF(localfn) 
 		else:
-			return omni_txt_cdf_mimic(localfn,cadence)	
+			return omni_txt_cdf_mimic(localfn,cadence,dtype=self.dtype)	
 
 class omni_derived_var(object):
 	"""
@@ -294,11 +379,31 @@ class omni_derived_var(object):
 	of CDF variables, that we would like to be accessible via the same __getitem__
 	interface as the variables contained in the CDF
 	"""
+	chunksize = 1000000 # Samples computed at once by evaluate
+
 	def __init__(self,oi):
 		self.oi = oi # associated omni_interval
 		self.varvals = None # To hold computed so we don't recompute without needing to
 		self.attrs = dict()
 
+	def get(self,var):
+		"""A variable of the interval in its float_dtype, which every derived variable is computed in"""
+		return np.asarray(self.oi[var],dtype=self.oi.float_dtype)
+
+	def evaluate(self,fcn,**drivers):
+		"""
+		Call the elementwise function fcn on chunks of the driver
+		variables (keyword name: variable name), so temporaries stay
+		small even for years of 1-min data
+		"""
+		data = {key:self.oi.get_float(drivers[key]) for key in drivers}
+		n = len(next(iter(data.values())))
+		out = np.full((n,),np.nan,dtype=self.oi.float_dtype)
+		for i in range(0,n,self.chunksize):
+			with np.errstate(invalid='ignore',divide='ignore'):
+				out[i:i+self.chunksize] = fcn(**{key:data[key][i:i+self.chunksize] for key in data})
+		return out
+
 class borovsky(omni_derived_var):
 	"""Borovsky solar wind coupling function"""
 
@@ -315,8 +420,8 @@ class borovsky(omni_derived_var):
 		oi = self.oi
 		#Deal with names that differ between cadences
 		(densvar,vswvar) = ('N','V') if oi.cadence == 'hourly' else ('proton_density','flow_speed')
-		bx,by,bz = oi['BX_GSE'],oi['BY_GSM'],oi['BZ_GSM']
-		n,vsw,mach = oi[densvar],oi[vswvar],oi['Mach_num']
+		bx,by,bz = self.get('BX_GSE'),self.get('BY_GSM'),self.get('BZ_GSM')
+		n,vsw,mach = self.get(densvar),self.get(vswvar),self.get('Mach_num')
 		bt = np.sqrt(by**2+bz**2)
 		#Compute IMF clock angle
 		ca = np.arctan2(by,bz)
@@ -340,13 +445,13 @@ class newell(omni_derived_var):
 		oi = self.oi
 		#Deal with names that differ between cadences
 		vswvar = 'V' if oi.cadence == 'hourly' else 'flow_speed'
-		bx,by,bz = oi['BX_GSE'],oi['BY_GSM'],oi['BZ_GSM']
-		vsw,mach = oi[vswvar],oi['Mach_num']
+		bx,by,bz = self.get('BX_GSE'),self.get('BY_GSM'),self.get('BZ_GSM')
+		vsw,mach = self.get(vswvar),self.get('Mach_num')
 		bt = np.sqrt(by**2+bz**2)
 		#Compute IMF clock angle
 		ca = np.arctan2(by,bz)
 		neg_ca = bt*np.cos(ca)*bz < 0
-		ca[neg_ca] = ca[net_ca] + np.pi
+		ca[neg_ca] = ca[neg_ca] + np.pi
 		sin_ca = np.abs(np.sin(ca/2.))
 
 		newell = (vsw*1000.)**(4./3)*(bt*1.0e-9)**(2./3)*(sin_ca)**(8./3);
@@ -385,8 +490,8 @@ class knippjh(omni_derived_var):
 			lymod = 0.
 		
 		#Paper uses absolute value of pcn and dst
-		PC = np.abs(self.oi['PC_N_INDEX']).flatten()
-		Dst = np.abs(self.oi['DST' if oi.cadence == 'hourly' else 'SYM_H']).flatten()
+		PC = np.abs(self.get('PC_N_INDEX')).flatten()
+		Dst = np.abs(self.get('DST' if oi.cadence == 'hourly' else 'SYM_H')).flatten()
 
 		jhindex = np.zeros_like(PC)
 		jhindex.fill(np.nan)
@@ -417,34 +522,238 @@ class knippjh(omni_derived_var):
 		self.varvals = jhindex
 		return jhindex
 
+#Elementwise solar wind driven quantities (n in cm^-3, v in km/s, b in nT)
+def dynamic_pressure(n,v):
+	"""Solar wind dynamic pressure in nPa (with 4% alphas, as OMNI's Pressure)"""
+	return 2.0e-6*n*v**2
+
+def shue_standoff(bz,pdyn):
+	"""Shue et al. (1998) magnetopause subsolar standoff distance in Earth radii"""
+	return (10.22+1.29*np.tanh(0.184*(bz+8.14)))*pdyn**(-1./6.6)
+
+def bow_shock_standoff(r_mp,mach,gamma=5./3):
+	"""
+	Bow shock nose distance in Earth radii from the magnetopause standoff
+	distance and the magnetosonic Mach number (Farris and Russell, 1994)
+	"""
+	return r_mp*(1.+1.1*((gamma-1.)*mach**2+2.)/((gamma+1.)*(mach**2-1.)))
+
+def alfven_mach(b,n,v):
+	"""Alfven Mach number, v over the Alfven speed b/sqrt(mu0*n*m_p)"""
+	va = b*1.0e-9/np.sqrt(4.0e-7*np.pi*n*1.0e6*1.6726e-27)/1.0e3
+	return v/va
+
+def reconnection_efield(v,by,bz):
+	"""Kan and Lee (1979) reconnection electric field in mV/m"""
+	ca = np.arctan2(by,bz)
+	return v*np.sqrt(by**2+bz**2)*np.sin(ca/2.)**2*1.0e-3
+
+def akasofu_epsilon(v,bx,by,bz,l0_re=7.):
+	"""Akasofu epsilon, (4 pi/mu0) v B^2 sin^4(clock angle/2) l0^2, in GW"""
+	ca = np.arctan2(by,bz)
+	l0 = l0_re*6371.2e3
+	return 1.0e7*v*1.0e3*(bx**2+by**2+bz**2)*1.0e-18*np.sin(ca/2.)**4*l0**2/1.0e9
+
+def _sw_names(cadence):
+	"""Names of density and flow speed, which differ between cadences"""
+	return ('N','V') if cadence == 'hourly' else ('proton_density','flow_speed')
+
+class pdyn(omni_derived_var):
+	"""Solar wind dynamic pressure"""
+
+	def __init__(self,*args,**kwargs):
+		omni_derived_var.__init__(self,*args,**kwargs)
+		self.attrs['CATDESC'] = 'Solar Wind Dynamic Pressure (2e-6 n V^2)'
+		self.attrs['UNITS'] = 'nPa'
+
+	def __call__(self):
+		if self.varvals is None:
+			densvar,vswvar = _sw_names(self.oi.cadence)
+			self.varvals = self.evaluate(dynamic_pressure,n=densvar,v=vswvar)
+		return self.varvals
+
+class shue_r0(omni_derived_var):
+	"""Shue et al. 1998 magnetopause standoff distance"""
+
+	def __init__(self,*args,**kwargs):
+		omni_derived_var.__init__(self,*args,**kwargs)
+		self.attrs['CATDESC'] = 'Shue 1998 Magnetopause Subsolar Standoff Distance'
+		self.attrs['UNITS'] = 'Re'
+
+	def __call__(self):
+		if self.varvals is None:
+			densvar,vswvar = _sw_names(self.oi.cadence)
+			self.varvals = self.evaluate(lambda bz,n,v: shue_standoff(bz,dynamic_pressure(n,v)),
+										bz='BZ_GSM',n=densvar,v=vswvar)
+		return self.varvals
+
+class bowshock_r0(omni_derived_var):
+	"""Bow shock nose distance"""
+
+	def __init__(self,*args,**kwargs):
+		omni_derived_var.__init__(self,*args,**kwargs)
+		self.attrs['CATDESC'] = 'Bow Shock Nose Distance (Farris and Russell 1994, Shue 1998 magnetopause)'
+		self.attrs['UNITS'] = 'Re'
+
+	def __call__(self):
+		if self.varvals is None:
+			densvar,vswvar = _sw_names(self.oi.cadence)
+			self.varvals = self.evaluate(lambda bz,n,v,mach: bow_shock_standoff(shue_standoff(bz,dynamic_pressure(n,v)),mach),
+										bz='BZ_GSM',n=densvar,v=vswvar,mach='Mgs_mach_num')
+		return self.varvals
+
+class alfven_mach_num(omni_derived_var):
+	"""Alfven Mach number computed from the field magnitude, density and speed"""
+
+	def __init__(self,*args,**kwargs):
+		omni_derived_var.__init__(self,*args,**kwargs)
+		self.attrs['CATDESC'] = 'Alfven Mach Number'
+		self.attrs['UNITS'] = ' '
+
+	def __call__(self):
+		if self.varvals is None:
+			densvar,vswvar = _sw_names(self.oi.cadence)
+			self.varvals = self.evaluate(lambda bx,by,bz,n,v: alfven_mach(np.sqrt(bx**2+by**2+bz**2),n,v),
+										bx='BX_GSE',by='BY_GSM',bz='BZ_GSM',n=densvar,v=vswvar)
+		return self.varvals
+
+class reconnection_e(omni_derived_var):
+	"""Kan and Lee reconnection electric field"""
+
+	def __init__(self,*args,**kwargs):
+		omni_derived_var.__init__(self,*args,**kwargs)
+		self.attrs['CATDESC'] = 'Kan and Lee 1979 Reconnection Electric Field'
+		self.attrs['UNITS'] = 'mV/m'
+
+	def __call__(self):
+		if self.varvals is None:
+			_,vswvar = _sw_names(self.oi.cadence)
+			self.varvals = self.evaluate(reconnection_efield,v=vswvar,by='BY_GSM',bz='BZ_GSM')
+		return self.varvals
+
+class epsilon(omni_derived_var):
+	"""Akasofu epsilon parameter"""
+
+	def __init__(self,*args,**kwargs):
+		omni_derived_var.__init__(self,*args,**kwargs)
+		self.attrs['CATDESC'] = 'Akasofu Epsilon Parameter (l0 = 7 Re)'
+		self.attrs['UNITS'] = 'GW'
+
+	def __call__(self):
+		if self.varvals is None:
+			_,vswvar = _sw_names(self.oi.cadence)
+			self.varvals = self.evaluate(akasofu_epsilon,v=vswvar,bx='BX_GSE',by='BY_GSM',bz='BZ_GSM')
+		return self.varvals
+
+#Variables computed from the CDF variables, available at every cadence.
+#For long ranges compute them one file at a time, e.g. with omnievents.iter_omni_chunks
+derived_vars = {'borovsky':borovsky,'newell':newell,'knippjh':knippjh,
+				'pdyn':pdyn,'shue_r0':shue_r0,'bowshock_r0':bowshock_r0,
+				'alfven_mach':alfven_mach_num,'reconnection_e':reconnection_e,
+				'epsilon':epsilon}
+
+#Nominal time between samples of each cadence
+cadence_minutes = {'1min':1.,'5min':5.,'hourly':60.}
+
+def _kp_from_kp10(kp10):
+	return kp10/10.
+
 class omni_interval(object):
-	def __init__(self,startdt,enddt,cadence,silent=False,cdf_or_txt='cdf'):
-		#Just handles the possiblilty of having a read running between two CDFs 
-		self.dwnldr = omni_downloader(cdf_or_txt=cdf_or_txt)
+	#Attributes made when the files are opened (see _open)
+	_opened_attrs = ('dwnldr','cdfs','paths','attrs','transforms','si','ei','computed','valid_masks')
+
+	def __init__(self,startdt,enddt,cadence,silent=False,cdf_or_txt='cdf',dtype=None,validate=False):
+		"""
+		dtype - None (default) returns variables as stored in the files
+			(get_float and derived variables as float64). np.float32 or
+			np.float64 returns floating point variables, integer variables
+			which have fill values (as NaN), get_float and derived variables
+			in that type; integer variables without fill stay integers.
+			np.float32 halves the memory of most variables
+		validate - if True, values outside the VALIDMIN/VALIDMAX of the variable
+			are NaN as well as fill values (integer variables with any are
+			converted to floats). The valid records are found once per file
+			and variable and kept (see get_masked)
+		"""
 		self.silent = silent #No messages
 		self.cadence = cadence
 		self.startdt = startdt
 		self.enddt = enddt
-		self.cdfs = [self.dwnldr.get_cdf(startdt,cadence)]
+		self.cdf_or_txt = cdf_or_txt
+		self.dtype = dtype
+		self.validate = validate
+		self._open()
+
+	@property
+	def float_dtype(self):
+		"""Type of get_float and derived variables"""
+		return np.dtype(self.dtype if self.dtype is not None else np.float64)
+
+	def _open(self,paths=None):
+		"""
+		Open the files spanning the interval, or the local files paths
+		if given (and they all exist)
+		"""
+		startdt,enddt,cadence = self.startdt,self.enddt,self.cadence
+		self.dwnldr = omni_downloader(cdf_or_txt=self.cdf_or_txt,dtype=self.dtype)
+		if paths is not None and all([os.path.exists(path) for path in paths]):
+			self.paths = list(paths)
+			self.cdfs = [self.dwnldr.open_file(path,cadence) for path in paths]
+		else:
+			#Just handles the possiblilty of having a read running between two CDFs 
+			self.cdfs = [self.dwnldr.get_cdf(startdt,cadence)]
+			self.paths = [self.dwnldr.local_path(startdt,cadence)]
+			while self.cdfs[-1]['Epoch'][-1] < enddt:
+				#Keep adding CDFs until we span the entire range
+				next_dt = self.cdfs[-1]['Epoch'][-1]+datetime.timedelta(days=1)
+				if self.dwnldr.file_start(next_dt,cadence) >= enddt:
+					#Range ends exactly at the end of this file
+					break
+				self.cdfs.append(self.dwnldr.get_cdf(next_dt,cadence))
+				self.paths.append(self.dwnldr.local_path(next_dt,cadence))
 		self.attrs = self.cdfs[-1].attrs #Mirror the global attributes for convenience
 		self.transforms = dict() #Functions which transform data automatically on __getitem__
+		self.valid_masks = dict() #(file index,variable) -> valid records of the file in the interval
 		#Find the index corresponding to the first value larger than startdt
 		self.si = np.searchsorted(self.cdfs[0]['Epoch'][:],startdt)
-		while self.cdfs[-1]['Epoch'][-1] < enddt:
-			#Keep adding CDFs until we span the entire range
-			self.cdfs.append(self.dwnldr.get_cdf(self.cdfs[-1]['Epoch'][-1]+datetime.timedelta(days=1),cadence))
 		#Find the first index larger than the enddt in the last CDF
 		self.ei = np.searchsorted(self.cdfs[-1]['Epoch'][:],enddt)
 		if not self.silent:
 			print("Created interval between %s and %s, cadence %s, start index %d, end index %d" % (self.startdt.strftime('%Y-%m-%d'),
 				self.enddt.strftime('%Y-%m-%d'),self.cadence,self.si,self.ei))
-		self.add_transform('KP',['hourly'],lambda x: x/10.,'Hourly Kp*10 -> Kp')
+		self.add_transform('KP',['hourly'],_kp_from_kp10,'Hourly Kp*10 -> Kp')
 		#Implement computed variables
-		self.computed = dict()
-		self.computed['borovsky']=borovsky(self)
-		self.computed['newell']=newell(self)
-		self.computed['knippjh']=knippjh(self)
-		
+		self.computed = {varname:derived_vars[varname](self) for varname in derived_vars}
+
+	def __getstate__(self):
+		"""
+		Pickle only the request, the paths of the files, which are
+		reopened on first use after unpickling, and the transforms
+		(so functions passed to add_transform must be picklable,
+		i.e. module level functions)
+		"""
+		if 'paths' in self.__dict__:
+			paths,transforms = self.__dict__['paths'],self.__dict__['transforms']
+		else:
+			paths,transforms = self.__dict__.get('_unopened_paths'),self.__dict__.get('_unopened_transforms',dict())
+		return {'startdt':self.startdt,'enddt':self.enddt,'cadence':self.cadence,'silent':self.silent,
+				'cdf_or_txt':self.cdf_or_txt,'dtype':self.dtype,'validate':self.validate,'paths':paths,
+				'transforms':transforms}
+
+	def __setstate__(self,state):
+		for key in ['startdt','enddt','cadence','silent','cdf_or_txt','dtype','validate']:
+			setattr(self,key,state[key])
+		self._unopened_paths = state['paths']
+		self._unopened_transforms = state.get('transforms',dict())
+
+	def __getattr__(self,name):
+		#Only called for missing attributes, i.e. before an unpickled interval is opened
+		if name in omni_interval._opened_attrs and '_unopened_paths' in self.__dict__:
+			self._open(paths=self.__dict__.pop('_unopened_paths'))
+			self.transforms.update(self.__dict__.pop('_unopened_transforms',dict()))
+			return getattr(self,name)
+		raise AttributeError(name)
+
 	def get_var_attr(self,var,att):
 		"""Get a variable attribute"""
 		if var in self.computed:
@@ -460,27 +769,28 @@ class omni_interval(object):
 		if cdfvar in self.computed:
 			return self.computed[cdfvar]()
 
-		#Attempt the getitem on all the cdfs in order
-		if len(self.cdfs) > 1:
-			ret = []
-			for icdf,cdf in enumerate(self.cdfs):
-				if icdf==0:
-					ret.append(cdf[cdfvar][self.si:])
-				elif icdf==len(self.cdfs)-1:
-					ret.append(cdf[cdfvar][:self.ei])
-				else:
-					ret.append(cdf[cdfvar][:])
-			data = np.concatenate(ret)
+		data,valid = self._read(cdfvar,with_valid=self.validate)
+		if self.dtype is not None:
+			data = self._as_dtype(cdfvar,data)
+		if self.validate:
+			#Fill and out of range values
+			if not np.all(valid):
+				if data.dtype.kind in 'iu':
+					data = data.astype(self.float_dtype)
+				#A new array, data can be a view of the txt mimic's
+				data = np.where(valid,data,data.dtype.type(np.nan))
 		else:
-			data = self.cdfs[-1][cdfvar][self.si:self.ei]
-		#Fix the fill values
-		try:
-			if np.isfinite(self.cdfs[-1][cdfvar].attrs['FILLVAL']):
-				filled = data==self.cdfs[-1][cdfvar].attrs['FILLVAL']
-				if np.count_nonzero(filled) > 0:
-					data[filled]=np.nan
-		except:
-			print("Unhandled fill value %s for variable %s" % (self.cdfs[-1][cdfvar].attrs['FILLVAL'],cdfvar))
+			#Fix the fill values
+			try:
+				if np.isfinite(self.cdfs[-1][cdfvar].attrs['FILLVAL']):
+					filled = data==self.cdfs[-1][cdfvar].attrs['FILLVAL']
+					if np.count_nonzero(filled) > 0:
+						data[filled]=np.nan
+			except:
+				print("Unhandled fill value %s for variable %s" % (self.cdfs[-1][cdfvar].attrs['FILLVAL'],cdfvar))
+		return self._transform(cdfvar,data)
+
+	def _transform(self,cdfvar,data):
 		#Check for transforms which need to be performed
 		if cdfvar in self.transforms:
 			transform = self.transforms[cdfvar]
@@ -493,6 +803,127 @@ class omni_interval(object):
 				#print "Data after", data
 		return data
 
+	def _file_slice(self,icdf):
+		"""Records of the icdf-th file which are in the interval"""
+		return slice(self.si if icdf == 0 else None,self.ei if icdf == len(self.cdfs)-1 else None)
+
+	def _read(self,cdfvar,with_valid=False):
+		"""
+		A CDF variable from all the files in order, and which records
+		are valid (None unless with_valid)
+		"""
+		ret = [cdf[cdfvar][self._file_slice(icdf)] for icdf,cdf in enumerate(self.cdfs)]
+		valid = None
+		if with_valid:
+			valid = np.concatenate([self._file_valid(icdf,cdfvar,part) for icdf,part in enumerate(ret)])
+		data = np.concatenate(ret) if len(ret) > 1 else ret[0]
+		return data,valid
+
+	def _file_valid(self,icdf,cdfvar,data):
+		"""
+		Which records of data (cdfvar read from the icdf-th file) are finite,
+		not fill and within VALIDMIN/VALIDMAX. Found once per file and variable
+		"""
+		key = (icdf,cdfvar)
+		if key not in self.valid_masks:
+			data = np.asarray(data)
+			valid = np.ones(data.shape,dtype=bool)
+			if data.dtype.kind in 'iuf':
+				attrs = self.cdfs[icdf][cdfvar].attrs
+				valid = np.isfinite(data)
+				with np.errstate(invalid='ignore'):
+					for att,compare in [('FILLVAL',np.not_equal),('VALIDMIN',np.greater_equal),('VALIDMAX',np.less_equal)]:
+						if att in attrs and np.isfinite(float(attrs[att])):
+							valid = np.logical_and(valid,compare(data,np.asarray(attrs[att]).astype(data.dtype)))
+			self.valid_masks[key] = valid
+		return self.valid_masks[key]
+
+	def get_masked(self,var):
+		"""
+		Variable as a numpy masked array, with fill values and values outside
+		VALIDMIN/VALIDMAX masked (non-finite values for derived variables)
+		"""
+		if var in self.computed:
+			return np.ma.masked_invalid(self[var])
+		data,valid = self._read(var,with_valid=True)
+		if self.dtype is not None and data.dtype.kind == 'f':
+			data = data.astype(self.dtype,copy=False)
+		return np.ma.masked_array(self._transform(var,data),mask=~valid)
+
+	def _as_dtype(self,cdfvar,data):
+		"""Floating point data, and integer data with fill values, as self.dtype"""
+		if data.dtype.kind == 'f':
+			return data.astype(self.dtype,copy=False)
+		elif data.dtype.kind in 'iu':
+			fillval = self.cdfs[-1][cdfvar].attrs['FILLVAL'] if 'FILLVAL' in self.cdfs[-1][cdfvar].attrs else None
+			if fillval is not None and np.any(data==fillval):
+				return data.astype(self.dtype)
+		return data
+
+	def batch_interpolate(self,vars,jd,method='linear',max_gap_mins=None,chunksize=1000000):
+		"""
+		Interpolate several variables to many times at once (e.g. every
+		sample of a satellite pass), without building interpolant objects.
+
+		vars - list of variable names (or one name)
+		jd - array of julian dates to interpolate to
+		method - 'linear', 'nearest' or 'previous' (the last value at or
+			before each time)
+		max_gap_mins - float, optional
+			outputs are NaN where the finite samples on either side of
+			a time are more than max_gap_mins apart (for 'previous', where
+			the last finite sample is more than max_gap_mins old)
+		chunksize - int
+			number of times processed at once, bounds temporary memory
+
+		Times outside the interval's finite data are NaN.
+		Returns a dict of arrays with the same shape as jd
+		"""
+		if method not in ['linear','nearest','previous']:
+			raise ValueError('Invalid method %s, valid values are "linear", "nearest" and "previous"' % (method))
+		if isinstance(vars,str):
+			vars = [vars]
+		jd = np.asarray(jd,dtype=float)
+		jd_flat = jd.flatten()
+		t_all = special_datetime.datetimearr2unixtime(self['Epoch']).flatten()/86400.+2440587.5
+		max_gap = np.inf if max_gap_mins is None else max_gap_mins/1440.
+		out = dict()
+		for var in vars:
+			y = np.asarray(self[var],dtype=float).flatten()
+			g = np.isfinite(y)
+			t,y = t_all[g],y[g]
+			yi = np.full(jd_flat.shape,np.nan)
+			if len(t) == 0:
+				out[var] = yi.reshape(jd.shape)
+				continue
+			for i_start in range(0,len(jd_flat),chunksize):
+				tq = jd_flat[i_start:i_start+chunksize]
+				#Finite samples at or before (i_prev) and after (i_next) each time
+				i_next = np.searchsorted(t,tq,side='right')
+				i_prev = np.clip(i_next-1,0,len(t)-1)
+				i_next = np.clip(i_next,0,len(t)-1)
+				t_prev,t_next = t[i_prev],t[i_next]
+				exact = t_prev == tq
+				inside = np.logical_and(tq>=t[0],tq<=t[-1])
+				if method == 'previous':
+					yq = y[i_prev]
+					ok = np.logical_and(tq>=t[0],tq-t_prev<=max_gap)
+				else:
+					gap = np.where(exact,0.,t_next-t_prev)
+					ok = np.logical_and(inside,gap<=max_gap)
+					if method == 'linear':
+						#Only weight times strictly between two samples, so times
+						#outside the data never divide by zero
+						between = np.logical_and(inside,~exact)
+						w = np.zeros(tq.shape)
+						w[between] = (tq[between]-t_prev[between])/(t_next[between]-t_prev[between])
+						yq = y[i_prev]+w*(y[i_next]-y[i_prev])
+					else:
+						yq = np.where(tq-t_prev <= t_next-tq,y[i_prev],y[i_next])
+				yi[i_start:i_start+chunksize] = np.where(ok,yq,np.nan)
+			out[var] = yi.reshape(jd.shape)
+		return out
+
 	def add_transform(self,cdfvar,cadences,fcn,desc):
 		"""
 			Call some function to manipulate the returned data 
@@ -512,19 +943,394 @@ class omni_interval(object):
 		"""
 		self.transforms[cdfvar] = {'cadences':cadences,'fcn':fcn,'desc':desc}
 
+	def get_float(self,var):
+		"""Variable as floats, with the fill values (integer variables' too) as NaN"""
+		data = np.array(self[var],dtype=self.float_dtype).flatten()
+		if var not in self.computed:
+			fillval = self.get_var_attr(var,'FILLVAL')
+			if fillval is not None:
+				data[data==self.float_dtype.type(fillval)] = np.nan
+		return data
+
+	def to_shared(self,varnames):
+		"""
+		Copy Epoch and variables (as floats, fill values NaN) into one
+		multiprocessing.shared_memory block, and return a small picklable
+		omni_shared_handle which worker processes attach to without copying.
+		The block is freed when this interval is closed (or garbage collected)
+		"""
+		if isinstance(varnames,str):
+			varnames = [varnames]
+		t = special_datetime.datetimearr2unixtime(self['Epoch']).flatten()
+		arrays = [t]+[self.get_float(var) for var in varnames]
+		from multiprocessing import shared_memory
+		shm = shared_memory.SharedMemory(create=True,size=max(1,8*len(t)*len(arrays)))
+		block = np.ndarray((len(arrays),len(t)),dtype=np.float64,buffer=shm.buf)
+		for i,arr in enumerate(arrays):
+			block[i,:] = arr
+		del block
+		if not hasattr(self,'_shared'):
+			self._shared = []
+		self._shared.append(weakref.finalize(self,_release_shared_memory,shm))
+		return omni_shared_handle(shm.name,len(t),['Epoch']+list(varnames),
+								self.startdt,self.enddt,self.cadence,tracker=_resource_tracker_id())
+
+	def close(self):
+		"""Close the files and free any shared memory made by to_shared"""
+		for cdf in self.cdfs:
+			cdf.close()
+		for finalizer in getattr(self,'_shared',[]):
+			finalizer()
+		self._shared = []
+
 	def __str__(self):
 		return str(self.cdfs[0])
 
+def _release_shared_memory(shm):
+	shm.close()
+	shm.unlink()
+
+def _resource_tracker_id():
+	"""
+	Identifies this process's multiprocessing resource tracker (the inode
+	of its pipe, which processes started by multiprocessing share), or None
+	"""
+	if os.name != 'posix':
+		return None
+	from multiprocessing import resource_tracker
+	fd = getattr(resource_tracker._resource_tracker,'_fd',None)
+	return None if fd is None else os.fstat(fd).st_ino
+
+def _attach_shared_memory(name,tracker=None):
+	"""
+	Attach to an existing shared memory block without letting this
+	process's resource tracker free it when the process exits.
+	tracker - _resource_tracker_id of the process which made the block
+	"""
+	from multiprocessing import shared_memory
+	try:
+		return shared_memory.SharedMemory(name=name,track=False)
+	except TypeError:
+		#Python < 3.13 always registers the block. Undo that if this process
+		#has its own tracker; a tracker shared with the process which made
+		#the block holds one entry per block, which that process unregisters
+		shm = shared_memory.SharedMemory(name=name)
+		own_tracker = _resource_tracker_id()
+		if own_tracker is not None and own_tracker != tracker:
+			from multiprocessing import resource_tracker
+			resource_tracker.unregister(shm._name,'shared_memory')
+		return shm
+
+class omni_shared_handle(object):
+	"""
+	Picklable reference to omni_interval variables in shared memory
+	(see omni_interval.to_shared). Pass it to worker processes and call
+	attach there
+	"""
+	def __init__(self,name,n,varnames,startdt,enddt,cadence,tracker=None):
+		self.name = name
+		self.tracker = tracker
+		self.n = n
+		self.varnames = varnames
+		self.startdt = startdt
+		self.enddt = enddt
+		self.cadence = cadence
+
+	def attach(self):
+		return omni_shared_interval(self)
+
+class omni_shared_interval(object):
+	def __init__(self,handle):
+		"""
+		Read-only, zero-copy view of shared omni_interval variables with
+		the omni_interval __getitem__ interface, made by
+		omni_shared_handle.attach. The variables are views of the shared
+		block, so copy any you keep past close
+		"""
+		self.startdt = handle.startdt
+		self.enddt = handle.enddt
+		self.cadence = handle.cadence
+		self.varnames = handle.varnames
+		self.shm = _attach_shared_memory(handle.name,tracker=handle.tracker)
+		#A view of the mapping itself (views of shm.buf don't hold it open),
+		#so closing the mapping while variables are still in use fails
+		self.block = np.frombuffer(self.shm._mmap,dtype=np.float64,
+									count=len(handle.varnames)*handle.n).reshape(len(handle.varnames),handle.n)
+		self.block.flags.writeable = False
+
+	def __getitem__(self,var):
+		if var == 'Epoch':
+			return (self.block[0,:]*1e6).astype('datetime64[us]').astype(datetime.datetime)
+		return self.block[self.varnames.index(var),:]
+
+	def get_float(self,var):
+		return self[var]
+
+	def close(self):
+		"""
+		Detach (the parent interval frees the memory). Raises BufferError
+		if variables returned by __getitem__ are still referenced; delete
+		them (or keep copies) and close again
+		"""
+		self.block = None
+		try:
+			self.shm.close()
+		except BufferError:
+			raise BufferError(('Arrays from shared OMNI block %s are still in use, '
+								+'delete them (or copy them) before close') % (self.shm.name))
+
+class omni_fused_interval(object):
+	def __init__(self,startdt,enddt,varnames,cadence='1min',grid=None,
+					upsample='previous',downsample='mean',silent=True,cdf_or_txt='cdf'):
+		"""
+		Variables from different OMNI cadences aligned to one time grid.
+
+		Each variable is read from the coarsest cadence which is at least
+		as fine as the grid (or the finest cadence which has it, if none is),
+		then resampled to the grid:
+			coarser source - upsampled by step-hold (upsample='previous')
+				or linear interpolation (upsample='linear'), across at
+				most one and a half source steps
+			finer source - downsampled by NaN-aware aggregation of the
+				samples in [grid[i],grid[i+1]) (downsample='mean','min' or 'max')
+
+		startdt,enddt - datetime
+			span of the grid (ignored if grid is given)
+		varnames - list
+			CDF or derived variable names, e.g. ['BZ_GSM','F10_INDEX','KP']
+		cadence - str or float
+			grid step, a cadence name ('1min','5min','hourly') or minutes
+		grid - array of datetimes, optional
+			explicit grid times (regularly spaced)
+
+		The aligned data is self.block (len(grid) x len(varnames)),
+		and is also available by name through __getitem__,
+		with the grid as 'Epoch'
+		"""
+		self.varnames = list(varnames)
+		self.silent = silent
+		self.cdf_or_txt = cdf_or_txt
+		self.upsample = upsample
+		self.downsample = downsample
+		if grid is None:
+			self.grid_minutes = cadence_minutes[cadence] if cadence in cadence_minutes else float(cadence)
+			step = np.timedelta64(int(round(self.grid_minutes*60.e6)),'us')
+			dt64 = np.arange(np.datetime64(startdt,'us'),np.datetime64(enddt,'us')+step//2,step)
+		else:
+			dt64 = np.asarray(grid,dtype='datetime64[us]').flatten()
+			self.grid_minutes = np.median(np.diff(dt64).astype(float))/60.e6
+		self.dts = dt64.astype(datetime.datetime)
+		self.t = special_datetime.datetimearr2unixtime(self.dts).flatten()
+		self.jds = self.t/86400.+2440587.5
+
+		self.sources = {varname:self.source_cadence(varname,self.grid_minutes) for varname in self.varnames}
+		#One interval per source cadence, padded so the grid edges can be resampled
+		self.intervals = dict()
+		for source in set(self.sources.values()):
+			pad = datetime.timedelta(minutes=2*max(cadence_minutes[source],self.grid_minutes))
+			self.intervals[source] = omni_interval(self.dts[0]-pad,self.dts[-1]+pad,source,
+													silent=silent,cdf_or_txt=cdf_or_txt)
+		self.block = np.full((len(self.dts),len(self.varnames)),np.nan)
+		for ivar,varname in enumerate(self.varnames):
+			self.block[:,ivar] = self._resample(varname)
+
+	@staticmethod
+	def source_cadence(varname,grid_minutes):
+		"""
+		The coarsest cadence with varname that is at least as fine
+		as grid_minutes, or the finest with varname if none are
+		"""
+		candidates = [c for c in cadence_minutes
+						if varname in derived_vars or varname in txt_metadata(c)['vars']]
+		if len(candidates) == 0:
+			raise KeyError('Variable %s is not in any OMNI cadence' % (varname))
+		adequate = [c for c in candidates if cadence_minutes[c] <= grid_minutes*(1.+1e-6)]
+		if len(adequate) > 0:
+			return max(adequate,key=lambda c: cadence_minutes[c])
+		return min(candidates,key=lambda c: cadence_minutes[c])
+
+	def _resample(self,varname):
+		source = self.sources[varname]
+		oi = self.intervals[source]
+		source_minutes = cadence_minutes[source]
+		if source_minutes >= self.grid_minutes*(1.-1e-6):
+			method = 'linear' if source_minutes <= self.grid_minutes*(1.+1e-6) else self.upsample
+			return oi.batch_interpolate([varname],self.jds,method=method,
+										max_gap_mins=1.5*source_minutes)[varname]
+		#Aggregate the finer samples which fall in each grid step
+		t = special_datetime.datetimearr2unixtime(oi['Epoch']).flatten()
+		y = np.asarray(oi[varname],dtype=float).flatten()
+		edges = np.concatenate([self.t,[self.t[-1]+self.grid_minutes*60.]])
+		ibin = np.searchsorted(edges,t,side='right')-1
+		g = np.logical_and(np.isfinite(y),np.logical_and(ibin>=0,ibin<len(self.t)))
+		ibin,y = ibin[g],y[g]
+		count = np.bincount(ibin,minlength=len(self.t))
+		if self.downsample == 'mean':
+			with np.errstate(invalid='ignore',divide='ignore'):
+				return np.bincount(ibin,weights=y,minlength=len(self.t))/count
+		elif self.downsample in ['min','max']:
+			ufunc = np.minimum if self.downsample == 'min' else np.maximum
+			out = np.full((len(self.t),),np.inf if self.downsample == 'min' else -np.inf)
+			ufunc.at(out,ibin,y)
+			out[count==0] = np.nan
+			return out
+		else:
+			raise ValueError('Invalid downsample %s, valid values are "mean", "min" and "max"' % (self.downsample))
+
+	def __getitem__(self,varname):
+		if varname == 'Epoch':
+			return self.dts
+		return self.block[:,self.varnames.index(varname)]
+
+	def get_var_attr(self,var,att):
+		"""Get a variable attribute from the interval the variable was read from"""
+		return self.intervals[self.sources[var]].get_var_attr(var,att)
+
+window_stat_names = ['count','mean','median','min','max','first','last']
+
+def omni_window_stats(startdts,enddts,varnames,cadence='1min',stats=('mean','median','last'),cdf_or_txt='cdf'):
+	"""
+	Statistics of OMNI variables in many (e.g. tens of thousands of short)
+	windows at once. Only the files the windows touch are read, each once,
+	and every window's statistics are computed together with searchsorted
+	and reduceat, instead of making an omni_interval per window.
+
+	startdts,enddts - lists/arrays of datetimes, the windows are the
+		samples with startdt <= Epoch < enddt
+	varnames - list of variable names (or one name)
+	stats - any of 'count' (of valid values),'mean','median','min','max',
+		'first' and 'last' (valid value)
+
+	Returns a numpy structured array with one record per window, in
+	the order given, with fields 'start','end' (datetime64[us]) and
+	'<var>_<stat>' for each variable and statistic (NaN for windows
+	without valid data)
+	"""
+	if isinstance(varnames,str):
+		varnames = [varnames]
+	for stat in stats:
+		if stat not in window_stat_names:
+			raise ValueError('Invalid statistic %s, valid values are %s' % (stat,str(window_stat_names)))
+	dwnldr = omni_downloader(cdf_or_txt=cdf_or_txt)
+	starts64 = np.array(startdts,dtype='datetime64[us]').flatten()
+	ends64 = np.array(enddts,dtype='datetime64[us]').flatten()
+	if starts64.shape != ends64.shape:
+		raise ValueError('Different numbers of window starts (%d) and ends (%d)' % (len(starts64),len(ends64)))
+	t0 = (starts64-np.datetime64('1970-01-01T00:00:00','us')).astype(float)/1e6
+	t1 = (ends64-np.datetime64('1970-01-01T00:00:00','us')).astype(float)/1e6
+
+	dtype = [('start','datetime64[us]'),('end','datetime64[us]')]
+	dtype += [('%s_%s' % (var,stat),np.int32 if stat=='count' else float) for var in varnames for stat in stats]
+	out = np.zeros(starts64.shape,dtype=dtype)
+	out['start'],out['end'] = starts64,ends64
+	for field in out.dtype.names[2:]:
+		if not field.endswith('_count'):
+			out[field] = np.nan
+	if len(out) == 0:
+		return out
+
+	#Plan the files: number of each window's first and last file, counting files from 1970
+	n_months = dwnldr.file_months[cadence]
+	first_file = starts64.astype('datetime64[M]').astype(np.int64)//n_months
+	last_file = np.maximum((ends64-np.timedelta64(1,'us')).astype('datetime64[M]').astype(np.int64)//n_months,first_file)
+	nfiles = last_file-first_file+1
+	offsets = np.arange(np.sum(nfiles))-np.repeat(np.cumsum(nfiles)-nfiles,nfiles)
+	files = np.unique(np.repeat(first_file,nfiles)+offsets)
+
+	#Go through the files in order, keeping only the data of the windows which
+	#continue into the next file
+	buffer_t,buffer_data = np.zeros((0,)),{var:np.zeros((0,)) for var in varnames}
+	for ifile in files:
+		months = int(ifile)*n_months
+		file_startdt = datetime.datetime(1970+months//12,months%12+1,1)
+		file_startdt,file_enddt = dwnldr.file_span(file_startdt,cadence)
+		oi = omni_interval(file_startdt,file_enddt,cadence,silent=True,cdf_or_txt=cdf_or_txt)
+		t = special_datetime.datetimearr2unixtime(oi['Epoch']).flatten()
+		keep = t > (buffer_t[-1] if len(buffer_t) > 0 else -np.inf)
+		buffer_t = np.concatenate([buffer_t,t[keep]])
+		for var in varnames:
+			buffer_data[var] = np.concatenate([buffer_data[var],oi.get_float(var)[keep]])
+		oi.close()
+
+		windows = np.flatnonzero(last_file==ifile)
+		if len(windows) > 0:
+			i0 = np.searchsorted(buffer_t,t0[windows],side='left')
+			i1 = np.searchsorted(buffer_t,t1[windows],side='left')
+			for var in varnames:
+				_window_reductions(out,windows,var,stats,buffer_data[var],i0,i1)
+
+		pending = last_file > ifile
+		if np.any(pending):
+			keep = buffer_t >= np.min(t0[pending])
+			buffer_t = buffer_t[keep]
+			buffer_data = {var:buffer_data[var][keep] for var in varnames}
+		else:
+			buffer_t,buffer_data = np.zeros((0,)),{var:np.zeros((0,)) for var in varnames}
+	return out
+
+def _window_reductions(out,windows,var,stats,y,i0,i1):
+	"""Fill the var statistics of out[windows] from y over [i0,i1)"""
+	valid = np.isfinite(y)
+	n_valid = np.concatenate([[0],np.cumsum(valid)])
+	count = n_valid[i1]-n_valid[i0]
+	has_data = count > 0
+	iy = np.arange(len(y))
+	for stat in stats:
+		field = '%s_%s' % (var,stat)
+		if stat == 'count':
+			out[field][windows] = count
+		elif stat == 'mean':
+			sums = np.concatenate([[0.],np.cumsum(np.where(valid,y,0.))])
+			with np.errstate(invalid='ignore',divide='ignore'):
+				out[field][windows] = (sums[i1]-sums[i0])/count
+		elif stat in ['min','max']:
+			out[field][windows] = segment_reduce(np.fmin if stat=='min' else np.fmax,y,i0,i1)
+		elif stat in ['first','last']:
+			if stat == 'first':
+				#Index of the first valid value at or after each sample
+				inext = np.minimum.accumulate(np.where(valid,iy,len(y))[::-1])[::-1]
+				i = np.concatenate([inext,[len(y)]])[i0]
+			else:
+				#Index of the last valid value at or before each sample
+				iprev = np.maximum.accumulate(np.where(valid,iy,-1))
+				i = np.concatenate([[-1],iprev])[i1]
+			out[field][windows] = np.where(has_data,np.concatenate([y,[np.nan]])[i],np.nan)
+		elif stat == 'median':
+			#Gather every window's valid samples, then take binned percentiles
+			lengths = i1-i0
+			iwindow = np.repeat(np.arange(len(windows)),lengths)
+			isample = np.repeat(i0,lengths)+np.arange(np.sum(lengths))-np.repeat(np.cumsum(lengths)-lengths,lengths)
+			g = valid[isample]
+			out[field][windows] = binned_percentiles(iwindow[g],y[isample[g]],len(windows),[50.])[0,:]
+
 class omni_event(object):
 	def __init__(self,startdt,enddt,label=None,cadence='5min',cdf_or_txt='cdf'):
 		self.interval = omni_interval(startdt,enddt,cadence,cdf_or_txt=cdf_or_txt)
-		datetime2doy = lambda dt: dt.timetuple().tm_yday + dt.hour/24. + dt.minute/24./60. + dt.second/86400. + dt.microsecond/86400./1e6
-		self.doy = special_datetime.datetimearr2doy(self.interval['Epoch'])
-		self.jd = special_datetime.datetimearr2jd(self.interval['Epoch'])
 		self.label = '%s-%s' % (startdt.strftime('%m-%d-%Y'),enddt.strftime('%m-%d-%Y')) if label is None else label
 		self.interpolants = dict()
+		self._times()
+
+	def _times(self):
+		self.doy = special_datetime.datetimearr2doy(self.interval['Epoch'])
+		self.jd = special_datetime.datetimearr2unixtime(self.interval['Epoch'])/86400.+2440587.5
 		self.attrs = self.interval.attrs	
 
+	def __getstate__(self):
+		"""Pickle the (lazily reopening) interval and label, not the data"""
+		return {'interval':self.interval,'label':self.label}
+
+	def __setstate__(self,state):
+		self.interval = state['interval']
+		self.label = state['label']
+		self.interpolants = dict()
+
+	def __getattr__(self,name):
+		#Times are recomputed on first use after unpickling
+		if name in ('doy','jd','attrs') and 'interval' in self.__dict__:
+			self._times()
+			return getattr(self,name)
+		raise AttributeError(name)
+
 	def __getitem__(self,*args):
 		return self.interval.__getitem__(*args)
 
@@ -539,14 +1345,225 @@ class omni_event(object):
 			print("No interpolant for variable %s, creating %d point interpolant" % (var,len(self.jd.flatten())))
 			t,y = self.jd.flatten(),self.interval[var].flatten()
 			g = np.isfinite(y)
+			from scipy import interpolate
 			self.interpolants[var]=interpolate.PchipInterpolator(t[g],y[g])
 		#Return the interpolated result
 		return self.interpolants[var].__call__(jd,**kwargs)
 
+	def batch_interpolate(self,vars,jd,**kwargs):
+		"""
+		Interpolate several variables to many julian dates at once,
+		see omni_interval.batch_interpolate. Nothing is cached
+		"""
+		return self.interval.batch_interpolate(vars,jd,**kwargs)
+
 	def close(self):
 		"""Close the CDFs"""
-		for cdf in self.interval.cdfs:
-			cdf.close()
+		self.interval.close()
+
+def _interp_events(ts,ys,x):
+	"""
+	Linearly interpolate each of several events (lists of time and
+	value arrays, times relative to the event center) to the common
+	grid x. NaNs are skipped and nothing is extrapolated.
+	Returns a len(ts) x len(x) array.
+
+	All of the events' finite samples are concatenated, with each event
+	offset in time so the concatenation is sorted, and interpolated
+	with one np.interp call
+	"""
+	nevents = len(ts)
+	tgs,ygs = [],[]
+	for t,y in zip(ts,ys):
+		t,y = np.asarray(t,dtype=float).flatten(),np.asarray(y,dtype=float).flatten()
+		g = np.isfinite(y)
+		tgs.append(t[g])
+		ygs.append(y[g])
+	n_per_event = np.array([len(t) for t in tgs],dtype=int)
+	event_index = np.repeat(np.arange(nevents),n_per_event)
+	t_all,y_all = np.concatenate(tgs),np.concatenate(ygs)
+	iy = np.full((nevents,len(x)),np.nan)
+	if len(t_all) == 0:
+		return iy
+	half_width = max(np.max(np.abs(t_all)),np.max(np.abs(x)))
+	event_spacing = 4.*half_width+1.
+	xq = x.reshape(1,-1)+np.arange(nevents).reshape(-1,1)*event_spacing
+	iy[:,:] = np.interp(xq.ravel(),t_all+event_index*event_spacing,y_all).reshape(iy.shape)
+	#No extrapolation past each event's first or last finite sample
+	first = np.searchsorted(event_index,np.arange(nevents),side='left')
+	last = np.searchsorted(event_index,np.arange(nevents),side='right')-1
+	has_data = last >= first
+	t_first = np.where(has_data,t_all[np.minimum(first,len(t_all)-1)],np.inf)
+	t_last = np.where(has_data,t_all[np.clip(last,0,len(t_all)-1)],-np.inf)
+	outside = np.logical_or(x.reshape(1,-1) < t_first.reshape(-1,1),
+							x.reshape(1,-1) > t_last.reshape(-1,1))
+	iy[outside] = np.nan
+	return iy
+
+#Data shared with the worker processes of _run_in_pool (e.g. the
+#superposed epoch stack for the resampling workers)
+_worker_data = None
+
+def _init_worker(data):
+	global _worker_data
+	_worker_data = data
+
+def _run_in_pool(worker,data,tasks,nprocs=None):
+	"""
+	Results of worker(task) for each task, in order, with data sent once
+	to each worker process (as _worker_data) rather than with every task.
+	Tasks are spread across nprocs processes (default all cores, 1 runs
+	serially, as does a single task)
+	"""
+	if nprocs is None:
+		nprocs = os.cpu_count()
+	if nprocs == 1 or len(tasks) <= 1:
+		_init_worker(data)
+		return [worker(task) for task in tasks]
+	import concurrent.futures
+	with concurrent.futures.ProcessPoolExecutor(max_workers=min(nprocs,len(tasks)),
+					initializer=_init_worker,initargs=(data,)) as executor:
+		return list(executor.map(worker,tasks))
+
+def _bootstrap_worker(args):
+	"""
+	Percentile q of nsamples bootstrap resamplings (with replacement)
+	of the events in the stack, returns nsamples x len(x)
+	"""
+	q,nsamples,seed = args
+	iy = _worker_data
+	rng = np.random.default_rng(seed)
+	events = rng.integers(0,iy.shape[0],size=(nsamples,iy.shape[0]))
+	return np.nanpercentile(iy[events,:],q,axis=1)
+
+def _random_epoch_worker(args):
+	"""
+	Percentile q of nsamples random epoch realizations, in which
+	each event's zero epoch is moved to a random time in its own
+	window (the event's row of the stack is circularly shifted),
+	returns nsamples x len(x)
+	"""
+	q,nsamples,seed = args
+	iy = _worker_data
+	nevents,nx = iy.shape
+	rng = np.random.default_rng(seed)
+	shifts = rng.integers(0,nx,size=(nsamples,nevents,1))
+	cols = (np.arange(nx).reshape(1,1,-1)+shifts) % nx
+	return np.nanpercentile(iy[np.arange(nevents).reshape(1,-1,1),cols],q,axis=1)
+
+def _run_resampling(worker,iy,q,nsamples,seed=None,nprocs=None,max_elements=10000000):
+	"""
+	Run nsamples realizations of worker over the stack iy in chunks
+	small enough to keep each chunk's temporary under max_elements values,
+	spread across a pool of nprocs processes (nprocs=1 runs serially).
+	Chunking and seeding do not depend on nprocs, so for a given seed
+	the result is the same however many processes are used
+	"""
+	chunksize = max(1,int(max_elements//iy.size))
+	nchunks = int(np.ceil(nsamples/float(chunksize)))
+	seeds = np.random.SeedSequence(seed).spawn(nchunks)
+	chunks = [(q,min(chunksize,nsamples-ichunk*chunksize),seeds[ichunk]) for ichunk in range(nchunks)]
+	return np.concatenate(_run_in_pool(worker,iy,chunks,nprocs=nprocs),axis=0)
+
+def segment_reduce(fcn,y,i0,i1):
+	"""
+	fcn.reduceat (e.g. np.fmin or np.fmax) of y over the (possibly
+	overlapping) segments [i0,i1), NaN for empty segments
+	"""
+	i0,i1 = np.asarray(i0,dtype=int),np.asarray(i1,dtype=int)
+	out = np.full(i0.shape,np.nan)
+	nonempty = i1 > i0
+	if np.any(nonempty):
+		#Interleave starts and ends, the reductions over [i0,i1) are every other one
+		y = np.concatenate([np.asarray(y,dtype=float),[np.nan]])
+		indices = np.column_stack([i0[nonempty],i1[nonempty]]).flatten()
+		out[nonempty] = fcn.reduceat(y,indices)[::2]
+	return out
+
+def binned_percentiles(bin_index,values,nbins,q):
+	"""
+	Percentiles q (linear interpolation, like np.percentile) of values
+	grouped by integer bin_index (0..nbins-1), without a loop over bins.
+	Values are sorted by bin then by value, and each bin's percentile is
+	read off at its offset into the sorted array. Returns len(q) x nbins,
+	NaN for empty bins
+	"""
+	q = np.atleast_1d(np.asarray(q,dtype=float))
+	counts = np.bincount(bin_index,minlength=nbins)
+	order = np.lexsort((values,bin_index))
+	sorted_values = values[order]
+	starts = np.concatenate([[0],np.cumsum(counts)[:-1]])
+	out = np.full((len(q),nbins),np.nan)
+	has_data = counts > 0
+	if not np.any(has_data):
+		return out
+	pos = (counts[has_data]-1).reshape(1,-1)*(q.reshape(-1,1)/100.)
+	lo = np.floor(pos).astype(int)
+	hi = np.ceil(pos).astype(int)
+	start = starts[has_data].reshape(1,-1)
+	y_lo,y_hi = sorted_values[start+lo],sorted_values[start+hi]
+	out[:,has_data] = y_lo+(pos-lo)*(y_hi-y_lo)
+	return out
+
+def binned_superposed_epoch(t,y,centers,bin_edges,q=(25,50,75)):
+	"""
+	Superposed epoch statistics by binning instead of interpolating.
+	Every event's samples are placed in epoch time bins by their time
+	relative to the event center, with one np.digitize and np.bincount
+	pass over all of the events' samples together, so gaps stay gaps
+	and any data (not only OMNI) can be used.
+
+	t,y - either
+		lists of arrays, one time and one value array per event, or
+		single arrays holding a whole time series (e.g. satellite data,
+		sorted by time) from which each event's samples are taken
+	centers - array
+		the center (zero epoch) time of each event, same units as t
+	bin_edges - array
+		edges of the epoch time bins, relative to the centers
+
+	Returns a dict with the bin 'edges' and centers 'x', and for each
+	bin the number of finite samples 'count', the 'mean' and the
+	percentiles q 'percentiles' (len(q) x number of bins)
+	"""
+	bin_edges = np.asarray(bin_edges,dtype=float).flatten()
+	centers = np.asarray(centers,dtype=float).flatten()
+	if isinstance(t,(list,tuple)):
+		n_per_event = np.array([np.size(tt) for tt in t],dtype=int)
+		t_rel = np.concatenate([np.asarray(tt,dtype=float).flatten() for tt in t])-np.repeat(centers,n_per_event)
+		values = np.concatenate([np.asarray(yy,dtype=float).flatten() for yy in y])
+	else:
+		t,y = np.asarray(t,dtype=float).flatten(),np.asarray(y,dtype=float).flatten()
+		#Index ranges of the samples within the bins of each event
+		i_lo = np.searchsorted(t,centers+bin_edges[0],side='left')
+		i_hi = np.searchsorted(t,centers+bin_edges[-1],side='left')
+		n_per_event = i_hi-i_lo
+		event_index = np.repeat(np.arange(len(centers)),n_per_event)
+		sample_index = np.arange(np.sum(n_per_event))-np.repeat(np.cumsum(n_per_event)-n_per_event,n_per_event)+np.repeat(i_lo,n_per_event)
+		t_rel = t[sample_index]-centers[event_index]
+		values = y[sample_index]
+
+	nbins = len(bin_edges)-1
+	bin_index = np.digitize(t_rel,bin_edges)-1
+	g = np.logical_and(np.isfinite(values),np.logical_and(bin_index>=0,bin_index<nbins))
+	bin_index,values = bin_index[g],values[g]
+	count = np.bincount(bin_index,minlength=nbins)
+	with np.errstate(invalid='ignore',divide='ignore'):
+		mean = np.bincount(bin_index,weights=values,minlength=nbins)/count
+	return {'edges':bin_edges,
+			'x':(bin_edges[:-1]+bin_edges[1:])/2.,
+			'count':count,
+			'mean':mean,
+			'q':q,
+			'percentiles':binned_percentiles(bin_index,values,nbins,q)}
+
+def _plot_percentile_bands(ax,x,y_lq,y_med,y_uq,lab,**kwargs):
+	"""Median line and shaded interquartile band used by the SEA classes"""
+	ax.plot(x,y_med,label=lab, linestyle='-',zorder=10,**kwargs)
+	ax.plot(x,y_lq,linestyle=':',zorder=10,**kwargs)
+	ax.plot(x,y_uq,linestyle=':',zorder=10,**kwargs)
+	ax.legend()
+	ax.fill_between(x,y_lq,y_uq,color = 'b' if 'color' not in kwargs else kwargs['color'],alpha=.1,zorder=7)
 
 class omni_sea(object):
 	def __init__(self,center_ymdhm_list,name=None,ndays=3,cadence='5min',cdf_or_txt='cdf'):
@@ -563,10 +1580,29 @@ class omni_sea(object):
 		self.events = [omni_event(center_dt-datetime.timedelta(days=ndays),center_dt+datetime.timedelta(days=ndays),cadence=cadence,cdf_or_txt=cdf_or_txt) for center_dt in self.center_dts ]
 		#mirror the attributes of the first event's last CDF
 		self.attrs = self.events[0].attrs
+		#Interpolated events x times arrays, see stack
+		self._stack_cache = dict()
+
+	def __getstate__(self):
+		"""Pickle without the cached stacks, the events reopen their files on first use"""
+		state = self.__dict__.copy()
+		state['_stack_cache'] = dict()
+		state.pop('attrs',None)
+		return state
+
+	def __setstate__(self,state):
+		self.__dict__.update(state)
+
+	def __getattr__(self,name):
+		if name == 'attrs' and 'events' in self.__dict__:
+			self.attrs = self.events[0].attrs
+			return self.attrs
+		raise AttributeError(name)
 
 	def plot_individual(self,ax,var,show=False,cmap=None,text_kwargs=None,plot_kwargs=None):
 		""" Plot all individual intervals labeled at their maxima"""
 		if cmap == None:
+			mpl,pp = _matplotlib()
 			norm = mpl.colors.Normalize(vmin=0,vmax=len(self.center_jds))
 			cmap = mpl.cm.get_cmap('hot')
 		for i,(event,center_jd) in enumerate(zip(self.events,self.center_jds)):
@@ -578,6 +1614,7 @@ class omni_sea(object):
 			text_kwargs = {'backgroundcolor':'grey','alpha':.7,'ha':'center'} if text_kwargs is None else text_kwargs
 			ax.text(t[maxind],y[maxind],event.label,**text_kwargs)
 		if show:
+			mpl,pp = _matplotlib()
 			pp.show()
 			pp.pause(10)
 
@@ -585,55 +1622,175 @@ class omni_sea(object):
 		"""Get a variable attribute from the last CDF in the interval"""
 		return self.events[0].get_var_attr(var,att)
 
-	def plot_stats(self,ax,var,x=None,xstep=0.042,show=False,plot_events=False,**kwargs):
-		"""Default to having 1 hour steps for interpolation"""
+	def _default_x(self,xstep):
+		"""Epoch time grid in days, default to having 1 hour steps"""
+		return np.arange(-1*self.ndays,self.ndays+xstep,xstep)
+
+	def _stack_var(self,var,x,method):
+		"""
+		Interpolate one variable from every event to x days
+		since the event's center, returns nevents x len(x)
+		"""
+		if method == 'pchip':
+			iy = np.zeros((self.nevents,len(x)))
+			for i,(event,center_jd) in enumerate(zip(self.events,self.center_jds)):
+				iy[i,:] = event.interpolate(var,x+center_jd)
+			return iy
+		elif method != 'linear':
+			raise ValueError('Invalid interpolation method %s, valid values are "linear" and "pchip"' % (method))
+
+		ts,ys = [],[]
+		for event,center_jd in zip(self.events,self.center_jds):
+			ts.append(event.jd.flatten()-center_jd)
+			ys.append(event[var])
+		return _interp_events(ts,ys,x)
+
+	def stack(self,vars,x=None,xstep=0.042,method='linear'):
+		"""
+		Superposed epoch stack, an array of shape nevents x len(x) x len(vars)
+		of each variable interpolated to x days since each event's center.
+
+		method='linear' interpolates all events in one vectorized pass,
+		method='pchip' builds a PchipInterpolator for each event (slower).
+		Results are cached per variable, grid and method, so percentiles,
+		plotting and CSV output with the same settings reuse one interpolation
+		"""
+		if isinstance(vars,str):
+			vars = [vars]
 		if x is None:
-			x = np.arange(-1*self.ndays,self.ndays+xstep,xstep)
+			x = self._default_x(xstep)
+		x = np.asarray(x,dtype=float).flatten()
+		iys = []
+		for var in vars:
+			key = (var,method,x.tobytes())
+			if key not in self._stack_cache:
+				self._stack_cache[key] = self._stack_var(var,x,method)
+			iys.append(self._stack_cache[key])
+		return np.stack(iys,axis=-1)
+
+	def percentiles(self,var,q=(25,50,75),x=None,xstep=0.042,method='linear'):
+		"""
+		Percentiles q of the superposed epoch stack of var at each time in x,
+		returns a len(q) x len(x) array
+		"""
+		iy = self.stack([var],x=x,xstep=xstep,method=method)[:,:,0]
+		return np.nanpercentile(iy,q,axis=0)
 
-		iy = np.zeros((len(self.center_jds),len(x)))
-		for i,(event,center_jd) in enumerate(zip(self.events,self.center_jds)):
-			t,y = event.jd-center_jd, event[var]
-			iy[i,:] = event.interpolate(var,x+center_jd)
+	def bootstrap(self,var,q=50,nboot=1000,ci=95.,x=None,xstep=0.042,method='linear',nprocs=None,seed=None):
+		"""
+		Bootstrap confidence band on percentile q (default the median) of var
+		at each epoch time, from nboot resamplings of the events with replacement.
+		Resamplings are computed from the cached stack (see stack) in
+		a pool of nprocs processes.
 
+		Returns a dict with the epoch times 'x', the percentile of the
+		actual events 'statistic' and the ci% band 'lower','upper'
+		"""
+		iy = self.stack([var],x=x,xstep=xstep,method=method)[:,:,0]
+		samples = _run_resampling(_bootstrap_worker,iy,q,nboot,seed=seed,nprocs=nprocs)
+		lower,upper = np.nanpercentile(samples,[(100.-ci)/2.,100.-(100.-ci)/2.],axis=0)
+		return {'x':self._default_x(xstep) if x is None else np.asarray(x,dtype=float).flatten(),
+				'q':q,'ci':ci,'nboot':nboot,
+				'statistic':np.nanpercentile(iy,q,axis=0),
+				'lower':lower,'upper':upper}
+
+	def random_epoch_test(self,var,q=50,nrand=1000,ci=95.,x=None,xstep=0.042,method='linear',nprocs=None,seed=None):
+		"""
+		Monte Carlo significance of percentile q (default the median)
+		of var at each epoch time against random epochs. In each of
+		nrand realizations every event's zero epoch is moved to a random
+		time in its own window, so no new data is loaded.
+		Realizations are computed from the cached stack (see stack)
+		in a pool of nprocs processes.
+
+		Returns a dict with the epoch times 'x', the percentile of the
+		actual events 'statistic', the ci% range of the null
+		distribution 'null_lower','null_upper' and the two-sided
+		p-value at each epoch time 'pvalue'
+		"""
+		iy = self.stack([var],x=x,xstep=xstep,method=method)[:,:,0]
+		null = _run_resampling(_random_epoch_worker,iy,q,nrand,seed=seed,nprocs=nprocs)
+		statistic = np.nanpercentile(iy,q,axis=0)
+		null_center = np.nanmedian(null,axis=0)
+		n_as_extreme = np.sum(np.abs(null-null_center) >= np.abs(statistic-null_center),axis=0)
+		null_lower,null_upper = np.nanpercentile(null,[(100.-ci)/2.,100.-(100.-ci)/2.],axis=0)
+		return {'x':self._default_x(xstep) if x is None else np.asarray(x,dtype=float).flatten(),
+				'q':q,'ci':ci,'nrand':nrand,
+				'statistic':statistic,
+				'null_lower':null_lower,'null_upper':null_upper,
+				'pvalue':(n_as_extreme+1.)/(nrand+1.)}
+
+	def binned_stats(self,var,bin_edges=None,xstep=0.042,q=(25,50,75)):
+		"""
+		Superposed epoch statistics of var from the events' samples
+		binned by epoch time (days), no interpolation, see
+		binned_superposed_epoch. Default bins are xstep wide
+		"""
+		if bin_edges is None:
+			bin_edges = self._default_x(xstep)
+		ts = [event.jd.flatten() for event in self.events]
+		ys = [event[var] for event in self.events]
+		return binned_superposed_epoch(ts,ys,self.center_jds,bin_edges,q=q)
+
+	def plot_stats(self,ax,var,x=None,xstep=0.042,show=False,plot_events=False,method='linear',
+					bootstrap=None,significance=None,alpha=.05,**kwargs):
+		"""
+		Default to having 1 hour steps for interpolation
+
+		Optionally also draw a confidence band from bootstrap (the result
+		of omni_sea.bootstrap) and the random epoch null range and epoch times
+		with p-value < alpha from significance (the result of
+		omni_sea.random_epoch_test)
+		"""
+		if x is None:
+			x = self._default_x(xstep)
+
+		iy = self.stack([var],x=x,method=method)[:,:,0]
+		if plot_events:
 			#Plot points
-			#Get len(x) random numbers from -.5 - .5
-			jitter = np.random.rand(*x.flatten().shape)-.5
+			#Get len(x) random numbers from -.5 - .5 for each event
+			jitter = np.random.rand(*iy.shape)-.5
 			#Scale
 			jitter = jitter*xstep/3
 			#Plot jittered points
-			if plot_events:
-				ax.plot(x.flatten()+jitter.flatten(),iy[i,:].flatten(),'.',
-					color='b' if 'color' not in kwargs else kwargs['color'], 
-					zorder=5.,alpha=.1)
-		y_med,y_lq,y_uq = np.nanmedian(iy,axis=0),np.nanpercentile(iy,25,axis=0),np.nanpercentile(iy,75,axis=0)
+			ax.plot((x.reshape(1,-1)+jitter).flatten(),iy.flatten(),'.',
+				color='b' if 'color' not in kwargs else kwargs['color'], 
+				zorder=5.,alpha=.1)
+		y_lq,y_med,y_uq = np.nanpercentile(iy,[25,50,75],axis=0)
 		lab = '' if self.name is None else '%s: ' % (self.name)
 		lab += 'Median %s Response' % (var)
-		ax.plot(x,y_med,label=lab, linestyle='-',zorder=10,**kwargs)
-		ax.plot(x,y_lq,linestyle=':',zorder=10,**kwargs)
-		ax.plot(x,y_uq,linestyle=':',zorder=10,**kwargs)
+		_plot_percentile_bands(ax,x,y_lq,y_med,y_uq,lab,**kwargs)
+		color = 'b' if 'color' not in kwargs else kwargs['color']
+		if bootstrap is not None:
+			ax.fill_between(bootstrap['x'],bootstrap['lower'],bootstrap['upper'],
+				facecolor='none',edgecolor=color,hatch='//',linewidth=0.,zorder=8,
+				label='%g%% CI (bootstrap)' % (bootstrap['ci']))
+		if significance is not None:
+			ax.plot(significance['x'],significance['null_lower'],linestyle='--',color='grey',zorder=9)
+			ax.plot(significance['x'],significance['null_upper'],linestyle='--',color='grey',zorder=9,
+				label='%g%% random epoch range' % (significance['ci']))
+			signif = significance['pvalue'] < alpha
+			ax.plot(significance['x'][signif],significance['statistic'][signif],'*',color=color,zorder=11,
+				label='p < %g' % (alpha))
+		if bootstrap is not None or significance is not None:
+			ax.legend()
 		#Put units on the y axis
 		un = self.get_var_attr(var,'UNITS')
 		un = '' if un is None else '[%s]' % (un)
 		ax.set_ylabel(var+un)
-		ax.legend()
-		ax.fill_between(x,y_lq,y_uq,color = 'b' if 'color' not in kwargs else kwargs['color'],alpha=.1,zorder=7)
 		if show:
+			mpl,pp = _matplotlib()
 			pp.show()
 			pp.pause(10)
 
-	def dump_stats(self,var,csvdir,csvfn=None,x=None,xstep=0.042):
+	def dump_stats(self,var,csvdir,csvfn=None,x=None,xstep=0.042,method='linear'):
 		"""
 		Writes superposed epoch analysis results to a CSV file
 		"""
 		if x is None:
-			x = np.arange(-1*self.ndays,self.ndays+xstep,xstep)
+			x = self._default_x(xstep)
 
-		iy = np.zeros((len(self.center_jds),len(x)))
-		for i,(event,center_jd) in enumerate(zip(self.events,self.center_jds)):
-			t,y = event.jd-center_jd, event[var]
-			iy[i,:] = event.interpolate(var,x+center_jd)
-
-		y_med,y_lq,y_uq = np.nanmedian(iy,axis=0),np.nanpercentile(iy,25,axis=0),np.nanpercentile(iy,75,axis=0)
+		y_lq,y_med,y_uq = self.percentiles(var,q=[25,50,75],x=x,method=method)
 		header = '' if self.name is None else '# %s: \n' % (self.name)
 		header += '# Omni Cadence: %s\n' % (self.cadence)
 		header += '# First Event: %s\n' % (self.events[0].label)
@@ -656,16 +1813,228 @@ class omni_sea(object):
 		with open(os.path.join(csvdir,csvfn),'w') as f:
 			f.write(header)
 			print(header)
-			for i in range(len(t.flatten())):
-				ln = '%.5f,%e,%e,%e\n' % (t[i],y_lq[i],y_med[i],y_uq[i])
+			for i in range(len(x)):
+				ln = '%.5f,%e,%e,%e\n' % (x[i],y_lq[i],y_med[i],y_uq[i])
 				f.write(ln)
 				print(ln)
 
+class p2_quantile_sketch(object):
+	def __init__(self,nbins,q=(25,50,75)):
+		"""
+		Streaming estimates of the percentiles q of the values
+		in each of nbins bins, using the P-squared algorithm
+		(Jain and Chlamtac, 1985, doi:10.1145/4372.4378), vectorized
+		across bins and percentiles. Memory is 5 markers per bin per
+		percentile, no matter how many values are added.
+
+		P-squared is exact for the first 5 values in a bin and
+		typically within a few percent of the data's standard deviation
+		after a few hundred values for unimodal distributions
+		"""
+		self.nbins = nbins
+		self.q = np.atleast_1d(np.asarray(q,dtype=float))
+		p = self.q/100.
+		nq = len(self.q)
+		#Marker heights, actual and desired positions (1-based)
+		self.heights = np.full((nq,nbins,5),np.nan)
+		self.positions = np.tile(np.arange(1.,6.),(nq,nbins,1))
+		initial_desired = np.column_stack([np.ones_like(p),1.+2*p,1.+4*p,3.+2*p,5.*np.ones_like(p)])
+		self.desired = np.tile(initial_desired[:,np.newaxis,:],(1,nbins,1))
+		self.increments = np.column_stack([np.zeros_like(p),p/2.,p,(1.+p)/2.,np.ones_like(p)])[:,np.newaxis,:]
+		#The first five values in each bin are kept as is
+		self.first_values = np.full((nbins,5),np.nan)
+		self.count = np.zeros((nbins,),dtype=int)
+
+	def add(self,values):
+		"""
+		Add one value to each bin (a len(nbins) array, NaNs are ignored)
+		"""
+		values = np.asarray(values,dtype=float).flatten()
+		g = np.isfinite(values)
+		starting = np.logical_and(g,self.count<5)
+		self.first_values[starting,self.count[starting]] = values[starting]
+		running = np.logical_and(g,self.count>=5)
+		self.count[g] += 1
+		#Bins which just got their fifth value initialize the markers
+		initializing = np.logical_and(starting,self.count==5)
+		if np.count_nonzero(initializing) > 0:
+			self.heights[:,initializing,:] = np.sort(self.first_values[initializing,:],axis=1)
+		if np.count_nonzero(running) > 0:
+			self._update(np.flatnonzero(running),values[running])
+
+	def _update(self,bins,x):
+		h = self.heights[:,bins,:]
+		n = self.positions[:,bins,:]
+		x = np.broadcast_to(x.reshape(1,-1),h.shape[:2]).copy()
+		#Cell k containing x, extending the extreme markers if needed
+		h[:,:,0] = np.minimum(h[:,:,0],x)
+		h[:,:,4] = np.maximum(h[:,:,4],x)
+		k = np.clip(np.sum(x[:,:,np.newaxis] >= h[:,:,1:4],axis=2),0,3)
+		n += (np.arange(5).reshape(1,1,5) > k[:,:,np.newaxis])
+		desired = self.desired[:,bins,:]+self.increments
+		#Adjust the three middle markers
+		for i in [1,2,3]:
+			d = desired[:,:,i]-n[:,:,i]
+			move = np.logical_or(np.logical_and(d>=1.,n[:,:,i+1]-n[:,:,i]>1.),
+								np.logical_and(d<=-1.,n[:,:,i-1]-n[:,:,i]<-1.))
+			d = np.sign(d)*move
+			#Piecewise parabolic prediction
+			hp = h[:,:,i]+d/(n[:,:,i+1]-n[:,:,i-1])*(
+				(n[:,:,i]-n[:,:,i-1]+d)*(h[:,:,i+1]-h[:,:,i])/(n[:,:,i+1]-n[:,:,i])
+				+(n[:,:,i+1]-n[:,:,i]-d)*(h[:,:,i]-h[:,:,i-1])/(n[:,:,i]-n[:,:,i-1]))
+			#Fall back to linear if it would leave the markers out of order
+			parabolic_ok = np.logical_and(h[:,:,i-1]<hp,hp<h[:,:,i+1])
+			neighbor = np.where(d>0,i+1,i-1)
+			h_nb = np.take_along_axis(h,neighbor[:,:,np.newaxis],axis=2)[:,:,0]
+			n_nb = np.take_along_axis(n,neighbor[:,:,np.newaxis],axis=2)[:,:,0]
+			with np.errstate(invalid='ignore',divide='ignore'):
+				hl = h[:,:,i]+d*(h_nb-h[:,:,i])/(n_nb-n[:,:,i])
+			h[:,:,i] = np.where(move,np.where(parabolic_ok,hp,hl),h[:,:,i])
+			n[:,:,i] += d
+		self.heights[:,bins,:] = h
+		self.positions[:,bins,:] = n
+		self.desired[:,bins,:] = desired
+
+	def percentiles(self):
+		"""
+		Current len(q) x nbins estimate of the percentiles, exact
+		for bins with fewer than five values, NaN for empty bins
+		"""
+		est = self.heights[:,:,2].copy()
+		few = np.logical_and(self.count>0,self.count<5)
+		if np.count_nonzero(few) > 0:
+			est[:,few] = np.nanpercentile(self.first_values[few,:],self.q,axis=1)
+		return est
+
+class running_moments(object):
+	def __init__(self,nbins):
+		"""
+		Running count, mean and variance of the values in each
+		of nbins bins (Welford's algorithm), NaNs are ignored
+		"""
+		self.count = np.zeros((nbins,),dtype=int)
+		self.mean = np.full((nbins,),np.nan)
+		self.m2 = np.zeros((nbins,))
+
+	def add(self,values):
+		values = np.asarray(values,dtype=float).flatten()
+		g = np.isfinite(values)
+		self.count[g] += 1
+		first = np.logical_and(g,self.count==1)
+		self.mean[first] = 0.
+		delta = values[g]-self.mean[g]
+		self.mean[g] += delta/self.count[g]
+		self.m2[g] += delta*(values[g]-self.mean[g])
+
+	def var(self,ddof=1):
+		with np.errstate(invalid='ignore',divide='ignore'):
+			return np.where(self.count>ddof,self.m2/(self.count-ddof),np.nan)
+
+	def std(self,ddof=1):
+		return np.sqrt(self.var(ddof=ddof))
+
+class omni_sea_stream(object):
+	def __init__(self,vars,name=None,ndays=3,cadence='5min',x=None,xstep=0.042,q=(25,50,75),cdf_or_txt='cdf'):
+		"""
+		Superposed epoch analysis for very large numbers of events.
+		Events are added one at a time, interpolated (linearly) to the
+		epoch grid x and folded into per-bin percentile sketches and
+		running moments, so memory is proportional to len(x), not to
+		the number of events. Percentiles are approximate,
+		see p2_quantile_sketch.
+		"""
+		self.vars = [vars] if isinstance(vars,str) else list(vars)
+		self.name = name
+		self.ndays = ndays
+		self.cadence = cadence
+		self.cdf_or_txt = cdf_or_txt
+		self.x = np.arange(-1*ndays,ndays+xstep,xstep) if x is None else np.asarray(x,dtype=float).flatten()
+		self.xstep = xstep
+		self.q = q
+		self.nevents = 0
+		self.sketches = {var:p2_quantile_sketch(len(self.x),q=q) for var in self.vars}
+		self.moments = {var:running_moments(len(self.x)) for var in self.vars}
+		self.attrs = None
+		self.units = dict()
+		self.first_label,self.last_label = None,None
+
+	def add_values(self,var,y):
+		"""Add one event's values for var, already on the epoch grid x"""
+		self.sketches[var].add(y)
+		self.moments[var].add(y)
+
+	def add_event(self,center_ymdhm):
+		"""
+		Load the data around one event center [y,mo,d,h,m], add it
+		to the statistics of every variable and close its files
+		"""
+		[y,mo,d,h,m] = center_ymdhm
+		center_dt = datetime.datetime(y,mo,d,h)+datetime.timedelta(minutes=m)
+		center_jd = special_datetime.datetimearr2unixtime([center_dt])[0,0]/86400.+2440587.5
+		event = omni_event(center_dt-datetime.timedelta(days=self.ndays),
+							center_dt+datetime.timedelta(days=self.ndays),
+							cadence=self.cadence,cdf_or_txt=self.cdf_or_txt)
+		t = event.jd.flatten()-center_jd
+		for var in self.vars:
+			self.add_values(var,_interp_events([t],[event[var]],self.x)[0,:])
+			if var not in self.units:
+				self.units[var] = event.get_var_attr(var,'UNITS')
+		if self.attrs is None:
+			self.attrs = event.attrs
+			self.first_label = event.label
+		self.last_label = event.label
+		self.nevents += 1
+		event.close()
+
+	def add_events(self,center_ymdhm_list):
+		for center_ymdhm in center_ymdhm_list:
+			self.add_event(center_ymdhm)
+
+	def percentiles(self,var):
+		"""Approximate percentiles q of var, a len(q) x len(x) array"""
+		return self.sketches[var].percentiles()
+
+	def mean(self,var):
+		return self.moments[var].mean.copy()
+
+	def std(self,var,ddof=1):
+		return self.moments[var].std(ddof=ddof)
+
+	def count(self,var):
+		"""Number of events with a finite value at each epoch time"""
+		return self.moments[var].count.copy()
+
+	def plot_stats(self,ax,var,show=False,**kwargs):
+		"""Plot the median and quartiles (q must include 25, 50 and 75)"""
+		qs = list(self.sketches[var].q)
+		est = self.percentiles(var)
+		y_lq,y_med,y_uq = [est[qs.index(qq),:] for qq in [25.,50.,75.]]
+		lab = '' if self.name is None else '%s: ' % (self.name)
+		lab += 'Median %s Response' % (var)
+		_plot_percentile_bands(ax,self.x,y_lq,y_med,y_uq,lab,**kwargs)
+		un = self.units.get(var,None)
+		un = '' if un is None else '[%s]' % (un)
+		ax.set_ylabel(var+un)
+		if show:
+			mpl,pp = _matplotlib()
+			pp.show()
+			pp.pause(10)
+
 class omni_interval_delay_smooth(object):
+    #Slop allowed when comparing timestamps to window edges [seconds]
+    #(text file Epochs are computed from fractional day of year)
+    time_tolerance_secs = 1.
+
     def __init__(self,startdt,enddt,cadence,delay_mins=10,avg_mins=45):
         """
         Create lagged and smoothed 1-minute omniweb solar wind data
         appropriately for driving CS10
+
+        The lag and the backward averaging window are defined on the
+        Epoch timestamps instead of on a number of array elements, so
+        data gaps and changes of cadence do not shift the windows.
+        The value at time t is the mean of the finite samples with
+        Epoch in (t-delay_mins-avg_mins,t-delay_mins]
         """
         self.startdt=startdt
         self.enddt=enddt
@@ -676,71 +2045,169 @@ class omni_interval_delay_smooth(object):
         self.delayed_startdt = delayed_startdt
         self.oi = omni_interval(delayed_startdt,enddt,cadence)
         self.dts = self.oi['Epoch']
-        self.jds = special_datetime.datetimearr2jd(self.dts).flatten()
+        #Seconds since 1970, used for all of the window searches
+        self.t = special_datetime.datetimearr2unixtime(self.dts).flatten()
+        self.jds = self.t/86400.+2440587.5
 
     def __getitem__(self,varname):
-    	if varname == 'Epoch':
-    		return self.dts
-    	else:
-    		return self._lagged_smoothed(self.oi[varname])
-        
-    def _mins2elements(self,jd,n_mins):
-        """
-        Calculate the number of elements
-        of a time variable jd that has
-        units of days that corresponds 
-        to n_mins minutes.
+        if varname == 'Epoch':
+            return self.dts
+        else:
+            return self._lagged_smoothed(self.oi[varname])
+
+    def _window_bounds(self,t,start_mins,end_mins):
         """
-        delta_t = np.nanmedian(np.diff(jd*24.*60.))
-        if delta_t <= 0.:
-            raise RuntimeError('Negative or zero delta-t'
-                                +' (%f minutes) for avg/lag' % (delta_t)) 
-        n_elements = int(np.round(n_mins/delta_t))
-        print('%d minutes convertes to %d elements' % (n_mins,n_elements))
-        return n_elements
-
-    def _delay(self,jd,y,n_mins):
-        """	
-        Lag an array n_mins minutes
-        relative to a time variable in units of days (jd)
+        Find the indices bounding the window (t-start_mins,t-end_mins]
+        for every time in t (seconds, sorted), so that
+        t[i_lo[k]:i_hi[k]] are the samples in the window for t[k].
+        Two searchsorted calls, so O(n log n)
         """
-        #Calculate number of elements to lag by
-        n_elements = self._mins2elements(jd,n_mins)
-        y_delay = np.roll(y,-1*n_elements)
-        y_delay[:n_elements] = np.nan
-        return y_delay
+        tol = self.time_tolerance_secs
+        i_lo = np.searchsorted(t,t-start_mins*60.+tol,side='right')
+        i_hi = np.searchsorted(t,t-end_mins*60.+tol,side='right')
+        return i_lo,i_hi
 
-    def _backward_smooth(self,jd,y,n_mins):
+    def _backward_smooth(self,t,y,n_mins,lag_mins=0.):
         """
-        Backward smooth a variable y for n_mins minutes using
-        a time variable jd in units of days
+        Backward smooth a variable y for n_mins minutes,
+        after lagging it lag_mins minutes, using a time variable t
+        in units of seconds. NaNs are excluded from the averages,
+        windows with no finite samples, or which begin before
+        the first sample, are NaN
         """
-        n_elements = self._mins2elements(jd,n_mins)
-        y_smooth = np.zeros_like(y)
-        lagged_ys = [np.roll(y,i) for i in range(n_elements)]
-        lagged_ys_arr = np.column_stack(lagged_ys)
-        y_smooth = np.nanmean(lagged_ys_arr,axis=1)
-        y_smooth[:n_elements] = np.nan # Clean up wraparound
+        y = np.asarray(y,dtype=float).flatten()
+        i_lo,i_hi = self._window_bounds(t,lag_mins+n_mins,lag_mins)
+        #Window sums from cumulative sums of the finite values
+        g = np.isfinite(y)
+        csum = np.concatenate([[0.],np.cumsum(np.where(g,y,0.))])
+        ccount = np.concatenate([[0],np.cumsum(g)])
+        n_in_window = ccount[i_hi]-ccount[i_lo]
+        y_smooth = np.full(y.shape,np.nan)
+        has_data = n_in_window > 0
+        y_smooth[has_data] = (csum[i_hi]-csum[i_lo])[has_data]/n_in_window[has_data]
+        #Clean up incomplete windows at the start
+        incomplete = t-(lag_mins+n_mins)*60.+self.time_tolerance_secs < t[0]
+        y_smooth[incomplete] = np.nan
         return y_smooth
 
     def _lagged_smoothed(self,y):
-    	"""
-    	Use class variables to define
-    	lag and smoothing interval and 
-    	jd
-    	"""
-    	return self._backward_smooth(self.jds,
-    								self._delay(self.jds,y,self.delay_mins),
-    								self.avg_mins)
+        """
+        Use class variables to define
+        lag and smoothing interval and
+        timestamps
+        """
+        return self._backward_smooth(self.t,y,self.avg_mins,
+                                    lag_mins=self.delay_mins)
+
+
+class omni_realtime_delay_smooth(object):
+    #Same slop as the batch class, so that replays give identical windows
+    time_tolerance_secs = omni_interval_delay_smooth.time_tolerance_secs
+
+    def __init__(self,varnames,delay_mins=10,avg_mins=45,cadence_mins=1.,buffer_size=None):
+        """
+        Incremental counterpart to omni_interval_delay_smooth for
+        nowcasting. Samples are pushed one at a time in time order and
+        the lagged, smoothed value of each variable is returned right
+        away, using the same windows as the batch class.
+
+        A fixed size ring buffer holds the samples which are in, or
+        have yet to enter, the averaging window, and running sums of
+        the finite values in the window are updated as samples enter
+        and leave it, so each push costs O(1).
+
+        varnames - list
+            names of the variables which will be pushed
+        cadence_mins - float
+            nominal time between samples, used to size the ring buffer
+        buffer_size - int, optional
+            override the ring buffer length (needed if samples may
+            arrive faster than cadence_mins)
+        """
+        self.varnames = list(varnames)
+        self.delay_mins = delay_mins
+        self.avg_mins = avg_mins
+        if buffer_size is None:
+            buffer_size = int(np.ceil((delay_mins+avg_mins)/float(cadence_mins)))+2
+        self.buffer_size = buffer_size
+        nvars = len(self.varnames)
+        self.t_buf = np.full((buffer_size,),np.nan)
+        self.y_buf = np.full((buffer_size,nvars),np.nan)
+        #Running counters of samples pushed, entered into
+        #and left the window. Buffer position is counter % buffer_size
+        self.n_pushed = 0
+        self.n_entered = 0
+        self.n_left = 0
+        self.window_sum = np.zeros((nvars,))
+        self.window_count = np.zeros((nvars,),dtype=int)
+        self.first_t = None
+        self.last_t = None
+
+    def _add(self,i,sign):
+        y = self.y_buf[i % self.buffer_size,:]
+        g = np.isfinite(y)
+        self.window_sum[g] += sign*y[g]
+        self.window_count[g] += sign
+        #Reset empty windows so roundoff can't accumulate
+        self.window_sum[self.window_count==0] = 0.
+
+    def push(self,epoch,values):
+        """
+        Add the sample at datetime epoch. values is a dict keyed
+        by variable name or a sequence in the order of varnames.
+        Returns a dict of the lagged, smoothed value of each variable
+        at epoch (NaN until a full window has been seen)
+        """
+        t = (epoch-datetime.datetime(1970,1,1)).total_seconds()
+        if self.last_t is not None and t <= self.last_t:
+            raise ValueError('Samples must be pushed in time order'
+                             +' (%s is not after the last sample)' % (str(epoch)))
+        if isinstance(values,dict):
+            values = [values[varname] for varname in self.varnames]
+        if self.first_t is None:
+            self.first_t = t
+        self.last_t = t
+
+        tol = self.time_tolerance_secs
+        window_start = t-(self.delay_mins+self.avg_mins)*60.
+        window_end = t-self.delay_mins*60.
+
+        #Drop samples which are now older than the window
+        while self.n_left < self.n_pushed and self.t_buf[self.n_left % self.buffer_size] <= window_start+tol:
+            if self.n_left < self.n_entered:
+                self._add(self.n_left,-1)
+            self.n_left += 1
+        self.n_entered = max(self.n_entered,self.n_left)
+
+        if self.n_pushed-self.n_left >= self.buffer_size:
+            raise RuntimeError('Ring buffer of %d samples is full, ' % (self.buffer_size)
+                               +'samples are arriving faster than cadence_mins, increase buffer_size')
+        i = self.n_pushed % self.buffer_size
+        self.t_buf[i] = t
+        self.y_buf[i,:] = values
+        self.n_pushed += 1
+
+        #Admit samples which the end of the window has reached
+        while self.n_entered < self.n_pushed and self.t_buf[self.n_entered % self.buffer_size] <= window_end+tol:
+            self._add(self.n_entered,1)
+            self.n_entered += 1
+
+        y_smooth = np.full((len(self.varnames),),np.nan)
+        if window_start+tol >= self.first_t:
+            has_data = self.window_count > 0
+            y_smooth[has_data] = self.window_sum[has_data]/self.window_count[has_data]
+        return dict(zip(self.varnames,y_smooth))
 
 
 if __name__ == '__main__':
-	available_formats = ['cdf','txt'] if spacepy_is_available else ['txt']
+	mpl,pp = _matplotlib()
+	available_formats = ['cdf','txt'] if _import_pycdf() else ['txt']
 	for source_format in available_formats:
 		print("Producing superposed epoch plots")
 
 		import seaborn as sns
 		#Test on a few Storm Sudden Commencement Events
+		#(omnievents.find_sudden_impulses builds full catalogs of these)
 		storm_sudden_commencement = [
 		[2007,11,19,18,10.3],
 		[2010,4,5,8,26],
@@ -0,0 +1,377 @@
+"""
+	omnirollup.py
+	Pre-aggregated (rolled up) OMNI statistics. For each variable the
+	count, mean, min, max and percentiles in every hour, day, 27-day
+	Bartels rotation and year are computed once, in one pass over the
+	archive, and stored as small numpy files. Long range plots and
+	climatology queries then read the level of the right resolution
+	instead of reloading decades of data.
+"""
+import os, datetime
+import numpy as np
+from geospacepy import omnireader, special_datetime
+
+rollup_levels = ['hourly','daily','bartels','yearly']
+
+#Approximate length of each level's bins in seconds, for choosing a level
+level_seconds = {'hourly':3600.,'daily':86400.,'bartels':27*86400.,'yearly':365.25*86400.}
+
+#Bartels rotation 1 began on 8 February 1832
+bartels_epoch = (np.datetime64('1832-02-08T00:00:00','s')-np.datetime64('1970-01-01T00:00:00','s')).astype(float)
+
+def level_bin_index(t,level):
+	"""
+	Integer bin number of times t (seconds since 1970) at a rollup level.
+	For 'bartels' this is the Bartels rotation number, for 'yearly' the year
+	"""
+	t = np.asarray(t,dtype=float)
+	if level == 'hourly':
+		return np.floor(t/3600.).astype(np.int64)
+	elif level == 'daily':
+		return np.floor(t/86400.).astype(np.int64)
+	elif level == 'bartels':
+		return np.floor((t-bartels_epoch)/(27*86400.)).astype(np.int64)+1
+	elif level == 'yearly':
+		return np.floor(t).astype(np.int64).astype('datetime64[s]').astype('datetime64[Y]').astype(np.int64)+1970
+	else:
+		raise ValueError('Invalid rollup level %s, valid values are %s' % (level,str(rollup_levels)))
+
+def level_bin_start(index,level):
+	"""Start time (seconds since 1970) of bins at a rollup level"""
+	index = np.asarray(index,dtype=np.int64)
+	if level == 'hourly':
+		return index*3600.
+	elif level == 'daily':
+		return index*86400.
+	elif level == 'bartels':
+		return bartels_epoch+(index-1)*27*86400.
+	elif level == 'yearly':
+		return (index-1970).astype('datetime64[Y]').astype('datetime64[s]').astype(np.int64).astype(float)
+	else:
+		raise ValueError('Invalid rollup level %s, valid values are %s' % (level,str(rollup_levels)))
+
+def rollup_filename(rollup_dir,cadence,var,level):
+	return os.path.join(rollup_dir,cadence,'%s_%s.npz' % (var,level))
+
+def compress_sketch(means,weights,size):
+	"""
+	Merge weighted values into a quantile sketch of at most size centroids
+	of about equal weight (values in the same centroid are adjacent when
+	sorted). Returns centroid means and weights, padded to size with zero
+	weight (NaN mean). Sketches merge by compressing their centroids together
+	"""
+	means,weights = np.asarray(means,dtype=float),np.asarray(weights,dtype=float)
+	used = weights > 0
+	means,weights = means[used],weights[used]
+	out_means,out_weights = np.full((size,),np.nan),np.zeros((size,))
+	if len(means) <= size:
+		order = np.argsort(means,kind='mergesort')
+		out_means[:len(means)],out_weights[:len(means)] = means[order],weights[order]
+		return out_means,out_weights
+	order = np.argsort(means,kind='mergesort')
+	means,weights = means[order],weights[order]
+	cw = np.cumsum(weights)
+	group = np.minimum((size*(cw-weights/2.)/cw[-1]).astype(int),size-1)
+	out_weights = np.bincount(group,weights=weights,minlength=size)
+	with np.errstate(invalid='ignore',divide='ignore'):
+		out_means = np.bincount(group,weights=weights*means,minlength=size)/out_weights
+	return out_means,out_weights
+
+def sketch_percentiles(means,weights,vmin,vmax,q):
+	"""
+	Percentiles q of a sketch (see compress_sketch) with the exact min and max.
+	Each centroid sits at the rank of its middle value; percentiles are
+	interpolated between centroids like np.percentile, so a sketch holding
+	every value (unit weights) gives exact percentiles
+	"""
+	used = weights > 0
+	means,weights = means[used],weights[used]
+	q = np.asarray(q,dtype=float)
+	if len(means) == 0:
+		return np.full(q.shape,np.nan)
+	total = np.sum(weights)
+	if total <= 1:
+		return np.full(q.shape,means[0])
+	rank = (np.cumsum(weights)-(weights+1.)/2.)/(total-1.)*100.
+	return np.interp(q,np.concatenate([[0.],rank,[100.]]),np.concatenate([[vmin],means,[vmax]]))
+
+class omni_rollup_builder(object):
+	def __init__(self,varnames,q=(10,25,50,75,90),levels=rollup_levels,sketch_size=128):
+		"""
+		Accumulates rollups from time ordered chunks of data (see add).
+		Bins which start and end within one chunk get exact statistics.
+		A bin still being filled when a chunk ends is kept as its count,
+		sum, min, max and a quantile sketch of at most sketch_size centroids,
+		so memory does not grow with the bin length; its percentiles are
+		approximate. The sketches of the first and last bin of each level
+		are saved, so rollups built in pieces combine their shared bins.
+		"""
+		self.varnames = list(varnames)
+		self.q = list(q)
+		self.levels = list(levels)
+		self.sketch_size = sketch_size
+		self.open = {level:None for level in self.levels} #State of the bin being filled
+		self.edge_sketches = {level:dict() for level in self.levels} #bin -> (means,weights), nvars x sketch_size
+		self.summaries = {level:[] for level in self.levels}
+		self.span = None #First and last time added
+
+	def _state(self,bin,Y):
+		"""Count, sum, min, max and sketch of each variable of the samples Y of one bin"""
+		nvars = len(self.varnames)
+		state = {'bin':bin,'count':np.zeros((nvars,)),'sum':np.zeros((nvars,)),
+				'min':np.full((nvars,),np.nan),'max':np.full((nvars,),np.nan),
+				'means':np.full((nvars,self.sketch_size),np.nan),'weights':np.zeros((nvars,self.sketch_size))}
+		self._update(state,Y)
+		return state
+
+	def _update(self,state,Y):
+		for ivar in range(len(self.varnames)):
+			y = Y[:,ivar][np.isfinite(Y[:,ivar])]
+			if len(y) == 0:
+				continue
+			state['count'][ivar] += len(y)
+			state['sum'][ivar] += np.sum(y)
+			state['min'][ivar] = np.fmin(state['min'][ivar],np.min(y))
+			state['max'][ivar] = np.fmax(state['max'][ivar],np.max(y))
+			state['means'][ivar,:],state['weights'][ivar,:] = compress_sketch(
+				np.concatenate([state['means'][ivar,:],y]),
+				np.concatenate([state['weights'][ivar,:],np.ones(y.shape)]),self.sketch_size)
+
+	def _close(self,level):
+		"""Summarize the bin being filled, from its state"""
+		state = self.open[level]
+		self.open[level] = None
+		summary = {'bin':np.array([state['bin']])}
+		for ivar,var in enumerate(self.varnames):
+			count = state['count'][ivar]
+			summary[var] = {'count':np.array([count],dtype=np.int32),
+							'mean':np.array([state['sum'][ivar]/count if count > 0 else np.nan],dtype=np.float32),
+							'min':np.array([state['min'][ivar]],dtype=np.float32),
+							'max':np.array([state['max'][ivar]],dtype=np.float32),
+							'percentiles':sketch_percentiles(state['means'][ivar,:],state['weights'][ivar,:],
+									state['min'][ivar],state['max'][ivar],self.q).reshape(-1,1).astype(np.float32)}
+		self.summaries[level].append(summary)
+		if state['bin'] in self.edge_sketches[level]:
+			self.edge_sketches[level][state['bin']] = (state['means'],state['weights'])
+
+	def add(self,t,Y):
+		"""
+		Add a chunk of samples, t (seconds since 1970) and Y (len(t) x
+		number of variables). Chunks must be added in time order.
+		"""
+		t = np.asarray(t,dtype=float).flatten()
+		Y = np.asarray(Y,dtype=float).reshape(len(t),len(self.varnames))
+		if len(t) == 0:
+			return
+		first_chunk = self.span is None
+		self.span = (t[0] if first_chunk else self.span[0],t[-1])
+		for level in self.levels:
+			bins = level_bin_index(t,level)
+			if first_chunk:
+				#The first bin may be shared with an earlier piece, keep its sketch
+				self.edge_sketches[level][int(bins[0])] = None
+			if self.open[level] is not None:
+				same = bins == self.open[level]['bin']
+				self._update(self.open[level],Y[same,:])
+				if np.all(same):
+					continue
+				self._close(level)
+				t_level,Y_level,bins = t[~same],Y[~same,:],bins[~same]
+			else:
+				t_level,Y_level = t,Y
+			#The last bin may still get more data
+			last = bins == bins[-1]
+			if np.any(~last):
+				self._summarize(level,t_level[~last],Y_level[~last,:])
+			self.open[level] = self._state(int(bins[-1]),Y_level[last,:])
+
+	def finish(self):
+		"""Summarize the bins which are still being filled"""
+		for level in self.levels:
+			if self.open[level] is not None:
+				self.edge_sketches[level][self.open[level]['bin']] = None
+				self._close(level)
+
+	def _summarize(self,level,t,Y):
+		"""Exact statistics of bins which are complete in this chunk"""
+		bins,ibin = np.unique(level_bin_index(t,level),return_inverse=True)
+		nbins = len(bins)
+		summary = {'bin':bins}
+		for ivar,var in enumerate(self.varnames):
+			y = Y[:,ivar]
+			g = np.isfinite(y)
+			count = np.bincount(ibin[g],minlength=nbins)
+			with np.errstate(invalid='ignore',divide='ignore'):
+				mean = np.bincount(ibin[g],weights=y[g],minlength=nbins)/count
+			#Min and max are the 0th and 100th percentile
+			pct = omnireader.binned_percentiles(ibin[g],y[g],nbins,[0.]+self.q+[100.])
+			summary[var] = {'count':count.astype(np.int32),
+							'mean':mean.astype(np.float32),
+							'min':pct[0,:].astype(np.float32),
+							'max':pct[-1,:].astype(np.float32),
+							'percentiles':pct[1:-1,:].astype(np.float32)}
+		self.summaries[level].append(summary)
+		#Sketch of the first bin of the piece, if it is complete in the first chunk
+		for bin in self.edge_sketches[level]:
+			if self.edge_sketches[level][bin] is None and bin in bins:
+				state = self._state(bin,Y[ibin==np.searchsorted(bins,bin),:])
+				self.edge_sketches[level][bin] = (state['means'],state['weights'])
+
+	def _combine(self,old,old_sketches,new,new_sketches):
+		"""
+		Combine the bins of an existing rollup table and a new one. Bins in
+		both (a bin spanning two pieces) add counts, take the count weighted
+		mean, min of mins, max of maxes and percentiles of the merged sketches
+		"""
+		bins = np.union1d(old['bin'],new['bin'])
+		iold,inew = np.searchsorted(bins,old['bin']),np.searchsorted(bins,new['bin'])
+		nbins = len(bins)
+		out = {'bin':bins,'count':np.zeros((nbins,),dtype=np.int32),
+				'min':np.full((nbins,),np.nan,dtype=np.float32),'max':np.full((nbins,),np.nan,dtype=np.float32),
+				'percentiles':np.full((len(self.q),nbins),np.nan,dtype=np.float32)}
+		total = np.zeros((nbins,))
+		for i,table in [(iold,old),(inew,new)]:
+			out['count'][i] += table['count']
+			total[i] += np.where(table['count']>0,table['mean'].astype(float)*table['count'],0.)
+			out['min'][i] = np.fmin(out['min'][i],table['min'])
+			out['max'][i] = np.fmax(out['max'][i],table['max'])
+			out['percentiles'][:,i] = table['percentiles']
+		with np.errstate(invalid='ignore',divide='ignore'):
+			out['mean'] = (total/out['count']).astype(np.float32)
+		sketches = dict(old_sketches)
+		for bin in new_sketches:
+			if bin in sketches:
+				(m0,w0),(m1,w1) = sketches[bin],new_sketches[bin]
+				sketches[bin] = compress_sketch(np.concatenate([m0,m1]),np.concatenate([w0,w1]),self.sketch_size)
+				ibin = np.searchsorted(bins,bin)
+				out['percentiles'][:,ibin] = sketch_percentiles(sketches[bin][0],sketches[bin][1],
+												out['min'][ibin],out['max'][ibin],self.q)
+			else:
+				sketches[bin] = new_sketches[bin]
+		return out,sketches
+
+	def save(self,rollup_dir,cadence,span=None):
+		"""
+		Write one file per variable per level. If a file already exists the
+		new bins are combined with it, so an archive can be rolled up in
+		pieces in any order; bins spanning two pieces are combined (see
+		_combine). span - (start,end) seconds since 1970 this piece covers
+		(default the first to last time added). Pieces must not overlap,
+		a ValueError is raised before anything is written if they do
+		"""
+		if span is None:
+			span = (self.span[0],self.span[1]+1.) if self.span is not None else None
+		if span is None:
+			return
+		if not os.path.exists(os.path.join(rollup_dir,cadence)):
+			os.makedirs(os.path.join(rollup_dir,cadence))
+		for level in self.levels:
+			for var in self.varnames:
+				fn = rollup_filename(rollup_dir,cadence,var,level)
+				if os.path.exists(fn):
+					with np.load(fn) as old:
+						spans = old['spans'] if 'spans' in old.files else np.zeros((0,2))
+					if np.any(np.logical_and(spans[:,0]<span[1],span[0]<spans[:,1])):
+						epoch = datetime.datetime(1970,1,1)
+						raise ValueError('Rollup %s already has data between %s and %s, build into a new directory'
+							% (fn,str(epoch+datetime.timedelta(seconds=float(span[0]))),
+							str(epoch+datetime.timedelta(seconds=float(span[1])))))
+		for level in self.levels:
+			if len(self.summaries[level]) == 0:
+				continue
+			for ivar,var in enumerate(self.varnames):
+				new = {'bin':np.concatenate([summary['bin'] for summary in self.summaries[level]])}
+				for stat in ['count','mean','min','max']:
+					new[stat] = np.concatenate([summary[var][stat] for summary in self.summaries[level]])
+				new['percentiles'] = np.concatenate([summary[var]['percentiles'] for summary in self.summaries[level]],axis=1)
+				sketches = {bin:(means[ivar,:],weights[ivar,:]) for bin,(means,weights) in self.edge_sketches[level].items()}
+				spans = np.array([span],dtype=float)
+				fn = rollup_filename(rollup_dir,cadence,var,level)
+				if os.path.exists(fn):
+					with np.load(fn) as old:
+						old_sketches = dict()
+						if 'sketch_bin' in old.files:
+							old_sketches = {int(bin):(means,weights) for bin,means,weights
+											in zip(old['sketch_bin'],old['sketch_means'],old['sketch_weights'])}
+						new,sketches = self._combine(old,old_sketches,new,sketches)
+						if 'spans' in old.files:
+							spans = np.concatenate([old['spans'],spans],axis=0)
+				sketch_bins = np.array(sorted(sketches.keys()),dtype=np.int64)
+				np.savez(fn,q=np.asarray(self.q,dtype=np.float32),spans=spans,sketch_bin=sketch_bins,
+						sketch_means=np.array([sketches[bin][0] for bin in sketch_bins]).reshape(-1,self.sketch_size),
+						sketch_weights=np.array([sketches[bin][1] for bin in sketch_bins]).reshape(-1,self.sketch_size),
+						**new)
+
+def build_rollups(startdt,enddt,cadence,varnames,rollup_dir,q=(10,25,50,75,90),levels=rollup_levels,
+					cdf_or_txt='cdf',silent=True):
+	"""
+	Roll up the OMNI variables varnames between startdt and enddt,
+	reading (downloading if needed) one file at a time, and save
+	the rollups in rollup_dir (see omni_rollup to query them).
+	Rolling up an archive in pieces (e.g. a year at a time, into the
+	same rollup_dir) gives the same bins as one pass over it
+	"""
+	dwnldr = omnireader.omni_downloader(cdf_or_txt=cdf_or_txt)
+	builder = omni_rollup_builder(varnames,q=q,levels=levels)
+	for file_startdt,file_enddt in dwnldr.file_spans(startdt,enddt,cadence):
+		oi = omnireader.omni_interval(max(startdt,file_startdt),min(enddt,file_enddt),cadence,
+										silent=silent,cdf_or_txt=cdf_or_txt)
+		t = special_datetime.datetimearr2unixtime(oi['Epoch']).flatten()
+		Y = np.column_stack([oi.get_float(var) for var in varnames])
+		builder.add(t,Y)
+		oi.close()
+	builder.finish()
+	builder.save(rollup_dir,cadence,span=special_datetime.datetimearr2unixtime([startdt,enddt]).flatten())
+	return builder
+
+class omni_rollup(object):
+	def __init__(self,rollup_dir,cadence):
+		"""
+		Query rolled up OMNI statistics (see build_rollups). Files are
+		loaded on first use and kept in memory, so repeated queries
+		over any range only cost a couple of searchsorted calls.
+		"""
+		self.rollup_dir = rollup_dir
+		self.cadence = cadence
+		self.tables = dict()
+
+	def _table(self,var,level):
+		if (var,level) not in self.tables:
+			fn = rollup_filename(self.rollup_dir,self.cadence,var,level)
+			if not os.path.exists(fn):
+				raise IOError('No %s rollup of %s %s, build it with build_rollups' % (level,self.cadence,var))
+			with np.load(fn) as npz:
+				table = {key:npz[key] for key in npz.files}
+			table['start'] = level_bin_start(table['bin'],level)
+			self.tables[(var,level)] = table
+		return self.tables[(var,level)]
+
+	def choose_level(self,startdt,enddt,max_points=2000):
+		"""The finest level with at most max_points bins between startdt and enddt"""
+		span = (enddt-startdt).total_seconds()
+		for level in rollup_levels:
+			if span/level_seconds[level] <= max_points:
+				return level
+		return rollup_levels[-1]
+
+	def query(self,var,startdt,enddt,level=None,max_points=2000):
+		"""
+		Statistics of var in the bins which start between startdt and enddt
+		at level (by default the finest level with at most max_points bins).
+
+		Returns a dict with the bin start times 'Epoch', the 'level',
+		and for each bin 'count','mean','min','max' and 'percentiles'
+		(len(q) x number of bins) of percentiles 'q'
+		"""
+		if level is None:
+			level = self.choose_level(startdt,enddt,max_points=max_points)
+		table = self._table(var,level)
+		t0,t1 = special_datetime.datetimearr2unixtime([startdt,enddt]).flatten()
+		i0 = np.searchsorted(table['start'],t0,side='left')
+		i1 = np.searchsorted(table['start'],t1,side='left')
+		result = {'level':level,'q':table['q'],
+				'Epoch':(table['start'][i0:i1]*1e6).astype('datetime64[us]').astype(datetime.datetime),
+				'percentiles':table['percentiles'][:,i0:i1]}
+		for stat in ['count','mean','min','max']:
+			result[stat] = table[stat][i0:i1]
+		return result
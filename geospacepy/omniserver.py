@@ -0,0 +1,246 @@
+"""
+	omniserver.py
+	A local OMNI data service. One server process (asyncio, listening on a
+	Unix socket or a localhost TCP port) reads OMNI files once and keeps
+	their variables in memory; any number of client processes ask it for
+	(variables, time range, cadence) and get the arrays back in a compact
+	binary form, instead of each reading and holding its own copy.
+
+	Start a server with
+		python -m geospacepy.omniserver --socket /tmp/omni.sock
+	(or --port 8765), then in each worker use omni_client like an
+	omni_interval:
+		oi = omni_client(startdt,enddt,'1min',address='/tmp/omni.sock')
+		bz = oi['BZ_GSM']
+
+	Protocol: every message is a 4 byte big-endian length and a JSON header,
+	followed for responses by the raw bytes of the arrays the header lists
+	(name, dtype, shape), in order.
+"""
+import asyncio, collections, concurrent.futures, datetime, json, socket, struct, threading
+import numpy as np
+from geospacepy import omnireader, special_datetime
+
+def _pack_header(header):
+	payload = json.dumps(header).encode('utf-8')
+	return struct.pack('>I',len(payload))+payload
+
+def _pack_arrays(names,arrays):
+	"""Header and bytes of a response holding arrays"""
+	arrays = [np.ascontiguousarray(arr) for arr in arrays]
+	header = {'status':'ok','arrays':[{'name':name,'dtype':arr.dtype.str,'shape':list(arr.shape)}
+										for name,arr in zip(names,arrays)]}
+	return _pack_header(header)+b''.join(arr.tobytes() for arr in arrays)
+
+def _dt2str(dt):
+	return dt.strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+def _str2dt(s):
+	return datetime.datetime.strptime(s,'%Y-%m-%dT%H:%M:%S.%f')
+
+class omni_server(object):
+	def __init__(self,address,cdf_or_txt='cdf',max_cached_files=240):
+		"""
+		address - path of a Unix socket, or a (host,port) tuple
+		max_cached_files - least recently used files beyond this many
+			are dropped from memory
+		"""
+		self.address = address
+		self.cdf_or_txt = cdf_or_txt
+		self.max_cached_files = max_cached_files
+		self.dwnldr = omnireader.omni_downloader(cdf_or_txt=cdf_or_txt)
+		self.files = collections.OrderedDict() #(cadence,file start) -> {'oi','t','vars'}
+		self.loading = dict() #(cadence,file start) -> future of a file being read
+		#Reading files (pycdf) stays in one thread, off the event loop
+		self.reader = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+		self.loop = None
+		self.server = None
+		self.ready = threading.Event()
+		self.writers = set() #Open client connections
+
+	def _read_file(self,cadence,file_span):
+		oi = omnireader.omni_interval(file_span[0],file_span[1],cadence,silent=True,cdf_or_txt=self.cdf_or_txt)
+		t = special_datetime.datetimearr2unixtime(oi['Epoch']).flatten()
+		return {'oi':oi,'t':t,'vars':dict()}
+
+	def _read_vars(self,cached,varnames):
+		for var in varnames:
+			if var not in cached['vars']:
+				cached['vars'][var] = cached['oi'].get_float(var)
+
+	async def _file(self,cadence,file_span):
+		"""The cache entry of a file, reading it if needed (once, however many requests wait on it)"""
+		key = (cadence,file_span[0])
+		if key in self.files:
+			self.files.move_to_end(key)
+			return self.files[key]
+		if key not in self.loading:
+			self.loading[key] = self.loop.run_in_executor(self.reader,self._read_file,cadence,file_span)
+		try:
+			cached = await self.loading[key]
+		finally:
+			self.loading.pop(key,None)
+		self.files[key] = cached
+		while len(self.files) > self.max_cached_files:
+			old_key,old = self.files.popitem(last=False)
+			old['oi'].close()
+		return cached
+
+	async def get(self,cadence,startdt,enddt,varnames):
+		"""Epoch (seconds since 1970) and the variables between startdt and enddt"""
+		#Empty arrays if there are no files in the range (e.g. startdt >= enddt)
+		t,data = [np.zeros((0,))],{var:[np.zeros((0,))] for var in varnames}
+		for file_span in self.dwnldr.file_spans(startdt,enddt,cadence):
+			cached = await self._file(cadence,file_span)
+			missing = [var for var in varnames if var not in cached['vars']]
+			if len(missing) > 0:
+				await self.loop.run_in_executor(self.reader,self._read_vars,cached,missing)
+			t0,t1 = special_datetime.datetimearr2unixtime([startdt,enddt]).flatten()
+			i0,i1 = np.searchsorted(cached['t'],[t0,t1],side='left')
+			t.append(cached['t'][i0:i1])
+			for var in varnames:
+				data[var].append(cached['vars'][var][i0:i1])
+		return np.concatenate(t),[np.concatenate(data[var]) for var in varnames]
+
+	async def _handle(self,reader,writer):
+		self.writers.add(writer)
+		try:
+			while True:
+				try:
+					length = struct.unpack('>I',await reader.readexactly(4))[0]
+				except asyncio.IncompleteReadError:
+					break
+				payload = await reader.readexactly(length)
+				try:
+					#Bad requests (not JSON, missing keys) get an error response too
+					request = json.loads(payload.decode('utf-8'))
+					t,arrays = await self.get(request['cadence'],_str2dt(request['start']),
+												_str2dt(request['end']),request['vars'])
+					response = _pack_arrays(['Epoch']+request['vars'],[t]+arrays)
+				except Exception as e:
+					response = _pack_header({'status':'error','type':type(e).__name__,'message':str(e)})
+				writer.write(response)
+				await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			self.writers.discard(writer)
+			writer.close()
+
+	async def _serve(self):
+		self.loop = asyncio.get_running_loop()
+		if isinstance(self.address,str):
+			self.server = await asyncio.start_unix_server(self._handle,path=self.address)
+		else:
+			self.server = await asyncio.start_server(self._handle,host=self.address[0],port=self.address[1])
+			#Port 0 picks a free port
+			self.address = self.server.sockets[0].getsockname()[:2]
+		self.ready.set()
+		async with self.server:
+			try:
+				await self.server.serve_forever()
+			except asyncio.CancelledError:
+				pass
+
+	def serve_forever(self):
+		"""Run the server in this thread until stop is called (or interrupted)"""
+		asyncio.run(self._serve())
+		self.reader.shutdown()
+
+	def start(self):
+		"""Run the server in a background thread, returns when it is accepting connections"""
+		self.thread = threading.Thread(target=self.serve_forever,daemon=True)
+		self.thread.start()
+		self.ready.wait()
+		return self
+
+	def _close(self):
+		self.server.close()
+		for writer in list(self.writers):
+			writer.close()
+
+	def stop(self):
+		"""Stop a server started with start"""
+		if self.server is not None:
+			self.loop.call_soon_threadsafe(self._close)
+			if hasattr(self,'thread'):
+				self.thread.join()
+
+class omni_client(object):
+	def __init__(self,startdt,enddt,cadence,address):
+		"""
+		Stands in for omni_interval(startdt,enddt,cadence) in a worker,
+		getting variables from an omni_server at address (Unix socket
+		path or (host,port)). Variables are fetched on first __getitem__
+		and kept; fetch several at once with prefetch.
+		"""
+		self.startdt = startdt
+		self.enddt = enddt
+		self.cadence = cadence
+		self.address = address
+		self.data = dict()
+		self.sock = None
+
+	def _connect(self):
+		if self.sock is None:
+			if isinstance(self.address,str):
+				self.sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+			else:
+				self.sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+			self.sock.connect(self.address if isinstance(self.address,str) else tuple(self.address))
+		return self.sock
+
+	def _recvexactly(self,n):
+		buf = bytearray()
+		while len(buf) < n:
+			chunk = self.sock.recv(min(n-len(buf),1<<20))
+			if not chunk:
+				raise RuntimeError('OMNI server closed the connection')
+			buf.extend(chunk)
+		return bytes(buf)
+
+	def prefetch(self,varnames):
+		"""Fetch several variables in one request"""
+		varnames = [var for var in varnames if var not in self.data]
+		if len(varnames) == 0 and hasattr(self,'t'):
+			return
+		sock = self._connect()
+		sock.sendall(_pack_header({'cadence':self.cadence,'start':_dt2str(self.startdt),
+									'end':_dt2str(self.enddt),'vars':varnames}))
+		length = struct.unpack('>I',self._recvexactly(4))[0]
+		header = json.loads(self._recvexactly(length).decode('utf-8'))
+		if header['status'] != 'ok':
+			if header['type'] == 'KeyError':
+				raise KeyError(header['message'])
+			raise RuntimeError('OMNI server error %s: %s' % (header['type'],header['message']))
+		for spec in header['arrays']:
+			dtype = np.dtype(spec['dtype'])
+			n = int(np.prod(spec['shape']))*dtype.itemsize
+			self.data[spec['name']] = np.frombuffer(self._recvexactly(n),dtype=dtype).reshape(spec['shape'])
+		self.t = self.data.pop('Epoch')
+
+	def __getitem__(self,var):
+		if var == 'Epoch':
+			if not hasattr(self,'t'):
+				self.prefetch([])
+			return (self.t*1e6).astype('datetime64[us]').astype(datetime.datetime)
+		if var not in self.data:
+			self.prefetch([var])
+		return self.data[var]
+
+	def close(self):
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Serve OMNI data to omni_client instances')
+	parser.add_argument('--socket',help='Unix socket path to listen on')
+	parser.add_argument('--port',type=int,help='localhost TCP port to listen on')
+	parser.add_argument('--format',default='cdf',choices=['cdf','txt'])
+	args = parser.parse_args()
+	if args.socket is None and args.port is None:
+		parser.error('one of --socket or --port is required')
+	address = args.socket if args.socket is not None else ('127.0.0.1',args.port)
+	omni_server(address,cdf_or_txt=args.format).serve_forever()
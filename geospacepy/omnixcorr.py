@@ -0,0 +1,126 @@
+"""
+	omnixcorr.py
+	Lagged cross-correlation between OMNI variables (e.g. a solar wind
+	driver and a geomagnetic index), for every lag at once using FFTs.
+	Missing data are masked rather than interpolated: the correlation at
+	each lag only uses the pairs of samples where both variables are valid.
+	Correlation can also be computed in sliding windows (correlation vs.
+	lag vs. time), with the windows spread over several processes.
+"""
+import datetime
+import numpy as np
+from geospacepy import omnireader, special_datetime
+
+def _xcorr_sums(a,b,max_lag):
+	"""
+	sum_i a[...,i]*b[...,i+k] for k = -max_lag..max_lag along the last
+	axis (zero padded, so no wrap-around), returns ...x(2*max_lag+1)
+	"""
+	n = a.shape[-1]
+	nfft = int(2**np.ceil(np.log2(n+max_lag)))
+	c = np.fft.irfft(np.conj(np.fft.rfft(a,nfft))*np.fft.rfft(b,nfft),nfft)
+	#Negative lags wrap to the end
+	return np.concatenate([c[...,nfft-max_lag:],c[...,:max_lag+1]],axis=-1)
+
+def masked_xcorr(x,y,max_lag,min_pairs=2):
+	"""
+	Normalized (Pearson) cross-correlation of x and y at lags -max_lag..max_lag
+	samples, using only pairs where both are finite. Positive lags pair x[i]
+	with y[i+lag], i.e. y responding to x. Works along the last axis, so x,y
+	can be (nwindows x nsamples) to correlate many windows at once.
+
+	All six masked sums (pair counts, sums, sums of squares and the cross
+	sum) are cross-correlations of masked arrays, each one FFT product.
+	Returns r and the number of pairs at each lag; r is NaN for lags with
+	fewer than min_pairs pairs or no variance
+	"""
+	x,y = np.asarray(x,dtype=float),np.asarray(y,dtype=float)
+	mx,my = np.isfinite(x).astype(float),np.isfinite(y).astype(float)
+	#Remove the means first so the sums of squares don't lose precision
+	x0 = np.where(mx>0,x,0.)
+	y0 = np.where(my>0,y,0.)
+	with np.errstate(invalid='ignore',divide='ignore'):
+		x0 = x0-np.where(mx>0,np.sum(x0,axis=-1,keepdims=True)/np.sum(mx,axis=-1,keepdims=True),0.)
+		y0 = y0-np.where(my>0,np.sum(y0,axis=-1,keepdims=True)/np.sum(my,axis=-1,keepdims=True),0.)
+	x0,y0 = np.where(mx>0,x0,0.),np.where(my>0,y0,0.)
+
+	n = np.round(_xcorr_sums(mx,my,max_lag))
+	sx = _xcorr_sums(x0,my,max_lag)
+	sy = _xcorr_sums(mx,y0,max_lag)
+	sxx = _xcorr_sums(x0**2,my,max_lag)
+	syy = _xcorr_sums(mx,y0**2,max_lag)
+	sxy = _xcorr_sums(x0,y0,max_lag)
+	with np.errstate(invalid='ignore',divide='ignore'):
+		cov = sxy-sx*sy/n
+		varx = sxx-sx**2/n
+		vary = syy-sy**2/n
+		r = cov/np.sqrt(varx*vary)
+	bad = np.logical_or(n<max(min_pairs,2),np.logical_or(varx<=0,vary<=0))
+	r[bad] = np.nan
+	return np.clip(r,-1.,1.),n.astype(int)
+
+def _xcorr_windows_worker(args):
+	"""
+	Cross-correlation of a batch of windows starting at istarts, of the
+	(x,y) sent to the worker processes (see omnireader._run_in_pool)
+	"""
+	istarts,window,max_lag,min_pairs = args
+	x,y = omnireader._worker_data
+	iwin = np.asarray(istarts).reshape(-1,1)+np.arange(window).reshape(1,-1)
+	return masked_xcorr(x[iwin],y[iwin],max_lag,min_pairs=min_pairs)
+
+def sliding_masked_xcorr(x,y,max_lag,window,step,min_pairs=2,nprocs=None,max_elements=10000000):
+	"""
+	masked_xcorr of x and y in windows of window samples every step samples.
+	Windows are computed in batches (all windows of a batch in one set of FFTs)
+	small enough to keep temporaries under max_elements values, spread over
+	nprocs processes (nprocs=1 runs serially).
+	Returns istarts (first sample of each window), r and pair counts
+	(nwindows x 2*max_lag+1)
+	"""
+	x,y = np.asarray(x,dtype=float).flatten(),np.asarray(y,dtype=float).flatten()
+	istarts = np.arange(0,len(x)-window+1,step)
+	if len(istarts) == 0:
+		raise ValueError('Window of %d samples is longer than the data (%d samples)' % (window,len(x)))
+	batchsize = max(1,int(max_elements//(16*window)))
+	batches = [(istarts[i:i+batchsize],window,max_lag,min_pairs) for i in range(0,len(istarts),batchsize)]
+	results = omnireader._run_in_pool(_xcorr_windows_worker,(x,y),batches,nprocs=nprocs)
+	r = np.concatenate([result[0] for result in results],axis=0)
+	n = np.concatenate([result[1] for result in results],axis=0)
+	return istarts,r,n
+
+def _regular_grid(t,step):
+	"""Index of each time t on a regular grid of spacing step from t[0]"""
+	return np.round((t-t[0])/step).astype(np.int64)
+
+def omni_xcorr(oi,xvar,yvar,max_lag_mins,window_mins=None,step_mins=None,min_pairs=2,nprocs=None):
+	"""
+	Lagged cross-correlation of two variables of an omni_interval oi
+	(e.g. 'newell' and 'AL_INDEX', or 'BZ_GSM' and 'SYM_H'), lags up to
+	max_lag_mins. Positive lags mean yvar follows xvar. Missing records
+	and fill values are masked.
+
+	If window_mins is given, correlations are computed in windows of that
+	length every step_mins (default window_mins/2) minutes, in parallel.
+
+	Returns a dict with 'lags_mins', 'r' and 'npairs' (number of valid
+	pairs), which for sliding windows are (number of windows x number of
+	lags), with 'Epoch', the center of each window
+	"""
+	step = omnireader.cadence_minutes[oi.cadence]*60.
+	t = special_datetime.datetimearr2unixtime(oi['Epoch']).flatten()
+	igrid = _regular_grid(t,step)
+	x,y = np.full((igrid[-1]+1,),np.nan),np.full((igrid[-1]+1,),np.nan)
+	x[igrid],y[igrid] = oi.get_float(xvar),oi.get_float(yvar)
+	max_lag = int(round(max_lag_mins*60./step))
+	result = {'lags_mins':np.arange(-max_lag,max_lag+1)*step/60.}
+	if window_mins is None:
+		result['r'],result['npairs'] = masked_xcorr(x,y,max_lag,min_pairs=min_pairs)
+		return result
+	window = int(round(window_mins*60./step))
+	step_samples = max(1,int(round((step_mins if step_mins is not None else window_mins/2.)*60./step)))
+	istarts,result['r'],result['npairs'] = sliding_masked_xcorr(x,y,max_lag,window,step_samples,
+																min_pairs=min_pairs,nprocs=nprocs)
+	centers = t[0]+(istarts+window/2.)*step
+	result['Epoch'] = (centers*1e6).astype('datetime64[us]').astype(datetime.datetime)
+	return result
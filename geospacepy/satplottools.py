@@ -14,8 +14,6 @@ import datetime
 import logging
 import matplotlib
 from matplotlib.colors import Normalize, LogNorm
-from scipy import interpolate
-from scipy import ndimage
 log = logging.getLogger('dmsp.satplottools')
 log.setLevel(logging.DEBUG)
 
@@ -183,6 +183,27 @@ def datetimearr2jd(datetimearr):
 		jd[k,0] = datetime2jd(dt)
 	return jd
 
+def datetimearr2unixtime(datetimearr):
+	"""
+	Converts a n x 1 or 1 x n or (n,) array of python datetimes
+	to an n x 1 array of seconds since 1970-01-01 00:00 UT.
+	Unlike the other datetimearr2* functions this does not loop
+	in python, so it is suitable for very long arrays
+	"""
+	dt64 = numpy.asarray(datetimearr,dtype='datetime64[us]').flatten()
+	us = (dt64-numpy.datetime64('1970-01-01T00:00:00','us')).astype(numpy.int64)
+	return numpy.reshape(us/1.0e6,(-1,1))
+
+def unixtime2datetime(t):
+	"""
+	Converts seconds since 1970-01-01 00:00 UT to python datetimes,
+	a datetime for a scalar or a (n,) object array of datetimes for
+	an array (flattened). Vectorized, like datetimearr2unixtime
+	"""
+	if numpy.ndim(t) == 0:
+		return datetime.datetime(1970,1,1)+datetime.timedelta(seconds=float(t))
+	return (numpy.asarray(t,dtype=float).flatten()*1e6).astype('datetime64[us]').astype(datetime.datetime)
+
 def jdarr2datetime(jdarr):
 	"""
 	Converts a n x 1 or 1 x n or (n,) array of julian days
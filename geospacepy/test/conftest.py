@@ -0,0 +1,23 @@
+import pytest
+import functools
+from omnisynthetic import write_synthetic_omni_cdf
+
+@pytest.fixture
+def synthetic_omni_mirror(tmp_path,monkeypatch):
+	"""
+	An empty OMNI mirror directory which omni_downloader will read
+	from instead of the configured one. Tests write synthetic CDFs into it
+	with write_synthetic_omni_cdf, so nothing is downloaded
+	"""
+	pytest.importorskip('spacepy.pycdf')
+	from geospacepy import omnireader
+	monkeypatch.setattr(omnireader,'localdir',str(tmp_path))
+	return str(tmp_path)
+
+@pytest.fixture
+def write_omni_cdf(synthetic_omni_mirror):
+	"""
+	write_synthetic_omni_cdf with the localdir argument
+	already set to the synthetic mirror
+	"""
+	return functools.partial(write_synthetic_omni_cdf,synthetic_omni_mirror)
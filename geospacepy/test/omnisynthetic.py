@@ -0,0 +1,127 @@
+"""
+	omnisynthetic.py
+	Synthetic OMNI CDFs, with the names, time spans and layout of the
+	OMNIWeb CDFs but smooth, deterministic values, written into a local
+	mirror directory. A helper for the tests and benchmarks (it is not part
+	of the installed package), so they run without downloading (writing
+	CDFs needs spacepy).
+"""
+import datetime, os
+import numpy as np
+
+#Variables written to the synthetic high resolution CDFs,
+#(name,cdf type,fill value)
+hro_vars = [('BX_GSE','REAL4',9999.99),
+			('BY_GSM','REAL4',9999.99),
+			('BZ_GSM','REAL4',9999.99),
+			('flow_speed','REAL4',99999.9),
+			('Vx','REAL4',99999.9),
+			('proton_density','REAL4',999.99),
+			('Pressure','REAL4',99.99),
+			('Mach_num','REAL4',999.9),
+			('Mgs_mach_num','REAL4',99.9),
+			('BSN_x','REAL4',9999.99),
+			('PC_N_INDEX','REAL4',999.99),
+			('AL_INDEX','INT4',99999),
+			('SYM_H','INT4',99999)]
+
+#Variables written to the synthetic hourly CDFs
+hourly_vars = [('BX_GSE','REAL4',999.9),
+			('BY_GSM','REAL4',999.9),
+			('BZ_GSM','REAL4',999.9),
+			('V','REAL4',9999.),
+			('N','REAL4',999.9),
+			('Mach_num','REAL4',999.9),
+			('PC_N_INDEX','REAL4',999.9),
+			('F10_INDEX','REAL4',999.9),
+			('KP','INT4',99),
+			('DST','INT4',99999),
+			('AP_INDEX','INT4',999)]
+
+def synthetic_omni_values(varname,t):
+	"""
+	Smooth, deterministic, physically plausible values for
+	a variable at times t (seconds since 1970)
+	"""
+	h = t/3600.
+	values = {
+		'BX_GSE':2.*np.cos(2*np.pi*h/30.),
+		'BY_GSM':3.*np.sin(2*np.pi*h/7.),
+		'BZ_GSM':5.*np.sin(2*np.pi*h/11.)-1.,
+		'flow_speed':450.+80.*np.sin(2*np.pi*h/100.),
+		'V':450.+80.*np.sin(2*np.pi*h/100.),
+		'Vx':-(450.+80.*np.sin(2*np.pi*h/100.)),
+		'proton_density':6.+3.*np.cos(2*np.pi*h/50.),
+		'N':6.+3.*np.cos(2*np.pi*h/50.),
+		'Pressure':2.+np.cos(2*np.pi*h/50.),
+		'Mach_num':9.+2.*np.sin(2*np.pi*h/13.),
+		'Mgs_mach_num':6.+np.sin(2*np.pi*h/13.),
+		'BSN_x':13.+np.sin(2*np.pi*h/40.),
+		'PC_N_INDEX':1.+np.abs(np.sin(2*np.pi*h/9.)),
+		'F10_INDEX':100.+20.*np.sin(2*np.pi*h/(27*24.)),
+		'AL_INDEX':np.round(-200.+150.*np.sin(2*np.pi*h/5.)),
+		'SYM_H':np.round(-20.+15.*np.sin(2*np.pi*h/60.)),
+		'DST':np.round(-20.+15.*np.sin(2*np.pi*h/60.)),
+		'KP':np.round(20.+10.*np.sin(2*np.pi*h/24.)),
+		'AP_INDEX':np.round(10.+5.*np.sin(2*np.pi*h/24.)),
+	}
+	return values[varname]
+
+def write_synthetic_omni_cdf(localdir,filedt,cadence,drop=None,fill=None,modify=None):
+	"""
+	Write a CDF with the same name, time span and layout as the
+	OMNIWeb CDF for cadence containing filedt (1min/5min are monthly,
+	hourly are six-monthly) into localdir.
+
+	drop - slice or index array of records to leave out (a real data gap)
+	fill - slice or index array of records to set to the fill value
+	modify - dict of variable name: function(t,values) returning new
+		values, to put features (e.g. jumps) into the smooth data
+	"""
+	from spacepy import pycdf
+	if cadence == 'hourly':
+		month = 1 if filedt.month < 7 else 7
+		startdt = datetime.datetime(filedt.year,month,1)
+		enddt = datetime.datetime(filedt.year+1 if month==7 else filedt.year,1 if month==7 else 7,1)
+		step = datetime.timedelta(hours=1)
+		fn = 'omni2_h0_mrg1hr_%d%.2d01_v01.cdf' % (startdt.year,startdt.month)
+		cdfvars = hourly_vars
+	else:
+		startdt = datetime.datetime(filedt.year,filedt.month,1)
+		enddt = datetime.datetime(filedt.year+filedt.month//12,filedt.month%12+1,1)
+		step = datetime.timedelta(minutes=1 if cadence=='1min' else 5)
+		fn = 'omni_hro_%s_%d%.2d01_v01.cdf' % (cadence,startdt.year,startdt.month)
+		cdfvars = hro_vars
+
+	n = int((enddt-startdt).total_seconds()//step.total_seconds())
+	dt64 = np.datetime64(startdt,'s')+np.arange(n)*np.timedelta64(int(step.total_seconds()),'s')
+	keep = np.ones((n,),dtype=bool)
+	if drop is not None:
+		keep[drop] = False
+	dt64 = dt64[keep]
+	t = (dt64-np.datetime64('1970-01-01T00:00:00','s')).astype(float)
+
+	fullfn = os.path.join(localdir,fn)
+	if os.path.exists(fullfn):
+		os.remove(fullfn)
+	cdf = pycdf.CDF(fullfn,'')
+	cdf.attrs['Logical_source'] = 'synthetic_omni_%s' % (cadence)
+	cdf.new('Epoch',dt64.astype(datetime.datetime),type=pycdf.const.CDF_EPOCH)
+	cdf['Epoch'].attrs.new('FILLVAL',datetime.datetime(9999,12,31,23,59,59,999000),
+							type=pycdf.const.CDF_EPOCH)
+	for varname,cdftype,fillval in cdfvars:
+		values = synthetic_omni_values(varname,t)
+		if modify is not None and varname in modify:
+			values = modify[varname](t,values)
+		if cdftype == 'INT4':
+			dtype,fillval = np.int32,np.int32(fillval)
+		else:
+			dtype,fillval = np.float32,np.float32(fillval)
+		values = values.astype(dtype)
+		if fill is not None:
+			values[fill] = fillval
+		cdf.new(varname,values,type=getattr(pycdf.const,'CDF_'+cdftype))
+		cdf[varname].attrs['FILLVAL'] = fillval
+		cdf[varname].attrs['UNITS'] = 'synthetic'
+	cdf.close()
+	return fullfn
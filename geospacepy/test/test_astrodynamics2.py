@@ -42,5 +42,21 @@ def test_hour_angle_of_greenwich_at_noon_is_zero():
 	ha = astrodynamics2.hour_angle(dt,lons,hours=True)
 	assert (np.abs(ha)<.1)
 
+def test_package_imports_submodules_and_dependencies_lazily():
+	"""
+	Importing geospacepy, special_datetime or astrodynamics2 does not
+	import the other submodules, ephem or matplotlib
+	"""
+	import subprocess,sys
+	code = (
+		'import sys,geospacepy\n'
+		'assert [m for m in sys.modules if m.startswith("geospacepy.")] == []\n'
+		'from geospacepy import special_datetime\n'
+		'import geospacepy.astrodynamics2\n'
+		'assert geospacepy.config["omnireader"]["local_cdf_dir"]\n'
+		'print(",".join(m for m in ["ephem","matplotlib","geospacepy.omnireader"] if m in sys.modules))\n')
+	loaded = subprocess.run([sys.executable,'-c',code],capture_output=True,text=True,check=True).stdout.strip()
+	assert loaded == ''
+
 if __name__ == '__main__':
 	pytest.main()
@@ -0,0 +1,63 @@
+import pytest
+import numpy as np
+import datetime,os
+from geospacepy import omniavail, omnireader
+
+def test_validity_bitmaps_coverage_and_gaps(write_omni_cdf,synthetic_omni_mirror):
+	#Missing records in January (fill indices are after dropping them), fill values
+	#across the end of January into February
+	write_omni_cdf(datetime.datetime(2006,1,1),'5min',drop=slice(100,120),fill=slice(8880,8908))
+	write_omni_cdf(datetime.datetime(2006,2,1),'5min',fill=slice(0,12))
+	#Opening a file writes its bitmaps only if asked to
+	jan_fn = os.path.join(synthetic_omni_mirror,'omni_hro_5min_20060101_v01.cdf')
+	omnireader.omni_downloader().get_cdf(datetime.datetime(2006,1,1),'5min').close()
+	assert not os.path.exists(omniavail.bitmap_path(jan_fn))
+	omnireader.omni_downloader(build_bitmaps=True).get_cdf(datetime.datetime(2006,1,1),'5min').close()
+	assert os.path.exists(omniavail.bitmap_path(jan_fn))
+	assert [fn for fn in os.listdir(synthetic_omni_mirror) if fn.endswith('.tmp')] == []
+
+	avail = omniavail.omni_availability('5min')
+	jan1 = datetime.datetime(2006,1,1)
+	assert avail.coverage('BZ_GSM',jan1,jan1+datetime.timedelta(minutes=500)) == 1.
+	#Records 100-119 are dropped
+	assert avail.coverage('BZ_GSM',jan1,jan1+datetime.timedelta(minutes=1000)) == pytest.approx(180./200.)
+	starts = [jan1+datetime.timedelta(days=d) for d in range(59)]
+	coverage = avail.coverage('SYM_H',starts,[dt+datetime.timedelta(days=1) for dt in starts])
+	assert len(coverage) == 59
+	assert coverage[0] == pytest.approx(268./288.)
+	assert coverage[30] == pytest.approx(260./288.)
+	assert coverage[31] == pytest.approx(276./288.)
+	assert np.all(coverage[1:30] == 1.)
+
+	#The filled records in each file join up across the file boundary
+	gap_start,gap_end,gap_mins = avail.longest_gap('BZ_GSM',jan1,datetime.datetime(2006,3,1))
+	assert gap_start == jan1+datetime.timedelta(minutes=8900*5)
+	assert gap_end == datetime.datetime(2006,2,1,1)
+	assert gap_mins == 5*(28+12)
+	assert len(avail.gaps('BZ_GSM',jan1,datetime.datetime(2006,3,1))) == 2
+	assert avail.longest_gap('BZ_GSM',jan1+datetime.timedelta(days=2),jan1+datetime.timedelta(days=3)) == (None,None,0.)
+
+def test_empty_and_inverted_intervals_have_zero_coverage(write_omni_cdf):
+	write_omni_cdf(datetime.datetime(2006,1,1),'5min')
+	avail = omniavail.omni_availability('5min')
+	jan5 = datetime.datetime(2006,1,5)
+	for startdt,enddt in [(jan5,jan5),(jan5,jan5-datetime.timedelta(days=2))]:
+		t,valid = avail.valid('BZ_GSM',startdt,enddt)
+		assert len(t) == 0 and valid.dtype == bool
+		assert avail.coverage('BZ_GSM',startdt,enddt) == 0.
+		assert avail.gaps('BZ_GSM',startdt,enddt) == []
+		assert avail.longest_gap('BZ_GSM',startdt,enddt) == (None,None,0.)
+	#Empty windows among others
+	coverage = avail.coverage('BZ_GSM',[jan5,jan5],[jan5+datetime.timedelta(hours=1),jan5])
+	assert np.array_equal(coverage,[1.,0.])
+
+def test_validity_bitmaps_made_when_missing_and_mirror_read_only(write_omni_cdf,synthetic_omni_mirror,monkeypatch):
+	write_omni_cdf(datetime.datetime(2006,1,1),'5min',fill=slice(0,12))
+	def fail(*args,**kwargs):
+		raise OSError('read-only file system')
+	monkeypatch.setattr(omniavail.tempfile,'mkstemp',fail)
+	avail = omniavail.omni_availability('5min')
+	jan1 = datetime.datetime(2006,1,1)
+	#Bitmaps that can't be saved are still used
+	assert avail.coverage('BZ_GSM',jan1,jan1+datetime.timedelta(hours=2)) == pytest.approx(0.5)
+	assert not os.path.exists(omniavail.bitmap_path(os.path.join(synthetic_omni_mirror,'omni_hro_5min_20060101_v01.cdf')))
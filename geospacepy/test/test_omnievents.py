@@ -0,0 +1,108 @@
+import pytest
+import numpy as np
+import datetime
+from geospacepy import omnievents
+from omnisynthetic import synthetic_omni_values
+
+def _direct_t(startdt,enddt,step_secs=300.):
+	t0 = (startdt-datetime.datetime(1970,1,1)).total_seconds()
+	t1 = (enddt-datetime.datetime(1970,1,1)).total_seconds()
+	return np.arange(t0,t1,step_secs)
+
+def test_find_runs_and_merge_runs():
+	starts,ends = omnievents.find_runs([0,1,1,0,0,1,0,1,1,1])
+	assert np.array_equal(starts,[1,5,7])
+	assert np.array_equal(ends,[3,6,10])
+	assert np.array_equal(omnievents.merge_runs(starts,ends,1),[0,1,1])
+	assert np.array_equal(omnievents.merge_runs(starts,ends,0),[0,1,2])
+
+def test_conditions_are_parsed_not_run():
+	assert sorted(omnievents.condition_varnames('(BZ_GSM < -10) & ~(abs(BY_GSM) > 5) or window_min(SYM_H,60) < -50')) \
+		== ['BY_GSM','BZ_GSM','SYM_H']
+	for condition in ["__import__('os').system('ls')","BZ_GSM.__class__","np.abs(BZ_GSM) > 1",
+						"[BZ_GSM][0] > 1","lambda: 1","'BZ_GSM' > 1","change(SYM_H,mins=60) > 1","BZ_GSM <"]:
+		with pytest.raises(ValueError):
+			omnievents.condition_varnames(condition)
+	t = np.arange(6)*60.
+	variables = {'BZ_GSM':np.array([-12.,-3.,np.nan,-11.,-20.,0.]),'BY_GSM':np.array([1.,1.,1.,8.,1.,1.])}
+	tree = omnievents._parse_condition('-15 < BZ_GSM < -10 and not abs(BY_GSM) > 5 or BZ_GSM*2 >= 0')
+	mask = omnievents._evaluate_condition(tree,variables,omnievents._condition_functions(t))
+	assert list(mask) == [True,False,False,False,False,True]
+
+def test_window_reduce_matches_direct_windows():
+	rng = np.random.default_rng(3)
+	t = np.cumsum(rng.choice([60.,60.,60.,180.],size=500))
+	y = rng.normal(size=500)
+	y[rng.integers(0,500,size=60)] = np.nan
+	for mins in [0.,1.,7.,30.,200.]:
+		in_window = np.logical_and(t[np.newaxis,:]<=t[:,np.newaxis],t[np.newaxis,:]>=t[:,np.newaxis]-mins*60.)
+		expected_min = np.array([np.nanmin(np.where(row,y,np.nan)) if np.any(row & np.isfinite(y)) else np.nan
+									for row in in_window])
+		expected_max = np.array([np.nanmax(np.where(row,y,np.nan)) if np.any(row & np.isfinite(y)) else np.nan
+									for row in in_window])
+		np.testing.assert_array_equal(omnievents._window_reduce(np.fmin,t,y,mins),expected_min)
+		np.testing.assert_array_equal(omnievents._window_reduce(np.fmax,t,y,mins),expected_max)
+
+def test_find_events_matches_whole_array_search(write_omni_cdf):
+	startdt,enddt = datetime.datetime(2006,1,1),datetime.datetime(2006,3,1)
+	for month in [1,2]:
+		write_omni_cdf(datetime.datetime(2006,month,1),'5min')
+	events = omnievents.find_events('BZ_GSM < -4',startdt,enddt,cadence='5min',min_duration_mins=60.)
+
+	t = _direct_t(startdt,enddt)
+	bz = synthetic_omni_values('BZ_GSM',t).astype(np.float32)
+	i_starts,i_ends = omnievents.find_runs(bz < -4)
+	long_enough = (i_ends-i_starts)*5. >= 60.
+	assert len(events) == np.count_nonzero(long_enough)
+	assert np.array_equal(events.starts,t[i_starts[long_enough]])
+	assert np.array_equal(events.ends,t[i_ends[long_enough]-1]+300.)
+
+	ymdhm = events.center_ymdhm_list()
+	y,mo,d,h,m = ymdhm[0]
+	assert datetime.datetime(y,mo,d,h)+datetime.timedelta(minutes=m) == events['starts'][0]
+
+def test_find_events_empty_range(write_omni_cdf):
+	write_omni_cdf(datetime.datetime(2006,1,1),'5min')
+	for startdt,enddt in [(datetime.datetime(2006,1,5),datetime.datetime(2006,1,5)),
+							(datetime.datetime(2006,1,5),datetime.datetime(2006,1,1))]:
+		events = omnievents.find_events('BZ_GSM < -4',startdt,enddt,cadence='5min')
+		assert len(events) == 0
+		assert len(events['starts']) == 0
+
+def test_find_events_lookback_spans_file_boundary(write_omni_cdf):
+	startdt,enddt = datetime.datetime(2006,1,1),datetime.datetime(2006,3,1)
+	for month in [1,2]:
+		write_omni_cdf(datetime.datetime(2006,month,1),'5min')
+	#SYM_H (60 hour period) is rising at the start of 2006-02-01
+	events = omnievents.find_events('change(SYM_H,120) > 3',startdt,enddt,cadence='5min',lookback_mins=120.)
+
+	t = _direct_t(startdt,enddt)
+	symh = synthetic_omni_values('SYM_H',t)
+	rising = np.zeros(t.shape,dtype=bool)
+	rising[24:] = symh[24:]-symh[:-24] > 3
+	i_starts,i_ends = omnievents.find_runs(rising)
+	assert np.array_equal(events.starts,t[i_starts])
+	assert np.array_equal(events.ends,t[i_ends-1]+300.)
+
+def test_find_sudden_impulses_classifies_ssc_and_si(write_omni_cdf):
+	t_ssc = (datetime.datetime(2006,1,10,12)-datetime.datetime(1970,1,1)).total_seconds()
+	t_si = (datetime.datetime(2006,1,20,6,30)-datetime.datetime(1970,1,1)).total_seconds()
+	def symh(t,values):
+		values = values+30.*np.logical_and(t>=t_ssc,t<t_ssc+3*3600.)
+		#Main phase, then a slow recovery
+		storm = np.logical_and(t>=t_ssc+3*3600.,t<t_ssc+15*3600.)
+		values[storm] = -140.+120.*(t[storm]-t_ssc-3*3600.)/(12*3600.)
+		return values+20.*np.logical_and(t>=t_si,t<t_si+2*3600.)
+	def pressure(t,values):
+		return values*(1.+np.logical_and(t>=t_ssc,t<t_ssc+3*3600.)+np.logical_and(t>=t_si,t<t_si+2*3600.))
+	write_omni_cdf(datetime.datetime(2006,1,1),'1min',modify={'SYM_H':symh,'Pressure':pressure})
+
+	events = omnievents.find_sudden_impulses(datetime.datetime(2006,1,1),datetime.datetime(2006,2,1))
+	assert len(events) == 2
+	assert list(events['kind']) == ['SSC','SI']
+	assert np.allclose(events.starts,[t_ssc-60.,t_si-60.])
+	assert np.all(events['amplitude'] >= [28.,18.])
+	assert events['storm_min_symh'][0] <= -139.
+
+	ssc = events.select(events['kind']=='SSC')
+	assert ssc.center_ymdhm_list() == [[2006,1,10,11,59.]]
@@ -0,0 +1,91 @@
+import pytest
+import numpy as np
+import numpy.testing as nptest
+import datetime
+from geospacepy import omnifill, omnireader
+
+def test_gap_lengths_and_linear_previous_fill():
+	nan = np.nan
+	Y = np.array([[nan,1.],
+				  [1.,nan],
+				  [nan,nan],
+				  [3.,nan],
+				  [nan,5.],
+				  [nan,nan],
+				  [nan,7.],
+				  [8.,nan]])
+	nptest.assert_array_equal(omnifill.gap_lengths(Y),[[1,0],[0,3],[1,3],[0,3],[3,0],[3,1],[3,0],[0,1]])
+	filled,mask = omnifill.fill_gaps(Y,2,method='linear')
+	#Leading/trailing gaps and the 3 sample gap are not filled
+	nptest.assert_array_equal(mask[:,0],[False,False,True,False,False,False,False,False])
+	nptest.assert_array_equal(mask[:,1],[False,False,False,False,False,True,False,False])
+	assert filled[2,0] == 2. and filled[5,1] == 6.
+	assert np.all(np.isnan(filled[4:7,0]))
+	filled,mask = omnifill.fill_gaps(Y,3,method='previous')
+	nptest.assert_array_equal(filled[:,1],[1.,1.,1.,1.,5.,5.,7.,nan])
+	nptest.assert_array_equal(filled[:,0],[nan,1.,1.,3.,3.,3.,3.,8.])
+
+def test_pchip_fill_matches_local_pchip():
+	interpolate = pytest.importorskip('scipy.interpolate')
+	t = np.array([0.,1.,2.5,3.,4.,5.,6.,8.,9.])
+	y = np.sin(t)
+	y[[3,4,5]] = np.nan
+	filled,mask = omnifill.fill_gaps(y,3,method='pchip',t=t)
+	local = interpolate.PchipInterpolator(t[[1,2,6,7]],y[[1,2,6,7]])
+	nptest.assert_allclose(filled[[3,4,5]],local(t[[3,4,5]]))
+	assert mask.shape == y.shape and np.count_nonzero(mask) == 3
+	#A straight line is filled exactly
+	line = 2.*t+1.
+	line[[3,4,5]] = np.nan
+	nptest.assert_allclose(omnifill.fill_gaps(line,3,method='pchip',t=t)[0],2.*t+1.)
+
+@pytest.mark.parametrize('max_gap,max_span',[(6,None),(None,420.)],ids=['samples','span'])
+@pytest.mark.parametrize('method',omnifill.fill_methods)
+def test_gap_filler_stream_matches_batch(method,max_gap,max_span):
+	rng = np.random.default_rng(11)
+	n = 2000
+	t = np.arange(n)*60.
+	#Missing records
+	t[1000:] += 180.
+	t[1500:] += 60.
+	Y = np.cumsum(rng.normal(size=(n,3)),axis=0)
+	for icol in range(3):
+		for start in rng.integers(0,n,size=60):
+			Y[start:start+rng.integers(1,12),icol] = np.nan
+	Y[300:700,2] = np.nan
+	Y[998:1000,:] = np.nan
+	filled,mask = omnifill.fill_gaps(Y,max_gap,method=method,t=t,max_span=max_span)
+
+	filler = omnifill.gap_filler(max_gap,method=method,max_span=max_span)
+	outputs,kept = [],[]
+	i = 0
+	while i < n:
+		chunk = int(rng.integers(1,50))
+		outputs.append(filler.push(t[i:i+chunk],Y[i:i+chunk,:]))
+		kept.append(len(filler.t))
+		i += chunk
+	outputs.append(filler.flush())
+	nptest.assert_array_equal(np.concatenate([o[0] for o in outputs]),t)
+	nptest.assert_array_equal(np.concatenate([o[1] for o in outputs]),filled)
+	nptest.assert_array_equal(np.concatenate([o[2] for o in outputs]),mask)
+	#Only the open gaps and their neighbors are kept between chunks, even during the long gap
+	assert max(kept) < 50
+
+def test_fill_interval(write_omni_cdf):
+	write_omni_cdf(datetime.datetime(2006,3,1),'5min',fill=slice(1000,1003))
+	oi = omnireader.omni_interval(datetime.datetime(2006,3,3),datetime.datetime(2006,3,5),'5min',silent=True)
+	t,filled,mask = omnifill.fill_interval(oi,['BZ_GSM','SYM_H'],15.,method='linear')
+	assert np.count_nonzero(mask) == 6
+	assert not np.any(np.isnan(filled))
+	t,filled,mask = omnifill.fill_interval(oi,['BZ_GSM','SYM_H'],10.,method='linear')
+	assert np.count_nonzero(mask) == 0
+
+def test_fill_interval_counts_missing_records(write_omni_cdf):
+	#Two fill values next to five missing records are a 35 minute gap
+	write_omni_cdf(datetime.datetime(2006,3,1),'5min',drop=slice(1000,1005),fill=slice(1000,1002))
+	oi = omnireader.omni_interval(datetime.datetime(2006,3,3),datetime.datetime(2006,3,5),'5min',silent=True)
+	t,filled,mask = omnifill.fill_interval(oi,['BZ_GSM'],15.,method='linear')
+	assert np.count_nonzero(mask) == 0
+	t,filled,mask = omnifill.fill_interval(oi,['BZ_GSM'],35.,method='linear')
+	assert np.count_nonzero(mask) == 2
+	assert np.all(np.diff(t[mask[:,0]]) == 300.)
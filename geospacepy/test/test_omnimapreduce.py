@@ -0,0 +1,68 @@
+import pytest
+import numpy as np
+import numpy.testing as nptest
+import datetime
+from geospacepy import omnimapreduce, omnireader, special_datetime
+
+def _chunk_sum_count(oi,chunk_start,chunk_end):
+	bz = oi.get_float('BZ_GSM')
+	return np.array([np.nansum(bz),np.count_nonzero(np.isfinite(bz))])
+
+def _chunk_running_mean(oi,chunk_start,chunk_end):
+	"""One hour running mean of SYM_H, reported for the chunk only"""
+	t = special_datetime.datetimearr2unixtime(oi['Epoch']).flatten()
+	symh = oi.get_float('SYM_H')
+	valid = np.isfinite(symh)
+	cs = np.concatenate([[0.],np.cumsum(np.where(valid,symh,0.))])
+	cn = np.concatenate([[0],np.cumsum(valid)])
+	i0 = np.searchsorted(t,t-3600.,side='left')
+	with np.errstate(invalid='ignore',divide='ignore'):
+		mean = (cs[1:]-cs[i0])/(cn[1:]-cn[i0])
+	t0,t1 = special_datetime.datetimearr2unixtime([chunk_start,chunk_end]).flatten()
+	in_chunk = np.logical_and(t>=t0,t<t1)
+	return t[in_chunk],mean[in_chunk]
+
+def test_chunks_are_aligned_to_files():
+	chunks = omnimapreduce.omni_chunks(datetime.datetime(2006,1,15),datetime.datetime(2006,4,10),'5min')
+	assert chunks == [(datetime.datetime(2006,1,15),datetime.datetime(2006,2,1)),
+						(datetime.datetime(2006,2,1),datetime.datetime(2006,3,1)),
+						(datetime.datetime(2006,3,1),datetime.datetime(2006,4,1)),
+						(datetime.datetime(2006,4,1),datetime.datetime(2006,4,10))]
+	chunks = omnimapreduce.omni_chunks(datetime.datetime(2006,1,15),datetime.datetime(2006,4,10),'5min',files_per_chunk=2)
+	assert chunks == [(datetime.datetime(2006,1,15),datetime.datetime(2006,3,1)),
+						(datetime.datetime(2006,3,1),datetime.datetime(2006,4,10))]
+	#5 minute text files are yearly
+	chunks = omnimapreduce.omni_chunks(datetime.datetime(2005,6,15),datetime.datetime(2007,2,1),'5min',cdf_or_txt='txt')
+	assert chunks == [(datetime.datetime(2005,6,15),datetime.datetime(2006,1,1)),
+						(datetime.datetime(2006,1,1),datetime.datetime(2007,1,1)),
+						(datetime.datetime(2007,1,1),datetime.datetime(2007,2,1))]
+
+def test_map_chunks_5min_text_files_yearly(monkeypatch):
+	monkeypatch.setattr(omnimapreduce,'_map_chunk',lambda task: (task[1],task[2],task[5]))
+	results = omnimapreduce.omni_map(datetime.datetime(2005,6,15),datetime.datetime(2007,2,1),'5min',
+										_chunk_sum_count,nprocs=1,cdf_or_txt='txt')
+	assert [chunk_start for chunk_start,chunk_end,cdf_or_txt in results] == [datetime.datetime(2005,6,15),
+														datetime.datetime(2006,1,1),datetime.datetime(2007,1,1)]
+	assert all(cdf_or_txt == 'txt' for chunk_start,chunk_end,cdf_or_txt in results)
+
+def test_map_reduce_matches_whole_range(write_omni_cdf):
+	for month in [1,2,3]:
+		write_omni_cdf(datetime.datetime(2006,month,1),'5min',fill=slice(100,130))
+	startdt,enddt = datetime.datetime(2006,1,10),datetime.datetime(2006,3,20)
+	oi = omnireader.omni_interval(startdt,enddt,'5min',silent=True)
+	bz = oi.get_float('BZ_GSM')
+
+	for nprocs in [1,2]:
+		total = omnimapreduce.omni_map_reduce(startdt,enddt,'5min',_chunk_sum_count,combine=np.add,nprocs=nprocs)
+		nptest.assert_allclose(total,[np.nansum(bz),np.count_nonzero(np.isfinite(bz))])
+
+	#With a margin the windows at the start of each chunk see the previous file
+	whole_t,whole_mean = _chunk_running_mean(omnireader.omni_interval(startdt-datetime.timedelta(hours=1),enddt,'5min',silent=True),
+												startdt,enddt)
+	results = omnimapreduce.omni_map(startdt,enddt,'5min',_chunk_running_mean,margin_mins=60.,nprocs=2)
+	assert len(results) == 3
+	nptest.assert_array_equal(np.concatenate([r[0] for r in results]),whole_t)
+	nptest.assert_allclose(np.concatenate([r[1] for r in results]),whole_mean)
+
+	with pytest.raises(ValueError):
+		omnimapreduce.omni_map_reduce(enddt,startdt,'5min',_chunk_sum_count,combine=np.add)
@@ -0,0 +1,51 @@
+import pytest
+import numpy as np
+import numpy.testing as nptest
+import datetime
+from geospacepy import omnipropagate, special_datetime
+from omnisynthetic import synthetic_omni_values
+
+def test_resolve_overtaking():
+	arrival = np.array([0.,10.,25.,20.,30.,np.nan,29.,40.])
+	#25 is overtaken by 20, 30 by 29
+	nptest.assert_array_equal(omnipropagate.resolve_overtaking(arrival),[0,1,3,6,7])
+	nptest.assert_array_equal(omnipropagate.resolve_overtaking(arrival,overtaking='sort'),[0,1,3,2,6,4,7])
+
+@pytest.fixture
+def fast_stream_mirror(write_omni_cdf):
+	"""5min data with a jump to fast solar wind, so samples overtake each other far downstream"""
+	t_jump = (datetime.datetime(2006,3,31,22)-datetime.datetime(1970,1,1)).total_seconds()
+	def vx(t,values):
+		return np.where(np.logical_and(t>=t_jump,t<t_jump+6*3600.),-900.,values)
+	for month in [3,4]:
+		write_omni_cdf(datetime.datetime(2006,month,1),'5min',modify={'Vx':vx})
+	return t_jump
+
+def test_propagated_interval_previous_value(fast_stream_mirror):
+	startdt,enddt = datetime.datetime(2006,3,31,12),datetime.datetime(2006,4,1,12)
+	prop = omnipropagate.omni_interval_propagated(startdt,enddt,'5min',['BZ_GSM'],target_x_re=-50.,
+													max_lag_mins=60.)
+	assert prop['Epoch'][0] == startdt and len(prop['Epoch']) == 24*12
+	#Independent propagation of the synthetic values
+	t = prop.t[0]-3600.+np.arange(int((enddt-startdt).total_seconds()+3600.)//300)*300.
+	vx = np.where(np.logical_and(t>=fast_stream_mirror,t<fast_stream_mirror+6*3600.),-900.,
+					synthetic_omni_values('Vx',t).astype(np.float32))
+	arrival = t+(synthetic_omni_values('BSN_x',t).astype(np.float32)+50.)*6371.2/np.abs(vx)
+	assert np.any(np.diff(arrival) < 0)
+	later_min = np.minimum.accumulate(arrival[::-1])[::-1]
+	keep = arrival < np.concatenate([later_min[1:],[np.inf]])
+	arrival,bz = arrival[keep],synthetic_omni_values('BZ_GSM',t[keep]).astype(np.float32)
+	i = np.searchsorted(arrival,prop.t,side='right')-1
+	expected = np.where(prop.t-arrival[i] <= 900.,bz[i],np.nan)
+	nptest.assert_allclose(prop['BZ_GSM'],expected,rtol=1e-6)
+
+@pytest.mark.parametrize('method',['previous','linear'])
+def test_iter_propagated_matches_whole_range(fast_stream_mirror,method):
+	startdt,enddt = datetime.datetime(2006,3,28),datetime.datetime(2006,4,5)
+	prop = omnipropagate.omni_interval_propagated(startdt,enddt,'5min',['BZ_GSM','proton_density'],
+													target_x_re=-50.,max_lag_mins=60.,method=method)
+	chunks = list(omnipropagate.iter_propagated(startdt,enddt,'5min',['BZ_GSM','proton_density'],
+												target_x_re=-50.,max_lag_mins=60.,method=method))
+	assert len(chunks) == 2
+	nptest.assert_array_equal(np.concatenate([t for t,block in chunks]),prop.t)
+	nptest.assert_allclose(np.concatenate([block for t,block in chunks]),prop.block)
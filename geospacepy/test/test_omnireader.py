@@ -1,8 +1,9 @@
-from geospacepy import omnireader
+from geospacepy import omnireader, omnievents, special_datetime
 import pytest
 import numpy as np
 from numpy import testing as nptest
 import datetime,os,pkgutil
+from omnisynthetic import synthetic_omni_values
 
 @pytest.fixture(params=['hourly','5min','1min'],
 	ids=['hourly','5min','1min'])
@@ -29,8 +30,6 @@ def test_omnireader_can_download_txt():
 	assert os.path.exists(downloaded_txt)
 
 
-@pytest.mark.skipif(pkgutil.find_loader('spacepy') is None,
-                    reason="requires spacepy.pycdf, CDF reading library")
 @pytest.fixture(params=['hourly','5min','1min'],
 		ids=['hourly','5min','1min'])
 def omni_interval_txtcdf_comparison(request):
@@ -69,5 +68,488 @@ def test_omniinterval_txt_cdf_same_epoch(omni_interval_txtcdf_comparison):
 	eptxt,epcdf = oi_txt['Epoch'][0],oi_txt['Epoch'][0]
 	assert eptxt == epcdf
 
+def test_delay_smooth_matches_element_average_without_gaps(write_omni_cdf):
+	"""
+	With no gaps the time based window is the mean of the
+	avg_mins samples ending delay_mins before each time
+	"""
+	write_omni_cdf(datetime.datetime(2006,3,1),'1min')
+	dt = datetime.datetime(2006,3,14)
+	ods = omnireader.omni_interval_delay_smooth(dt,dt+datetime.timedelta(hours=6),'1min',
+												delay_mins=10,avg_mins=45)
+	bz_raw = ods.oi['BZ_GSM'].astype(float)
+	bz = ods['BZ_GSM']
+	i = np.searchsorted(ods.t,ods.t[0]+3600.)
+	nptest.assert_allclose(bz[i],np.mean(bz_raw[i-10-44:i-10+1]))
+	#The first output time at or after startdt has a complete window
+	i_start = np.searchsorted(ods.t,ods.t[0]+(10+45+1)*60.)
+	assert np.all(np.isfinite(bz[i_start:]))
+	assert np.all(np.isnan(bz[:10+45-1]))
+
+def test_delay_smooth_is_not_shifted_by_data_gaps(write_omni_cdf):
+	"""
+	Dropping records from the file (a true gap, not fill)
+	must not change the lag or window length of later samples
+	"""
+	dt = datetime.datetime(2006,3,14)
+	gap_start = int((dt-datetime.datetime(2006,3,1)).total_seconds()//60)+120
+	write_omni_cdf(datetime.datetime(2006,3,1),'1min',drop=slice(gap_start,gap_start+30))
+	ods = omnireader.omni_interval_delay_smooth(dt,dt+datetime.timedelta(hours=6),'1min',
+												delay_mins=10,avg_mins=45)
+	bz = ods['BZ_GSM']
+	t = ods.t
+	#Expected value computed directly from the synthetic signal
+	for k in [np.searchsorted(t,t[0]+5*3600.),np.searchsorted(t,t[0]+3*3600.+20*60.)]:
+		window_t = np.arange(t[k]-(10+45-1)*60.,t[k]-10*60.+1.,60.)
+		window_t = window_t[np.isin(window_t,t)]
+		expected = np.mean(synthetic_omni_values('BZ_GSM',window_t).astype(np.float32))
+		nptest.assert_allclose(bz[k],expected,rtol=1e-6)
+
+def test_realtime_delay_smooth_replay_matches_batch(write_omni_cdf):
+	"""
+	Pushing the samples of an interval (including a gap and fill values)
+	one at a time must reproduce omni_interval_delay_smooth
+	"""
+	dt = datetime.datetime(2006,3,14)
+	gap_start = int((dt-datetime.datetime(2006,3,1)).total_seconds()//60)+200
+	write_omni_cdf(datetime.datetime(2006,3,1),'1min',
+					drop=slice(gap_start,gap_start+20),fill=slice(gap_start+90,gap_start+100))
+	varnames = ['BZ_GSM','flow_speed','proton_density']
+	ods = omnireader.omni_interval_delay_smooth(dt,dt+datetime.timedelta(hours=8),'1min',
+												delay_mins=10,avg_mins=45)
+	rods = omnireader.omni_realtime_delay_smooth(varnames,delay_mins=10,avg_mins=45)
+	raw = np.column_stack([ods.oi[varname] for varname in varnames])
+	replayed = np.array([[out[varname] for varname in varnames]
+						for out in (rods.push(epoch,raw[i,:]) for i,epoch in enumerate(ods['Epoch']))])
+	for ivar,varname in enumerate(varnames):
+		nptest.assert_allclose(replayed[:,ivar],ods[varname],rtol=1e-9)
+
+def test_realtime_delay_smooth_rejects_out_of_order_samples():
+	rods = omnireader.omni_realtime_delay_smooth(['BZ_GSM'])
+	dt = datetime.datetime(2006,3,14)
+	rods.push(dt,{'BZ_GSM':1.})
+	with pytest.raises(ValueError):
+		rods.push(dt,{'BZ_GSM':2.})
+
+@pytest.fixture
+def synthetic_omni_sea(write_omni_cdf):
+	"""
+	A superposed epoch analysis of four events in
+	synthetic 5 minute data, one event has a fill value gap
+	"""
+	write_omni_cdf(datetime.datetime(2006,3,1),'5min',fill=slice(3000,3030))
+	write_omni_cdf(datetime.datetime(2006,4,1),'5min')
+	centers = [[2006,3,5,0,0],[2006,3,11,12,30],[2006,3,20,6,0],[2006,4,2,3,15]]
+	return omnireader.omni_sea(centers,name='synthetic',ndays=1,cadence='5min')
+
+def test_omni_sea_stack_linear_matches_per_event_interp(synthetic_omni_sea):
+	sea = synthetic_omni_sea
+	x = np.linspace(-.9,.9,50)
+	iy = sea.stack(['BZ_GSM','flow_speed'],x=x)
+	assert iy.shape == (sea.nevents,len(x),2)
+	for i,(event,center_jd) in enumerate(zip(sea.events,sea.center_jds)):
+		t,y = event.jd.flatten()-center_jd,event['flow_speed'].astype(float)
+		g = np.isfinite(y)
+		nptest.assert_allclose(iy[i,:,1],np.interp(x,t[g],y[g]))
+
+def test_omni_sea_stack_is_reused_by_stats_and_csv(synthetic_omni_sea,tmp_path):
+	sea = synthetic_omni_sea
+	x = np.linspace(-.9,.9,50)
+	lq,med,uq = sea.percentiles('BZ_GSM',q=[25,50,75],x=x)
+	ncached = len(sea._stack_cache)
+	sea.dump_stats('BZ_GSM',str(tmp_path),csvfn='bz.csv',x=x)
+	assert len(sea._stack_cache) == ncached
+	dumped = np.genfromtxt(os.path.join(str(tmp_path),'bz.csv'),delimiter=',')
+	nptest.assert_allclose(dumped[:,0],x,atol=1e-5)
+	nptest.assert_allclose(dumped[:,2],med,rtol=1e-5)
+
+def test_omni_sea_stack_pchip_matches_event_interpolate(synthetic_omni_sea):
+	sea = synthetic_omni_sea
+	x = np.linspace(-.5,.5,11)
+	iy = sea.stack('BZ_GSM',x=x,method='pchip')
+	nptest.assert_allclose(iy[1,:,0],sea.events[1].interpolate('BZ_GSM',x+sea.center_jds[1]))
+
+def test_p2_quantile_sketch_accuracy_against_exact_percentiles():
+	"""
+	After a couple thousand events the streaming quartiles should be within
+	a few percent of a standard deviation of np.nanpercentile, and
+	the sketch's memory must not grow with the number of events
+	"""
+	rng = np.random.RandomState(42)
+	nevents,nbins = 2000,60
+	scale = np.linspace(1.,5.,nbins)
+	data = rng.normal(size=(nevents,nbins))*scale+np.linspace(-3.,3.,nbins)
+	data[rng.rand(*data.shape)<.1] = np.nan
+	sketch = omnireader.p2_quantile_sketch(nbins,q=(25,50,75))
+	moments = omnireader.running_moments(nbins)
+	nbytes = sketch.heights.nbytes+sketch.positions.nbytes
+	for row in data:
+		sketch.add(row)
+		moments.add(row)
+	assert sketch.heights.nbytes+sketch.positions.nbytes == nbytes
+	exact = np.nanpercentile(data,[25,50,75],axis=0)
+	assert np.all(np.abs(sketch.percentiles()-exact)/scale < .05)
+	nptest.assert_allclose(moments.mean,np.nanmean(data,axis=0))
+	nptest.assert_allclose(moments.std(),np.nanstd(data,axis=0,ddof=1))
+	nptest.assert_array_equal(moments.count,np.sum(np.isfinite(data),axis=0))
+
+def test_omni_sea_stream_matches_omni_sea_for_few_events(synthetic_omni_sea):
+	"""
+	The sketches are exact for fewer than five events, so the
+	streaming and in-memory analyses must agree
+	"""
+	sea = synthetic_omni_sea
+	centers = [[2006,3,5,0,0],[2006,3,11,12,30],[2006,3,20,6,0],[2006,4,2,3,15]]
+	x = np.linspace(-.9,.9,50)
+	stream = omnireader.omni_sea_stream(['BZ_GSM','SYM_H'],ndays=1,cadence='5min',x=x)
+	stream.add_events(centers)
+	assert stream.nevents == 4
+	nptest.assert_allclose(stream.percentiles('BZ_GSM'),sea.percentiles('BZ_GSM',x=x))
+	nptest.assert_allclose(stream.mean('BZ_GSM'),np.nanmean(sea.stack('BZ_GSM',x=x)[:,:,0],axis=0))
+
+def test_omni_sea_bootstrap_is_reproducible_across_process_counts(synthetic_omni_sea):
+	sea = synthetic_omni_sea
+	x = np.linspace(-.9,.9,25)
+	serial = sea.bootstrap('BZ_GSM',x=x,nboot=200,seed=1,nprocs=1)
+	pooled = sea.bootstrap('BZ_GSM',x=x,nboot=200,seed=1,nprocs=2)
+	nptest.assert_allclose(serial['lower'],pooled['lower'])
+	nptest.assert_allclose(serial['upper'],pooled['upper'])
+	assert np.all(serial['lower'] <= serial['statistic'])
+	assert np.all(serial['statistic'] <= serial['upper'])
+	#Small chunks, so the work really is spread over the pool
+	iy = sea.stack('BZ_GSM',x=x)[:,:,0]
+	chunked = [omnireader._run_resampling(omnireader._random_epoch_worker,iy,50,100,
+					seed=3,nprocs=nprocs,max_elements=iy.size*10) for nprocs in [1,3]]
+	assert chunked[0].shape == (100,len(x))
+	nptest.assert_allclose(chunked[0],chunked[1])
+
+def test_omni_sea_random_epoch_test_feeds_plot_stats(synthetic_omni_sea):
+	import matplotlib.pyplot as pp
+	sea = synthetic_omni_sea
+	x = np.linspace(-.9,.9,25)
+	signif = sea.random_epoch_test('BZ_GSM',x=x,nrand=200,seed=2,nprocs=1)
+	assert np.all(signif['pvalue'] > 0.) and np.all(signif['pvalue'] <= 1.)
+	assert np.all(signif['null_lower'] <= signif['null_upper'])
+	boot = sea.bootstrap('BZ_GSM',x=x,nboot=50,seed=1,nprocs=1)
+	f = pp.figure()
+	sea.plot_stats(f.add_subplot(111),'BZ_GSM',x=x,bootstrap=boot,significance=signif)
+	pp.close(f)
+
+def test_binned_superposed_epoch_arbitrary_arrays_match_per_bin_numpy():
+	"""
+	A non-OMNI time series (irregular, with NaNs) binned around
+	random centers, compared with numpy applied bin by bin
+	"""
+	rng = np.random.RandomState(3)
+	t = np.sort(rng.rand(20000)*1000.)
+	y = np.sin(t)+rng.normal(size=t.shape)
+	y[::13] = np.nan
+	centers = rng.rand(30)*900.+50.
+	edges = np.linspace(-5.,5.,11)
+	result = omnireader.binned_superposed_epoch(t,y,centers,edges,q=(10,50,90))
+	t_rel = np.concatenate([t-c for c in centers])
+	y_rep = np.tile(y,len(centers))
+	for ib in range(len(edges)-1):
+		in_bin = np.logical_and(t_rel>=edges[ib],t_rel<edges[ib+1])
+		in_bin = np.logical_and(in_bin,np.isfinite(y_rep))
+		assert result['count'][ib] == np.count_nonzero(in_bin)
+		nptest.assert_allclose(result['mean'][ib],np.mean(y_rep[in_bin]))
+		nptest.assert_allclose(result['percentiles'][:,ib],np.percentile(y_rep[in_bin],[10,50,90]))
+
+def test_omni_sea_binned_stats_leaves_gaps_empty(synthetic_omni_sea):
+	"""
+	The second event has 2.5 hours of fill starting 2.5 hours before its
+	center, binning must not interpolate across it
+	"""
+	sea = synthetic_omni_sea
+	edges = np.linspace(-1.,1.,49)
+	binned = sea.binned_stats('BZ_GSM',bin_edges=edges)
+	assert binned['percentiles'].shape == (3,48)
+	n_finite = 0
+	for event,center_jd in zip(sea.events,sea.center_jds):
+		t_rel = event.jd.flatten()-center_jd
+		in_bins = np.logical_and(t_rel>=-1.,t_rel<1.)
+		n_finite += np.count_nonzero(np.isfinite(event['BZ_GSM'][in_bins]))
+	assert np.sum(binned['count']) == n_finite
+	#Hourly bins of 5 minute data from 4 events hold about 48 samples,
+	#those covering the fill are missing most of one event
+	gap_bins = np.logical_and(binned['x']>-2.5/24.,binned['x']<0.)
+	assert np.all(binned['count'][gap_bins] < 40)
+	assert np.all(binned['count'][~gap_bins] > 40)
+
+def test_batch_interpolate_methods_and_gap_masking(write_omni_cdf):
+	"""
+	Interpolate to many times in small chunks, compare to np.interp and
+	check that times in a 30 minute gap of fill are masked when the
+	tolerance is shorter than the gap
+	"""
+	dt = datetime.datetime(2006,3,14)
+	gap_start = int((dt-datetime.datetime(2006,3,1)).total_seconds()//60)+300
+	write_omni_cdf(datetime.datetime(2006,3,1),'1min',fill=slice(gap_start,gap_start+30))
+	oi = omnireader.omni_interval(dt,dt+datetime.timedelta(days=1),'1min')
+	t = special_datetime.datetimearr2unixtime(oi['Epoch']).flatten()/86400.+2440587.5
+	y = oi['BZ_GSM'].astype(float)
+	g = np.isfinite(y)
+	jd = np.linspace(t[0]-.01,t[-1]+.01,20001)
+	#Times outside the data don't raise floating point warnings
+	with np.errstate(all='raise'):
+		out = oi.batch_interpolate(['BZ_GSM','flow_speed'],jd,chunksize=777)
+	inside = np.logical_and(jd>=t[0],jd<=t[-1])
+	nptest.assert_allclose(out['BZ_GSM'][inside],np.interp(jd[inside],t[g],y[g]),rtol=1e-7)
+	assert np.all(np.isnan(out['BZ_GSM'][~inside]))
+
+	#Strictly between the last good sample before and the first after
+	in_gap = np.logical_and(jd>t[~g][0]-1./1440.,jd<t[~g][-1]+1./1440.)
+	masked = oi.batch_interpolate('BZ_GSM',jd,max_gap_mins=5.)['BZ_GSM']
+	assert np.all(np.isnan(masked[in_gap]))
+	assert np.all(np.isfinite(masked[np.logical_and(inside,~in_gap)]))
+
+	previous = oi.batch_interpolate('BZ_GSM',t[g][:100]+1e-6,method='previous')['BZ_GSM']
+	nptest.assert_allclose(previous,y[g][:100])
+	nearest = oi.batch_interpolate('BZ_GSM',t[g][1:100]-1e-6,method='nearest')['BZ_GSM']
+	nptest.assert_allclose(nearest,y[g][1:100])
+
+def test_fused_interval_picks_coarsest_adequate_source():
+	assert omnireader.omni_fused_interval.source_cadence('BZ_GSM',1.) == '1min'
+	assert omnireader.omni_fused_interval.source_cadence('BZ_GSM',10.) == '5min'
+	assert omnireader.omni_fused_interval.source_cadence('BZ_GSM',60.) == 'hourly'
+	assert omnireader.omni_fused_interval.source_cadence('F10_INDEX',1.) == 'hourly'
+	assert omnireader.omni_fused_interval.source_cadence('SYM_H',60.) == '5min'
+
+def test_fused_interval_aligns_hourly_and_high_resolution(write_omni_cdf):
+	write_omni_cdf(datetime.datetime(2006,3,1),'1min')
+	write_omni_cdf(datetime.datetime(2006,3,1),'5min')
+	write_omni_cdf(datetime.datetime(2006,1,1),'hourly')
+	dt = datetime.datetime(2006,3,14)
+	fused = omnireader.omni_fused_interval(dt,dt+datetime.timedelta(hours=6),
+											['BZ_GSM','F10_INDEX','KP'],cadence='1min')
+	assert fused.block.shape == (6*60+1,3)
+	assert fused.sources == {'BZ_GSM':'1min','F10_INDEX':'hourly','KP':'hourly'}
+	t = fused.t
+	nptest.assert_allclose(fused['BZ_GSM'],synthetic_omni_values('BZ_GSM',t).astype(np.float32))
+	#Step-hold of the hourly values
+	hour_start = np.floor(t/3600.)*3600.
+	nptest.assert_allclose(fused['F10_INDEX'],synthetic_omni_values('F10_INDEX',hour_start).astype(np.float32))
+	nptest.assert_allclose(fused['KP'],synthetic_omni_values('KP',hour_start)/10.)
+
+	#Block means of the 5 minute data on a 10 minute grid
+	coarse = omnireader.omni_fused_interval(dt,dt+datetime.timedelta(hours=6),
+											['SYM_H','BZ_GSM'],cadence=10.)
+	assert coarse.sources['BZ_GSM'] == '5min'
+	expected = (synthetic_omni_values('BZ_GSM',coarse.t).astype(np.float32)
+				+synthetic_omni_values('BZ_GSM',coarse.t+300.).astype(np.float32))/2.
+	nptest.assert_allclose(coarse['BZ_GSM'],expected,rtol=1e-6)
+
+def test_window_stats_matches_per_window_reductions(write_omni_cdf):
+	#Fill in the last hours of January, SYM_H is an integer variable
+	write_omni_cdf(datetime.datetime(2006,1,1),'5min',fill=slice(8900,8928))
+	write_omni_cdf(datetime.datetime(2006,2,1),'5min')
+	rng = np.random.default_rng(7)
+	jan1 = datetime.datetime(2006,1,1)
+	starts = [jan1+datetime.timedelta(minutes=int(m)) for m in rng.integers(0,58*1440,size=500)]
+	#Windows across the file boundary and inside the filled records
+	starts += [datetime.datetime(2006,1,31,22),datetime.datetime(2006,1,31,23,30)]
+	ends = [dt+datetime.timedelta(minutes=int(m)) for dt,m in zip(starts,rng.integers(1,180,size=len(starts)))]
+	stats = omnireader.omni_window_stats(starts,ends,['BZ_GSM','SYM_H'],cadence='5min',
+										stats=omnireader.window_stat_names)
+	assert len(stats) == len(starts)
+	assert stats['start'][0] == np.datetime64(starts[0])
+
+	fill_start = (jan1-datetime.datetime(1970,1,1)).total_seconds()+8900*300.
+	fill_end = fill_start+28*300.
+	for i,(startdt,enddt) in enumerate(zip(starts,ends)):
+		t0 = (startdt-datetime.datetime(1970,1,1)).total_seconds()
+		t1 = (enddt-datetime.datetime(1970,1,1)).total_seconds()
+		t = np.arange(np.ceil(t0/300.)*300.,t1,300.)
+		t = t[np.logical_or(t<fill_start,t>=fill_end)]
+		for var in ['BZ_GSM','SYM_H']:
+			y = synthetic_omni_values(var,t).astype(np.float32 if var=='BZ_GSM' else np.int32).astype(float)
+			assert stats[i][var+'_count'] == len(y)
+			if len(y) == 0:
+				assert np.isnan(stats[i][var+'_mean']) and np.isnan(stats[i][var+'_last'])
+				continue
+			nptest.assert_allclose([stats[i][var+'_'+stat] for stat in ['mean','median','min','max','first','last']],
+									[np.mean(y),np.median(y),np.min(y),np.max(y),y[0],y[-1]],rtol=1e-6)
+
+def test_derived_solar_wind_quantities(write_omni_cdf):
+	write_omni_cdf(datetime.datetime(2006,3,1),'5min')
+	write_omni_cdf(datetime.datetime(2006,4,1),'5min')
+	startdt,enddt = datetime.datetime(2006,3,20),datetime.datetime(2006,4,10)
+	oi = omnireader.omni_interval(startdt,enddt,'5min',silent=True)
+	t = special_datetime.datetimearr2unixtime(oi['Epoch']).flatten()
+	bx,by,bz,n,v,ms = [synthetic_omni_values(var,t).astype(np.float32).astype(float)
+						for var in ['BX_GSE','BY_GSM','BZ_GSM','proton_density','flow_speed','Mgs_mach_num']]
+	pdyn = 2.0e-6*n*v**2
+	r0 = (10.22+1.29*np.tanh(0.184*(bz+8.14)))*pdyn**(-1/6.6)
+	nptest.assert_allclose(oi['pdyn'],pdyn,rtol=1e-12)
+	nptest.assert_allclose(oi['shue_r0'],r0,rtol=1e-12)
+	nptest.assert_allclose(oi['bowshock_r0'],r0*(1+1.1*((2./3)*ms**2+2)/((8./3)*(ms**2-1))),rtol=1e-12)
+	b = np.sqrt(bx**2+by**2+bz**2)
+	nptest.assert_allclose(oi['alfven_mach'],v/(21.8*b/np.sqrt(n)),rtol=1e-3)
+	theta = np.arctan2(by,bz)
+	nptest.assert_allclose(oi['reconnection_e'],v*np.sqrt(by**2+bz**2)*np.sin(theta/2)**2/1000.,rtol=1e-12)
+	assert np.all(oi['epsilon'] >= 0.) and 10. < np.nanmax(oi['epsilon']) < 1.0e4
+	assert np.all(np.isfinite(oi['newell']))
+
+	#Small chunks and one file at a time give the same values
+	oi.computed['epsilon'].chunksize = 1000
+	oi.computed['epsilon'].varvals = None
+	epsilon = oi['epsilon']
+	chunks = [data['epsilon'] for t,data,nlookback in
+				omnievents.iter_omni_chunks(startdt,enddt,'5min',['epsilon'])]
+	nptest.assert_allclose(np.concatenate(chunks),epsilon,rtol=1e-12)
+
+def _shared_day_mean(args):
+	handle,day = args
+	shared = handle.attach()
+	t = special_datetime.datetimearr2unixtime(shared['Epoch']).flatten()
+	in_day = np.floor(t/86400.) == day
+	mean = np.nanmean(shared['BZ_GSM'][in_day])
+	shared.close()
+	return mean
+
+def test_shared_memory_export_to_process_pool(write_omni_cdf):
+	import concurrent.futures,pickle,multiprocessing
+	from multiprocessing import shared_memory
+	write_omni_cdf(datetime.datetime(2006,3,1),'5min',fill=slice(0,12))
+	oi = omnireader.omni_interval(datetime.datetime(2006,3,1),datetime.datetime(2006,3,8),'5min',silent=True)
+	handle = oi.to_shared(['BZ_GSM','SYM_H'])
+	assert len(pickle.dumps(handle)) < 1000
+
+	shared = handle.attach()
+	nptest.assert_array_equal(shared['Epoch'],oi['Epoch'])
+	nptest.assert_array_equal(shared['SYM_H'],oi.get_float('SYM_H'))
+	assert not shared['BZ_GSM'].flags.writeable
+	#Variables are views of the block, close fails while one is held
+	bz_view = shared['BZ_GSM']
+	with pytest.raises(BufferError):
+		shared.close()
+	del bz_view
+	shared.close()
+
+	t = special_datetime.datetimearr2unixtime(oi['Epoch']).flatten()
+	days = np.unique(np.floor(t/86400.))
+	#Spawned workers share this process's resource tracker
+	with concurrent.futures.ProcessPoolExecutor(max_workers=2,mp_context=multiprocessing.get_context('spawn')) as executor:
+		means = list(executor.map(_shared_day_mean,[(handle,day) for day in days]))
+	bz = oi.get_float('BZ_GSM')
+	nptest.assert_allclose(means,[np.nanmean(bz[np.floor(t/86400.)==day]) for day in days])
+
+	#Closing the interval frees the shared memory
+	oi.close()
+	with pytest.raises(FileNotFoundError):
+		shared_memory.SharedMemory(name=handle.name)
+
+def _negate(data):
+	return -data
+
+def _pickled_event_bz_mean(event):
+	return np.nanmean(event.interval.get_float('BZ_GSM'))
+
+def test_pickled_interval_event_and_sea_reopen_lazily(synthetic_omni_sea):
+	import concurrent.futures,pickle
+	oi = omnireader.omni_interval(datetime.datetime(2006,3,1),datetime.datetime(2006,3,8),'5min',silent=True)
+	data = pickle.dumps(oi)
+	assert len(data) < 2000
+	oi2 = pickle.loads(data)
+	assert 'cdfs' not in oi2.__dict__
+	nptest.assert_array_equal(oi2['Epoch'],oi['Epoch'])
+	nptest.assert_array_equal(oi2.get_float('SYM_H'),oi.get_float('SYM_H'))
+	nptest.assert_allclose(oi2['newell'],oi['newell'])
+	#An unopened interval pickles again without opening
+	oi3 = pickle.loads(pickle.dumps(pickle.loads(data)))
+	nptest.assert_array_equal(oi3['BZ_GSM'],oi['BZ_GSM'])
+	#Added transforms are kept
+	oi.add_transform('BZ_GSM',['5min'],_negate,'Flip BZ')
+	nptest.assert_array_equal(pickle.loads(pickle.dumps(oi))['BZ_GSM'],-oi3['BZ_GSM'])
+	nptest.assert_array_equal(pickle.loads(pickle.dumps(pickle.loads(pickle.dumps(oi))))['BZ_GSM'],-oi3['BZ_GSM'])
+
+	sea = synthetic_omni_sea
+	sea.stack(['BZ_GSM'])
+	sea2 = pickle.loads(pickle.dumps(sea))
+	assert len(sea2._stack_cache) == 0
+	nptest.assert_allclose(sea2.events[0].jd,sea.events[0].jd)
+	nptest.assert_allclose(sea2.stack(['BZ_GSM']),sea.stack(['BZ_GSM']))
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+		means = list(executor.map(_pickled_event_bz_mean,sea.events))
+	nptest.assert_allclose(means,[_pickled_event_bz_mean(event) for event in sea.events])
+
+def test_float32_interval_matches_float64(write_omni_cdf):
+	import pickle
+	write_omni_cdf(datetime.datetime(2006,3,1),'5min',fill=slice(0,12))
+	startdt,enddt = datetime.datetime(2006,3,1),datetime.datetime(2006,3,8)
+	oi64 = omnireader.omni_interval(startdt,enddt,'5min',silent=True,dtype=np.float64)
+	oi32 = omnireader.omni_interval(startdt,enddt,'5min',silent=True,dtype=np.float32)
+	#Integer SYM_H has fill values, so is promoted with NaN fill
+	for var in ['BZ_GSM','SYM_H']:
+		assert oi32[var].dtype == np.float32
+		assert oi32.get_float(var).dtype == np.float32
+		assert np.all(np.isnan(oi32[var][:12]))
+		nptest.assert_allclose(oi32.get_float(var),oi64.get_float(var),rtol=1e-6)
+	#Every derived variable is computed in the interval's float dtype
+	for var in omnireader.derived_vars:
+		assert oi32[var].dtype == np.float32
+		assert oi64[var].dtype == np.float64
+	for var in ['pdyn','shue_r0','epsilon']:
+		assert oi32[var].dtype == np.float32
+		assert oi64[var].dtype == np.float64
+		nptest.assert_allclose(oi32[var],oi64[var],rtol=1e-5,atol=1e-6)
+	assert pickle.loads(pickle.dumps(oi32))['BZ_GSM'].dtype == np.float32
+
+def test_validate_masks_fill_and_out_of_range_once_per_file(write_omni_cdf):
+	from spacepy import pycdf
+	spikes = [50,400,3000]
+	def add_spikes(t,values):
+		values = values.copy()
+		values[spikes] = 5000.
+		return values
+	for month in [3,4]:
+		fn = write_omni_cdf(datetime.datetime(2006,month,1),'5min',fill=slice(0,12),
+							modify={'BZ_GSM':add_spikes,'SYM_H':add_spikes})
+		with pycdf.CDF(fn) as cdf:
+			cdf.readonly(False)
+			for var in ['BZ_GSM','SYM_H']:
+				cdf[var].attrs.new('VALIDMIN',-1000,type=cdf[var].type())
+				cdf[var].attrs.new('VALIDMAX',1000,type=cdf[var].type())
+	startdt,enddt = datetime.datetime(2006,3,1),datetime.datetime(2006,4,15)
+	oi = omnireader.omni_interval(startdt,enddt,'5min',silent=True)
+	oiv = omnireader.omni_interval(startdt,enddt,'5min',silent=True,validate=True)
+	n_march = 31*288
+	invalid = np.zeros((len(oi['Epoch']),),dtype=bool)
+	invalid[np.r_[0:12,n_march:n_march+12,spikes,n_march+np.array(spikes)]] = True
+	for var in ['BZ_GSM','SYM_H']:
+		assert np.nanmax(oi.get_float(var)) == 5000.
+		bz = oiv[var]
+		assert bz.dtype.kind == 'f'
+		nptest.assert_array_equal(np.isnan(bz),invalid)
+		masked = oiv.get_masked(var)
+		nptest.assert_array_equal(masked.mask,invalid)
+		nptest.assert_array_equal(masked.compressed(),oi.get_float(var)[~invalid])
+	#One mask per file and variable, reused on later reads
+	assert sorted(oiv.valid_masks.keys()) == [(0,'BZ_GSM'),(0,'SYM_H'),(1,'BZ_GSM'),(1,'SYM_H')]
+	mask = oiv.valid_masks[(0,'BZ_GSM')]
+	oiv['BZ_GSM']
+	assert oiv.valid_masks[(0,'BZ_GSM')] is mask
+	assert np.all(np.isfinite(oiv['pdyn'][~invalid]))
+
+def test_validate_does_not_modify_the_read_array(write_omni_cdf,monkeypatch):
+	write_omni_cdf(datetime.datetime(2006,3,1),'5min',fill=slice(0,12))
+	oiv = omnireader.omni_interval(datetime.datetime(2006,3,1),datetime.datetime(2006,3,2),'5min',
+									silent=True,validate=True)
+	#Like the txt mimic, _read hands back the same array every time
+	cached = oiv._read('BZ_GSM',with_valid=True)
+	original = cached[0].copy()
+	monkeypatch.setattr(oiv,'_read',lambda cdfvar,with_valid=False: cached)
+	assert np.all(np.isnan(oiv['BZ_GSM'][:12]))
+	nptest.assert_array_equal(cached[0],original)
+
+def test_import_does_not_load_heavy_modules():
+	import subprocess,sys
+	heavy = ['matplotlib','scipy','spacepy','ftplib','geospacepy.omnitxtcdf']
+	code = 'import sys,geospacepy.omnireader; print(",".join(m for m in %r if m in sys.modules))' % (heavy,)
+	loaded = subprocess.run([sys.executable,'-c',code],capture_output=True,text=True,check=True).stdout.strip()
+	assert loaded == ''
+
 if __name__ == '__main__':
 	pytest.main()
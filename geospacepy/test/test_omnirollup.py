@@ -0,0 +1,92 @@
+import pytest
+import numpy as np
+import datetime,os
+from geospacepy import omnirollup
+from omnisynthetic import synthetic_omni_values
+
+def _direct_stats(varname,startdt,enddt,binsecs,step_secs=300.):
+	t0 = (startdt-datetime.datetime(1970,1,1)).total_seconds()
+	t1 = (enddt-datetime.datetime(1970,1,1)).total_seconds()
+	t = np.arange(t0,t1,step_secs)
+	y = synthetic_omni_values(varname,t).astype(np.float32).astype(float)
+	y = y.reshape(-1,int(binsecs//step_secs))
+	return y.mean(axis=1),y.min(axis=1),y.max(axis=1),np.percentile(y,50,axis=1)
+
+def test_omnirollup_matches_direct_aggregation(write_omni_cdf,synthetic_omni_mirror):
+	startdt,enddt = datetime.datetime(2006,1,1),datetime.datetime(2006,3,1)
+	for month in [1,2]:
+		write_omni_cdf(datetime.datetime(2006,month,1),'5min')
+	rollup_dir = os.path.join(synthetic_omni_mirror,'rollups')
+	omnirollup.build_rollups(startdt,enddt,'5min',['BZ_GSM','SYM_H'],rollup_dir,q=(25,50,75))
+
+	rollup = omnirollup.omni_rollup(rollup_dir,'5min')
+	for level,binsecs in [('hourly',3600.),('daily',86400.)]:
+		result = rollup.query('BZ_GSM',startdt,enddt,level=level)
+		mean,mn,mx,med = _direct_stats('BZ_GSM',startdt,enddt,binsecs)
+		assert result['Epoch'][0] == startdt
+		assert len(result['mean']) == len(mean)
+		assert np.all(result['count'] == int(binsecs//300))
+		assert np.allclose(result['mean'],mean,atol=1e-4)
+		assert np.allclose(result['min'],mn)
+		assert np.allclose(result['max'],mx)
+		assert np.allclose(result['percentiles'][1,:],med,atol=1e-4)
+
+	#Two months are one yearly bin and parts of three Bartels rotations
+	yearly = rollup.query('SYM_H',startdt,enddt,level='yearly')
+	assert yearly['Epoch'][0] == datetime.datetime(2006,1,1)
+	assert yearly['count'][0] == 59*288
+	bartels = rollup.query('SYM_H',datetime.datetime(2005,12,1),enddt,level='bartels')
+	assert np.sum(bartels['count']) == 59*288
+
+	#Automatic level selection
+	assert rollup.query('BZ_GSM',startdt,startdt+datetime.timedelta(days=2))['level'] == 'hourly'
+	assert rollup.query('BZ_GSM',startdt,enddt,max_points=100)['level'] == 'daily'
+
+def test_omnirollup_built_in_pieces_matches_one_pass(write_omni_cdf,synthetic_omni_mirror):
+	for filedt in [datetime.datetime(2005,12,1),datetime.datetime(2006,1,1),datetime.datetime(2006,2,1)]:
+		write_omni_cdf(filedt,'5min')
+	#Pieces split inside an hour, a day, a Bartels rotation and across a year
+	startdt,middt,enddt = datetime.datetime(2005,12,10),datetime.datetime(2006,1,15,12,37),datetime.datetime(2006,3,1)
+	one_pass = os.path.join(synthetic_omni_mirror,'one_pass')
+	pieces = os.path.join(synthetic_omni_mirror,'pieces')
+	omnirollup.build_rollups(startdt,enddt,'5min',['BY_GSM'],one_pass)
+	#Pieces can be built in any order
+	omnirollup.build_rollups(middt,enddt,'5min',['BY_GSM'],pieces)
+	omnirollup.build_rollups(startdt,middt,'5min',['BY_GSM'],pieces)
+	with pytest.raises(ValueError):
+		omnirollup.build_rollups(datetime.datetime(2006,2,1),enddt,'5min',['BY_GSM'],pieces)
+
+	t0 = (startdt-datetime.datetime(1970,1,1)).total_seconds()
+	t1 = (enddt-datetime.datetime(1970,1,1)).total_seconds()
+	t = np.arange(t0,t1,300.)
+	y = synthetic_omni_values('BY_GSM',t).astype(np.float32).astype(float)
+	for level in omnirollup.rollup_levels:
+		a = omnirollup.omni_rollup(one_pass,'5min').query('BY_GSM',datetime.datetime(2005,1,1),enddt,level=level)
+		b = omnirollup.omni_rollup(pieces,'5min').query('BY_GSM',datetime.datetime(2005,1,1),enddt,level=level)
+		bins = omnirollup.level_bin_index(t,level)
+		assert np.array_equal(b['count'],np.unique(bins,return_counts=True)[1])
+		assert np.array_equal(a['count'],b['count'])
+		assert np.allclose(a['mean'],b['mean'],atol=1e-4)
+		assert np.array_equal(a['min'],b['min'])
+		assert np.array_equal(a['max'],b['max'])
+		#Percentiles of bins held in sketches are approximate
+		exact = np.array([np.percentile(y[bins==bin],[10,25,50,75,90]) for bin in np.unique(bins)]).T
+		tolerance = 0.02*(np.max(y)-np.min(y))
+		assert np.allclose(a['percentiles'],exact,atol=tolerance)
+		assert np.allclose(b['percentiles'],exact,atol=tolerance)
+	#Bins split between the pieces are combined, not replaced
+	daily = omnirollup.omni_rollup(pieces,'5min').query('BY_GSM',datetime.datetime(2006,1,15),datetime.datetime(2006,1,16),level='daily')
+	assert daily['count'][0] == 288
+
+def test_sketch_percentiles_exact_for_few_values_and_bounded():
+	rng = np.random.default_rng(0)
+	y = rng.normal(size=50)
+	means,weights = omnirollup.compress_sketch(y,np.ones(y.shape),128)
+	assert np.allclose(omnirollup.sketch_percentiles(means,weights,y.min(),y.max(),[0,10,50,90,100]),
+						np.percentile(y,[0,10,50,90,100]))
+	y = rng.normal(size=100000)
+	means,weights = omnirollup.compress_sketch(y[:50000],np.ones((50000,)),128)
+	means,weights = omnirollup.compress_sketch(np.concatenate([means,y[50000:]]),np.concatenate([weights,np.ones((50000,))]),128)
+	assert len(means) == 128 and np.sum(weights) == 100000
+	assert np.allclose(omnirollup.sketch_percentiles(means,weights,y.min(),y.max(),[10,50,90]),
+						np.percentile(y,[10,50,90]),atol=0.02)
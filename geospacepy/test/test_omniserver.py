@@ -0,0 +1,75 @@
+import pytest
+import numpy as np
+import numpy.testing as nptest
+import datetime,os,socket,struct,json
+from geospacepy import omniserver, omnireader
+
+@pytest.fixture(params=['unix','tcp'])
+def running_server(request,write_omni_cdf,synthetic_omni_mirror):
+	write_omni_cdf(datetime.datetime(2006,3,1),'5min',fill=slice(100,110))
+	write_omni_cdf(datetime.datetime(2006,4,1),'5min')
+	if request.param == 'unix':
+		address = os.path.join(synthetic_omni_mirror,'omni.sock')
+	else:
+		address = ('127.0.0.1',0)
+	server = omniserver.omni_server(address)
+	reads = []
+	read_file = server._read_file
+	def counting_read_file(cadence,file_span):
+		reads.append(file_span[0])
+		return read_file(cadence,file_span)
+	server._read_file = counting_read_file
+	server.start()
+	yield server,reads
+	server.stop()
+
+def test_clients_match_omni_interval_and_share_reads(running_server):
+	server,reads = running_server
+	startdt,enddt = datetime.datetime(2006,3,30),datetime.datetime(2006,4,2)
+	oi = omnireader.omni_interval(startdt,enddt,'5min',silent=True)
+	clients = [omniserver.omni_client(startdt,enddt,'5min',server.address) for i in range(3)]
+	for client in clients:
+		nptest.assert_allclose(client['BZ_GSM'],oi.get_float('BZ_GSM'))
+		nptest.assert_array_equal(client['Epoch'],oi['Epoch'])
+		client.prefetch(['SYM_H','newell'])
+		nptest.assert_allclose(client['SYM_H'],oi.get_float('SYM_H'))
+		nptest.assert_allclose(client['newell'],oi['newell'])
+	#Each file is read once for all clients
+	assert sorted(reads) == [datetime.datetime(2006,3,1),datetime.datetime(2006,4,1)]
+	early = omniserver.omni_client(datetime.datetime(2006,3,1),datetime.datetime(2006,3,2),'5min',server.address)
+	assert np.count_nonzero(np.isnan(early['BZ_GSM'])) == 10
+	with pytest.raises(KeyError):
+		early['NOT_A_VARIABLE']
+	for client in clients+[early]:
+		client.close()
+
+def _send_raw(address,payload):
+	"""Send one request payload and return the decoded response header"""
+	sock = socket.socket(socket.AF_UNIX if isinstance(address,str) else socket.AF_INET,socket.SOCK_STREAM)
+	sock.connect(address if isinstance(address,str) else tuple(address))
+	sock.sendall(struct.pack('>I',len(payload))+payload)
+	f = sock.makefile('rb')
+	length = struct.unpack('>I',f.read(4))[0]
+	header = json.loads(f.read(length).decode('utf-8'))
+	f.close()
+	sock.close()
+	return header
+
+def test_bad_requests_get_error_responses(running_server):
+	server,reads = running_server
+	for payload in [b'\xff\xfenot json',b'{"cadence":',json.dumps({'cadence':'5min'}).encode('utf-8'),b'[1,2]']:
+		header = _send_raw(server.address,payload)
+		assert header['status'] == 'error'
+	#The server still answers good requests
+	client = omniserver.omni_client(datetime.datetime(2006,3,1),datetime.datetime(2006,3,2),'5min',server.address)
+	assert len(client['BZ_GSM']) == 288
+	client.close()
+
+def test_empty_range_gives_empty_arrays(running_server):
+	server,reads = running_server
+	for startdt,enddt in [(datetime.datetime(2006,3,2),datetime.datetime(2006,3,2)),
+							(datetime.datetime(2006,3,2),datetime.datetime(2006,3,1))]:
+		client = omniserver.omni_client(startdt,enddt,'5min',server.address)
+		assert len(client['BZ_GSM']) == 0
+		assert len(client['Epoch']) == 0
+		client.close()
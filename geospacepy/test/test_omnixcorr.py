@@ -0,0 +1,46 @@
+import pytest
+import numpy as np
+import numpy.testing as nptest
+import datetime
+from geospacepy import omnixcorr, omnireader
+
+@pytest.fixture
+def gappy_pair():
+	rng = np.random.default_rng(3)
+	x = np.cumsum(rng.normal(size=3000))
+	#y follows x 7 samples later
+	y = np.concatenate([np.zeros(7),x[:-7]])+rng.normal(scale=.5,size=3000)
+	x[rng.integers(0,3000,size=300)] = np.nan
+	y[500:620] = np.nan
+	return x,y
+
+def test_masked_xcorr_matches_pairwise_corrcoef(gappy_pair):
+	x,y = gappy_pair
+	r,n = omnixcorr.masked_xcorr(x,y,20)
+	lags = np.arange(-20,21)
+	for lag in [-20,-3,0,7,15]:
+		if lag >= 0:
+			a,b = x[:len(x)-lag],y[lag:]
+		else:
+			a,b = x[-lag:],y[:len(y)+lag]
+		g = np.isfinite(a) & np.isfinite(b)
+		assert n[lags==lag][0] == np.count_nonzero(g)
+		nptest.assert_allclose(r[lags==lag][0],np.corrcoef(a[g],b[g])[0,1],rtol=1e-8)
+	assert lags[np.argmax(r)] == 7
+
+def test_sliding_masked_xcorr_parallel_matches_serial(gappy_pair):
+	x,y = gappy_pair
+	istarts,r1,n1 = omnixcorr.sliding_masked_xcorr(x,y,10,400,150,nprocs=1,max_elements=20000)
+	istarts,r2,n2 = omnixcorr.sliding_masked_xcorr(x,y,10,400,150,nprocs=2,max_elements=20000)
+	nptest.assert_array_equal(r1,r2)
+	nptest.assert_array_equal(n1,n2)
+	r,n = omnixcorr.masked_xcorr(x[istarts[3]:istarts[3]+400],y[istarts[3]:istarts[3]+400],10)
+	nptest.assert_allclose(r1[3,:],r,rtol=1e-10)
+
+def test_omni_xcorr_sliding_windows(write_omni_cdf):
+	write_omni_cdf(datetime.datetime(2006,3,1),'5min',fill=slice(1000,1100))
+	oi = omnireader.omni_interval(datetime.datetime(2006,3,2),datetime.datetime(2006,3,12),'5min',silent=True)
+	result = omnixcorr.omni_xcorr(oi,'BZ_GSM','BZ_GSM',60.,window_mins=2*1440.,step_mins=1440.,nprocs=1)
+	assert result['r'].shape == (9,25)
+	nptest.assert_allclose(result['r'][:,12],1.)
+	assert result['Epoch'][0] == datetime.datetime(2006,3,3)